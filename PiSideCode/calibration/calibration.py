@@ -142,7 +142,12 @@ class Calibrator:
         reduction_factor: int=0.3,
     ) -> tuple[np.ndarray, bool, str]:
         # Convert it to gray and look for calibration board
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if img.ndim == 2:
+            # Gray capture, only need color for drawing
+            gray = img
+            img = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+        else:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         self.img_shape = gray.shape[::-1]
         
         # if not self.expect_board:
@@ -1,18 +1,29 @@
 import cv2
-from camera.camera_config import write_config, parse_config, is_disabled
-from camera.camera_info import Modes
+from camera.camera_config import write_config, parse_config, is_disabled, get_backend
+from camera.camera_info import Modes, Backends, EXTRINSICS
+from processing.tag_detectors import Detectors
+from processing.detection_mask import load_detection_mask
 from calibration.calibration import Calibrator
 import os
 import time
 from sys import platform
 import logging
 from camera.camera_info import CameraInfo
+from camera.frame_ring import FrameRing
+from camera.v4l2_capture import V4L2Capture
+from camera.device_watcher import DeviceWatcher
+from camera.replay_camera import (
+    ReplayCamera,
+    ReplayCameraInfo,
+    ReplayPace,
+    list_replay_sources,
+)
+from camera import gray_capture
 from pathlib import Path
 from directory import V4L_PATH, full_cam_path, calibration_path_by_cam, cam_config_path
 import json
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor
-from threading import Thread, Lock
+from threading import Thread, Condition, Lock, current_thread
 import eventlet
 import sys
 
@@ -21,23 +32,69 @@ import sys
 class Cameras:
     logger = logging.getLogger(__name__)
 
-    def __init__(self):
+    # Longest a consumer waits for a new frame before reusing the last one
+    FRAME_TIMEOUT = 0.5
+    # Pause between reads while a camera is failing or recovering
+    RETRY_DELAY = 0.05
+    # Longest the supervisor waits between rescans of V4L_PATH when nothing
+    # changed
+    SCAN_INTERVAL = 1.0
+    # A camera without frames for this long is closed and opened from scratch
+    REENUMERATE_TIMEOUT = 5.0
+
+    # replay_path plays back recorded frames instead of opening real cameras
+    def __init__(
+        self,
+        replay_path: str | None = None,
+        replay_pace: ReplayPace = ReplayPace.RECORDED,
+    ):
         # Cameras identified by their path (or whatever unique identifier is
         # available)
+        # Replaced, never modified in place, when cameras come and go so it
+        # is always safe to iterate
         self.info: dict[str, CameraInfo] = {}
 
-        self.frames: list[dict[str, np.ndarray]] = [{}, {}]
-        self.connections: list[dict[str, bool]] = [{}, {}]
-        self.timestamp: list[dict[str, float]] = [{}, {}]
-        self.cam_read_delay: list[dict[str, float]] = [{}, {}]
-
-        self.executor: ThreadPoolExecutor = ThreadPoolExecutor()
-        self.new_data_lock: Lock = Lock()
-        self.new_data_index: int = 0
-        self.written_index: int = 1
-        self.fresh_data: list[bool] = [False, False]
-
-        if platform == "linux" or platform == "linux2":
+        # Publisher index per camera, kept when a camera goes away so it gets
+        # the same index if it comes back
+        self.index: dict[str, int] = {}
+
+        # Capture thread currently owning each camera
+        self.capture_threads: dict[str, Thread] = {}
+        # Capture threads of removed cameras that have not let go yet
+        self.stopping_threads: dict[str, Thread] = {}
+        # Cameras the supervisor should leave alone (disabled or duplicates)
+        self.skipped: set[str] = set()
+        # Cameras that failed to open, only logged the first time
+        self.failed: set[str] = set()
+        self.last_frame_time: dict[str, float] = {}
+        self.camera_lock = Lock()
+
+        # How long the last reopen of each camera took (ms), from release
+        # to ready to read
+        self.recovery_time: dict[str, float] = {}
+
+        # Preallocated frame buffers per camera, each written by its own
+        # capture loop
+        self.rings: dict[str, FrameRing] = {}
+        self.connections: dict[str, bool] = {}
+        self.timestamp: dict[str, float] = {}
+        self.cam_read_delay: dict[str, float] = {}
+        self.sequence: dict[str, int] = {}
+
+        # Sequence numbers last handed out, so consumers only see new frames
+        self.processed_sequence: dict[str, int] = {}
+        self.displayed_sequence: dict[str, int] = {}
+
+        # Ring slots currently lent out to the main loop
+        self.processing_checkouts: dict[str, int | None] = {}
+        self.display_checkouts: dict[str, int | None] = {}
+
+        self.new_frame_condition: Condition = Condition()
+
+        if replay_path is not None:
+            self._open_replays(replay_path, replay_pace)
+
+        elif platform == "linux" or platform == "linux2":
             Cameras.logger.info("Platform is linux")
 
             # Automatically detect cameras
@@ -49,84 +106,290 @@ class Cameras:
 
             # Try all cameras found by the PI
             for identifier in sorted(camera_paths):
-                if is_disabled(identifier):
-                    Cameras.logger.info(f"Skipping {identifier} - DISABLED")
+                if self._should_open(identifier):
+                    self._add_camera(identifier, attempts=3)
+
+            # Pick up cameras plugged in (or back) later
+            Thread(target=self._supervise, daemon=True).start()
+
+        else:
+            Cameras.logger.error("Unsupported platform!")
+
+    # Other by-path names of a camera already listed
+    @staticmethod
+    def is_duplicate(identifier: str) -> bool:
+        return "-usbv2-" in identifier or "-usbv3-" in identifier
+
+    # Cameras a new Cameras would try to open, found without opening them or
+    # starting any thread (see VisionWorker)
+    @staticmethod
+    def find_identifiers(replay_path: str | None = None) -> list[str]:
+        try:
+            if replay_path is not None:
+                return [
+                    os.path.basename(source)
+                    for source in list_replay_sources(replay_path)
+                ]
+
+            if platform != "linux" and platform != "linux2":
+                return []
+
+            return [
+                identifier
+                for identifier in sorted(os.listdir(V4L_PATH))
+                if not Cameras.is_duplicate(identifier) and not is_disabled(identifier)
+            ]
+
+        except FileNotFoundError:
+            return []
+
+    def _should_open(self, identifier: str) -> bool:
+        if identifier in self.skipped:
+            return False
+
+        if is_disabled(identifier):
+            Cameras.logger.info(f"Skipping {identifier} - DISABLED")
+            self.skipped.add(identifier)
+            return False
+
+        if Cameras.is_duplicate(identifier):
+            Cameras.logger.info(f"Skipping {identifier} - DUPLICATE")
+            self.skipped.add(identifier)
+            return False
+
+        return True
+
+    def _add_camera(self, identifier: str, attempts: int = 1) -> bool:
+        backend = get_backend(identifier)
+
+        for attempt in range(attempts):
+            # Open camera and check if it is opened
+            cam = Cameras.open_capture(identifier, backend)
+
+            if cam.isOpened():
+                Cameras.logger.info(f"Camera found: {identifier} ({backend.value})")
+
+                try:
+                    # Initialize CameraInfo object
+                    cam_info = CameraInfo(cam, identifier, backend=backend)
+                except Exception as e:
+                    Cameras.logger.error(f"Failed to read {identifier}: {e}")
+                    cam.release()
                     continue
 
-                if "-usbv2-" in identifier or "-usbv3-" in identifier:
-                    Cameras.logger.info(f"Skipping {identifier} - DUPLICATE")
-                    continue        
+                # Attempt to import config from file
+                self.import_config(identifier, cam_info)
+
+                # Disable buffer so we always pull the latest image
+                cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+                # Try to disable auto exposure
+                if cam.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1):
+                    Cameras.logger.info(f"Auto exposure disabled for {identifier}")
+                else:
+                    Cameras.logger.warning(
+                        f"Failed to disable auto exposure for {identifier}"
+                    )
 
-                path = full_cam_path(identifier)
+                self.failed.discard(identifier)
+                self._start_capture(identifier, cam_info)
+                return True
 
-                for attempt in range(3):
-                    # Open camera and check if it is opened
-                    cam = cv2.VideoCapture(path, cv2.CAP_V4L2)
+            cam.release()
 
-                    # time.sleep(10)
+            if identifier not in self.failed or attempts > 1:
+                Cameras.logger.warning(f"Failed to open camera (attempt {attempt + 1}): for {identifier}")
+            if attempt + 1 < attempts:
+                eventlet.sleep(0.2)
 
-                    if cam.isOpened():
-                        Cameras.logger.info(f"Camera found: {identifier}")
+        self.failed.add(identifier)
+        return False
 
-                        # Initialize CameraInfo object
-                        self.info[identifier] = CameraInfo(cam, identifier)
+    # Stop using a camera, its capture thread lets go of the device once it
+    # finishes the read it may be in
+    def _remove_camera(self, identifier: str):
+        with self.camera_lock:
+            if identifier not in self.info:
+                return
 
-                        # Attempt to import config from file
-                        self.import_config(identifier)
+            info = dict(self.info)
+            del info[identifier]
+            self.info = info
 
-                        # Save configs
-                        eventlet.sleep(0.1)
+            thread = self.capture_threads.pop(identifier, None)
+            if thread is not None:
+                self.stopping_threads[identifier] = thread
 
-                        # write_config(identifier, self.info[identifier])
+        self.rings[identifier].clear()
+        self._publish_frame(identifier, False, 0.0, 0.0)
 
-                        # Disable buffer so we always pull the latest image
-                        cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    def _supervise(self):
+        watcher = DeviceWatcher(V4L_PATH)
 
-                        # Try to disable auto exposure
-                        if cam.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1):
-                            Cameras.logger.info(f"Auto exposure disabled for {identifier}")
-                        else:
-                            Cameras.logger.warning(
-                                f"Failed to disable auto exposure for {identifier}"
-                            )
-                        break
+        while True:
+            watcher.wait(Cameras.SCAN_INTERVAL)
 
-                    else:
-                        cam.release()
+            try:
+                self._scan()
+            except Exception as e:
+                Cameras.logger.error("Camera supervisor failed", exc_info=e)
 
-                        Cameras.logger.warning(f"Failed to open camera (attempt {attempt + 1}): for {identifier}")
-                        eventlet.sleep(0.2)
+    # Match the cameras in use to what is plugged in
+    def _scan(self):
+        try:
+            present = set(os.listdir(V4L_PATH))
+        except FileNotFoundError:
+            present = set()
+
+        now = time.monotonic()
+
+        for identifier, cam_info in self.info.items():
+            if identifier not in present:
+                Cameras.logger.warning(f"Camera {identifier} unplugged")
+                self._remove_camera(identifier)
+
+            elif (
+                not cam_info.is_recovering
+                and now - self.last_frame_time.get(identifier, now)
+                > Cameras.REENUMERATE_TIMEOUT
+            ):
+                # Reopening is not helping, start over with a fresh CameraInfo
+                Cameras.logger.warning(f"Camera {identifier} stuck, re-enumerating")
+                self._remove_camera(identifier)
+
+        for identifier in sorted(present - set(self.info)):
+            stopping = self.stopping_threads.get(identifier)
+            if stopping is not None and stopping.is_alive():
+                # Still holds the old device handle
+                continue
+            self.stopping_threads.pop(identifier, None)
+
+            if self._should_open(identifier) and self._add_camera(identifier):
+                Cameras.logger.info(
+                    f"Camera {identifier} added as index {self.index[identifier]}"
+                )
+
+    def _open_replays(self, replay_path: str, replay_pace: ReplayPace):
+        Cameras.logger.info(f"Replaying recorded frames from {replay_path} ({replay_pace.value})")
 
-            Thread(target=self._capture_thread, daemon=True).start()
+        try:
+            sources = list_replay_sources(replay_path)
+        except FileNotFoundError:
+            sources = []
 
-        else:
-            Cameras.logger.error("Unsupported platform!")
+        if len(sources) == 0:
+            Cameras.logger.error(f"No replay sources found in {replay_path}")
 
-    def reopen(self, identifier):
-        cam_info = self.info[identifier]
+        for source in sources:
+            identifier = os.path.basename(source)
+            cam = ReplayCamera(source, replay_pace)
+
+            if not cam.isOpened():
+                Cameras.logger.warning(f"Skipping {identifier} - no frames")
+                continue
+
+            cam_info = ReplayCameraInfo(cam, identifier)
+
+            # Recorded calibration wins, otherwise look for one like a real camera
+            if cam_info.K is None or cam_info.D is None:
+                self.import_calibration(identifier, cam_info)
+
+            Cameras.logger.info(f"Replay camera found: {identifier}")
+            self._start_capture(identifier, cam_info)
+
+    # Make a camera available to consumers and start reading it
+    def _start_capture(self, identifier: str, cam_info: CameraInfo):
+        with self.camera_lock:
+            if identifier in self.rings:
+                # Back after being removed, keep its sequence going
+                self.rings[identifier].clear()
+            else:
+                self.rings[identifier] = FrameRing(cam_info.frame_shape())
+                self.sequence[identifier] = 0
+
+            self.connections[identifier] = True
+            self.timestamp[identifier] = 0.0
+            self.cam_read_delay[identifier] = 0.0
+            self.last_frame_time[identifier] = time.monotonic()
+            # After the state above, readers of index expect it to exist
+            self.index.setdefault(identifier, len(self.index))
+
+            thread = Thread(
+                target=self._capture_loop,
+                args=(identifier, cam_info),
+                name=f"capture_{identifier}",
+                daemon=True,
+            )
+            self.capture_threads[identifier] = thread
+            self.info = {**self.info, identifier: cam_info}
+
+        thread.start()
+
+    @staticmethod
+    def open_capture(
+        identifier: str, backend: Backends
+    ) -> cv2.VideoCapture | V4L2Capture:
         path = full_cam_path(identifier)
+
+        if backend == Backends.V4L2_MMAP:
+            return V4L2Capture(path)
+
+        return cv2.VideoCapture(path, cv2.CAP_V4L2)
+
+    # Switch capture backend, applied by reopening the camera in the background
+    def set_backend(self, identifier: str, backend: Backends):
+        cam_info = self.info[identifier]
+
+        if backend == cam_info.backend:
+            return
+
+        cam_info.backend = backend
+        cam_info.is_recovering = True
+        Thread(
+            target=self._background_reopen, args=(identifier, cam_info), daemon=True
+        ).start()
+
+    def reopen(self, identifier, cam_info: CameraInfo | None = None):
+        cam_info = cam_info or self.info[identifier]
+
+        if isinstance(cam_info, ReplayCameraInfo):
+            # Start the recording over
+            cam_info.cam.release()
+            cam_info.cam = ReplayCamera(cam_info.cam.source, cam_info.cam.pace)
+            return cam_info.cam.isOpened()
         
         # Ensure the old handle is closed first
         if cam_info.cam is not None:
             cam_info.cam.release()
 
+        start = time.perf_counter()
+
         for attempt in range(3):
-            cam = cv2.VideoCapture(path, cv2.CAP_V4L2)
+            cam = Cameras.open_capture(identifier, cam_info.backend)
             
             if cam.isOpened():
-                Cameras.logger.info(f"Camera {identifier} RECOVERED on attempt {attempt + 1}")
-                
                 # Re-assign the new camera object to the existing info
                 cam_info.cam = cam
                 
-                # Import config from file
-                self.import_config(identifier)
-                
                 # Disable buffer so we always pull the latest image
                 cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-                
-                # Try to disable auto exposure
-                cam.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1)
+
+                # Fast path, put back what the camera was running with
+                if not cam_info.restore():
+                    Cameras.logger.warning(f"Restoring {identifier} failed, importing its config")
+
+                    # Import config from file
+                    self.import_config(identifier, cam_info)
+
+                    # Try to disable auto exposure
+                    cam.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1)
+
+                self.recovery_time[identifier] = round(
+                    (time.perf_counter() - start) * 1000, 1
+                )
+                Cameras.logger.info(
+                    f"Camera {identifier} RECOVERED on attempt {attempt + 1} in {self.recovery_time[identifier]} ms"
+                )
                 return True
             else:
                 cam.release()
@@ -135,26 +398,54 @@ class Cameras:
 
         return False
     
-    def _capture_thread(self):
-        while True:
-            '''
-            # TODO: determine if this is useful
-            # High-speed grab loop to discard stale frames
-            for identifier in self.info.keys():
-                cam_info = self.info[identifier]
-                cam_info.cam.grab() 
-            '''
-           
-            list(self.executor.map(self._read_frame, self.info.keys()))
+    def _capture_loop(self, identifier: str, cam_info: CameraInfo):
+        # Each camera reads independently so a slow or stalled camera (V4L2
+        # select() timeout) never holds back frames from the others
+        thread = current_thread()
+
+        while self.capture_threads.get(identifier) is thread:
+            if not self._read_frame(identifier, cam_info):
+                # Avoid spinning while the camera recovers
+                time.sleep(Cameras.RETRY_DELAY)
+
+        # Removed, the handle is only released here so it is never closed
+        # in the middle of a read
+        while cam_info.is_recovering:
+            time.sleep(Cameras.RETRY_DELAY)
 
-            if self.new_data_lock.locked():
-                self.new_data_lock.release()
+        if cam_info.cam is not None:
+            cam_info.cam.release()
 
-            self.fresh_data[self.new_data_index] = True
+        Cameras.logger.info(f"Stopped capturing from {identifier}")
 
-    def set_calibration(self, identifier: str, K: np.ndarray, D: np.ndarray):
-        self.info[identifier].K = K
-        self.info[identifier].D = D
+    def _publish_frame(
+        self,
+        identifier: str,
+        connected: bool,
+        timestamp: float,
+        read_delay: float,
+    ):
+        with self.new_frame_condition:
+            self.connections[identifier] = connected
+            self.timestamp[identifier] = timestamp
+            self.cam_read_delay[identifier] = read_delay
+            self.sequence[identifier] = self.sequence.get(identifier, 0) + 1
+
+            if connected:
+                self.last_frame_time[identifier] = time.monotonic()
+
+            self.new_frame_condition.notify_all()
+
+    def set_calibration(
+        self,
+        identifier: str,
+        K: np.ndarray,
+        D: np.ndarray,
+        cam_info: CameraInfo | None = None,
+    ):
+        cam_info = cam_info or self.info[identifier]
+        cam_info.K = K
+        cam_info.D = D
 
         Cameras.logger.info(f"Calibration set for {identifier}, using {K}\n{D}")
 
@@ -166,73 +457,139 @@ class Cameras:
     def list_d(self) -> list[np.ndarray]:
         return [i.D for i in self.info.values()]
 
-    def get_frame(self, identifier: str) -> list[np.ndarray]:
-        self.want_new_frames()
-        self.fresh_data[self.written_index] = False
+    # Frames handed out are borrowed from the camera's ring and stay valid
+    # (and are never overwritten) until the next call for the same camera
+    def get_frame(self, identifier: str) -> np.ndarray | None:
+        with self.new_frame_condition:
+            self.new_frame_condition.wait_for(
+                lambda: self.sequence[identifier]
+                > self.displayed_sequence.get(identifier, 0),
+                Cameras.FRAME_TIMEOUT,
+            )
+            self.displayed_sequence[identifier] = self.sequence[identifier]
+
+            ring = self.rings[identifier]
+            ring.release(self.display_checkouts.get(identifier))
+            self.display_checkouts[identifier], img = ring.checkout()
 
-        return self.frames[self.written_index][identifier]
+            return img
 
-    # Grab frames from each camera specifically for processing
+    # Grab the newest frame of each camera specifically for processing
+    # Only cameras with a frame newer than the last call are returned in the
+    # image and timestamp dicts, read delays cover all cameras and
+    # connections every camera ever seen (in index order, removed ones are
+    # disconnected)
+    # Frames are borrowed until the next call or release_frames()
     def get_frames_for_processing(
         self,
     ) -> tuple[
         dict[str, bool], dict[str, np.ndarray], dict[str, float], dict[str, float]
     ]:
-        self.want_new_frames()
-        self.fresh_data[self.written_index] = False
-
-        return (
-            self.connections[self.written_index],
-            self.frames[self.written_index],
-            self.timestamp[self.written_index],
-            self.cam_read_delay[self.written_index],
+        with self.new_frame_condition:
+            self.new_frame_condition.wait_for(
+                lambda: len(self._fresh_identifiers()) > 0, Cameras.FRAME_TIMEOUT
+            )
+
+            fresh = self._fresh_identifiers()
+            images = {}
+
+            self.release_frames()
+
+            for identifier in fresh:
+                self.processed_sequence[identifier] = self.sequence[identifier]
+                self.processing_checkouts[identifier], images[identifier] = (
+                    self.rings[identifier].checkout()
+                )
+
+            return (
+                {
+                    identifier: identifier in self.info
+                    and self.connections[identifier]
+                    for identifier in list(self.index)
+                },
+                images,
+                {identifier: self.timestamp[identifier] for identifier in fresh},
+                {identifier: self.cam_read_delay[identifier] for identifier in self.info},
+            )
+
+    # JPEG bytes of a frame handed out by get_frames_for_processing, None
+    # when the camera did not deliver compressed frames
+    def get_raw_frame(self, identifier: str) -> np.ndarray | None:
+        return self.rings[identifier].raw_frame(
+            self.processing_checkouts.get(identifier)
         )
 
-    def want_new_frames(self):
-        # New data at our read index
-        if self.fresh_data[self.written_index]:
-            return
+    # Return frames borrowed by get_frames_for_processing to their rings
+    def release_frames(self):
+        for identifier, slot in self.processing_checkouts.items():
+            self.rings[identifier].release(slot)
 
-        # Both slots have old data
-        if not self.fresh_data[self.new_data_index]:
-            self.new_data_lock.acquire()
+        self.processing_checkouts.clear()
 
-        # Old data at current index but new in other
-        self.written_index = self.new_data_index
-        self.new_data_index = (self.new_data_index + 1) % 2
+    # Must be called with new_frame_condition held
+    def _fresh_identifiers(self) -> list[str]:
+        return [
+            identifier
+            for identifier in self.info
+            if self.sequence[identifier] > self.processed_sequence.get(identifier, 0)
+        ]
 
-    def _read_frame(self, identifier):
-        # eventlet.sleep(0.1) # FIXME cam returns None sometimes, delay could help???
+    def _read_frame(self, identifier: str, cam_info: CameraInfo) -> bool:
         # [ WARN:1@259.552] global cap_v4l.cpp:1048 tryIoctl VIDEOIO(V4L2 select() timeout.
-        cam_info = self.info[identifier]
 
         # If this camera is currently being re-opened, don't try to read it
         if cam_info.is_recovering:
-            # Populate data and exit
-            self.frames[self.new_data_index][identifier] = None
-            self.connections[self.new_data_index][identifier] = False
-            self.timestamp[self.new_data_index][identifier] = 0.0
-            self.cam_read_delay[self.new_data_index][identifier] = 0.0
-            return
+            if self.connections[identifier]:
+                self.rings[identifier].clear()
+                self._publish_frame(identifier, False, 0.0, 0.0)
+            return False
 
         ret, img = False, None
+        ring = self.rings[identifier]
         before = time.perf_counter()
 
         try:
-            ret, img = cam_info.cam.read()
+            # Read straight into a preallocated buffer instead of allocating a
+            # new frame every read
+            slot, buffer = ring.acquire(cam_info.frame_shape())
+            frame = None
+            raw = None
+            # Read once, the web UI may toggle it mid-read
+            gray = cam_info.gray_capture
+
+            if gray and cam_info.fourcc == gray_capture.MJPG:
+                # Raw JPEG sizes vary, decode it to luma in the ring buffer
+                ret, raw = cam_info.cam.read()
+                if ret:
+                    img = buffer
+                    frame = gray_capture.to_luma(
+                        raw, cam_info.fourcc, cam_info.resolution, buffer
+                    )
+            else:
+                ret, img = cam_info.cam.read(image=buffer)
+
+                if ret and cam_info.backend == Backends.V4L2_MMAP:
+                    # Kept from before the decode, recordings store it as is
+                    raw = cam_info.cam.last_jpeg
+
+                if ret and gray:
+                    frame = gray_capture.to_luma(
+                        img, cam_info.fourcc, cam_info.resolution, buffer
+                    )
 
             if not ret:
                 # Read fails, shift to recovery mode and start the recovery background thread
                 cam_info.is_recovering = True
                 Cameras.logger.warning(f"Read failed for {identifier}. Starting background recovery...")
-                Thread(target=self._background_reopen, args=(identifier,), daemon=True).start()
-
-                # Populate data and exit
-                self.frames[self.new_data_index][identifier] = None
-                self.connections[self.new_data_index][identifier] = False
-                self.timestamp[self.new_data_index][identifier] = 0.0
-                self.cam_read_delay[self.new_data_index][identifier] = 0.0
-                return
+                Thread(
+                    target=self._background_reopen,
+                    args=(identifier, cam_info),
+                    daemon=True,
+                ).start()
+
+                ring.clear()
+                self._publish_frame(identifier, False, 0.0, 0.0)
+                return False
             else:
                 # Grab timestamps first
                 stream_time_ms = cam_info.cam.get(cv2.CAP_PROP_POS_MSEC)
@@ -240,35 +597,50 @@ class Cameras:
 
                 # Calculate glass time
                 exp_time_ms = cam_info.get("Exposure Time, Absolute") * 0.1
-                usb_transfer_time_ms = 16.7 #TODO: Get this from somewhere?
+                if cam_info.backend == Backends.REPLAY:
+                    # Replay reports when the frame was handed out
+                    usb_transfer_time_ms = 0.0
+                else:
+                    # Both V4L2 backends report the kernel buffer timestamp,
+                    # corrected the same so switching backends doesn't move
+                    # the published time
+                    usb_transfer_time_ms = 16.7 #TODO: Get this from somewhere?
                 glass_time_ms = stream_time_ms - usb_transfer_time_ms - 0.5*exp_time_ms
 
-                # Populate normal data
-                self.frames[self.new_data_index][identifier] = img
-                self.connections[self.new_data_index][identifier] = ret
-                self.timestamp[self.new_data_index][identifier] = glass_time_ms
-                self.cam_read_delay[self.new_data_index][identifier] = round(after - before, 3)
+                ring.publish(slot, img, frame, raw)
+                self._publish_frame(
+                    identifier, ret, glass_time_ms, round(after - before, 3)
+                )
+                return True
 
         except Exception as e:
             Cameras.logger.error(f"Failed to read frame", exc_info=e)
 
-    def _background_reopen(self, identifier):
+        return False
+
+    def _background_reopen(self, identifier: str, cam_info: CameraInfo):
         # Background recovery thread.
         try:
-            time.sleep(0.2)
-            # This calls your existing reopen() which handles release, open, and import_config
-            success = self.reopen(identifier)
+            # This calls your existing reopen() which handles release, open, and restoring settings
+            success = self.reopen(identifier, cam_info)
             if success:
                 Cameras.logger.info(f"Background recovery successful for {identifier}")
             else:
                 Cameras.logger.error(f"Background recovery failed for {identifier}")
+        except Exception as e:
+            # Only this camera is affected, the supervisor takes it from here
+            Cameras.logger.error(f"Background recovery failed for {identifier}", exc_info=e)
         finally:
             # Always clear the flag so _read_frame can try again next loop
-            self.info[identifier].is_recovering = False
+            cam_info.is_recovering = False
 
     # Find a calibration for the camera
-    def import_calibration(self, identifier: str) -> bool:
-        resolution = tuple(self.info[identifier].resolution)
+    # cam_info is for cameras not added to info yet
+    def import_calibration(
+        self, identifier: str, cam_info: CameraInfo | None = None
+    ) -> bool:
+        cam_info = cam_info or self.info[identifier]
+        resolution = tuple(cam_info.resolution)
 
         # Look for the calibration file
         try:
@@ -277,25 +649,26 @@ class Cameras:
             )
 
             # grab the camera matrix and distortion coefficent and set it
-            self.set_calibration(identifier, calib["K"], calib["dist"])
-            self.info[identifier].calibration_path = calibration_path_by_cam(
+            self.set_calibration(identifier, calib["K"], calib["dist"], cam_info)
+            cam_info.calibration_path = calibration_path_by_cam(
                 identifier, resolution
             )
             return True
         except (FileNotFoundError, json.decoder.JSONDecodeError):
-            self.info[identifier].calibration_path = None
+            cam_info.calibration_path = None
             Cameras.logger.error(
                 f"Calibration not found for camera {identifier} at resolution {resolution}"
             )
             return False
 
+    # cam_info is for cameras not added to info yet
     def import_config(
-        self, identifier: str
+        self, identifier: str, cam_info: CameraInfo | None = None
     ) -> dict[str, float | str | list[int] | None] | None:
         # Attempt to import config from file
         Cameras.logger.info(f"Attempting to import config for {identifier}")
         config = None
-        camera_info = self.info[identifier]
+        camera_info = cam_info or self.info[identifier]
 
         try:
             # Parse config from config file
@@ -305,6 +678,8 @@ class Cameras:
         except (FileNotFoundError, json.decoder.JSONDecodeError):
             Cameras.logger.warning(f"Config not found for camera {identifier}")
 
+        camera_info.detection_mask = load_detection_mask(identifier)
+
         if config is not None:
             # Config was found, set config data
 
@@ -317,12 +692,29 @@ class Cameras:
                     camera_info.set_frame_rate(value)
                 elif property == "mode":
                     camera_info.mode = Modes(value)
+                elif property == "gray_capture":
+                    camera_info.set_gray_capture(value)
+                elif property == "backend":
+                    # Chosen when the camera is opened, see get_backend
+                    pass
+                elif property == "decimation":
+                    camera_info.set_decimation(int(value))
+                elif property == "detector":
+                    camera_info.detector = Detectors(value)
+                elif property == "detector_profile":
+                    camera_info.set_detector_profile(value)
+                elif property == "tiles":
+                    camera_info.set_tiles(int(value))
+                elif property == "guided_search":
+                    camera_info.guided_search = bool(value)
+                elif property in EXTRINSICS:
+                    camera_info.set_extrinsic(property, float(value))
                 else:
-                    self.info[identifier].set(property, value)
-            self.import_calibration(identifier)
+                    camera_info.set(property, value)
+            self.import_calibration(identifier, camera_info)
 
         else:
-            self.import_calibration(identifier)
+            self.import_calibration(identifier, camera_info)
             Cameras.logger.warning(f"Camera config not found for camera {identifier}")
 
         return config
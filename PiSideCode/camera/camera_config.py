@@ -1,7 +1,7 @@
 import json
 from directory import cam_config_path, CAMERA_CONFIG_DIRECTORY, CALIBRATION_DIRECTORY
 from pathlib import Path
-from camera.camera_info import CameraInfo
+from camera.camera_info import CameraInfo, Backends
 import logging
 
 logger = logging.getLogger(__name__)
@@ -24,6 +24,15 @@ def is_disabled(identifier: str):
     return False
 
 
+def get_backend(identifier: str) -> Backends:
+    try:
+        with open(cam_config_path(identifier), "r") as data:
+            return Backends(json.load(data)["backend"])
+
+    except (FileNotFoundError, json.decoder.JSONDecodeError, KeyError, ValueError):
+        return Backends.OPENCV
+
+
 def parse_config(
     identifier: str, camera_info: CameraInfo
 ) -> dict[str, float | str | list[int] | None]:
@@ -1,8 +1,3 @@
-from pyrav4l2 import (
-    Device,
-    Control,
-    Menu,
-)
 import logging
 import cv2
 import numpy as np
@@ -11,7 +6,15 @@ import json
 from enum import Enum
 import time
 from threading import Lock
-from directory import  full_cam_path
+from camera import gray_capture
+from camera.device_cache import CachedControl, CachedMenu, load_device
+from camera.v4l2_ioctl import V4L2_CID_EXPOSURE_AUTO
+from processing.detection_mask import DetectionMask
+from processing.tag_detectors import (
+    DEFAULT_PROFILE,
+    Detectors,
+    load_detector_profiles,
+)
 
 
 class Modes(Enum):
@@ -20,6 +23,28 @@ class Modes(Enum):
     DISABLED = "DISABLED"
 
 
+class Backends(Enum):
+    OPENCV = "OPENCV"
+    V4L2_MMAP = "V4L2_MMAP"
+    REPLAY = "REPLAY"
+
+
+# Factors tags can be searched for at on a downscaled frame
+DECIMATIONS = (1, 2, 4)
+# Frames can be split into N x N tiles searched at the same time
+TILES = (1, 2, 3)
+# Where the camera sits on the robot relative to its center (WPILib axes),
+# meters and degrees, with their ranges in the web interface
+EXTRINSICS = {
+    "camera_x": (-1.0, 1.0, 0.005),
+    "camera_y": (-1.0, 1.0, 0.005),
+    "camera_z": (0.0, 1.5, 0.005),
+    "camera_roll": (-180.0, 180.0, 0.5),
+    "camera_pitch": (-90.0, 90.0, 0.5),
+    "camera_yaw": (-180.0, 180.0, 0.5),
+}
+
+
 EXPOSED_PROPERTIES = re.compile(
     "[Bb]rightness|[Exposure \(Auto\)]|[Exposure Time, Absolute]|[Exposure, Auto]|[Exposure \(Absolute\)]|Contrast|Saturation|Gamma|Gain"
 )
@@ -28,33 +53,74 @@ EXPOSED_PROPERTIES = re.compile(
 class CameraInfo:
     logger = logging.getLogger(__name__)
 
+    # Backends the camera can be switched between from the web interface
+    BACKENDS = (Backends.OPENCV, Backends.V4L2_MMAP)
+
     def __init__(
         self,
         cam: cv2.VideoCapture,
         identifier: str,
         K: np.ndarray | None = None,
         D: np.ndarray | None = None,
+        backend: Backends = Backends.OPENCV,
     ):
         self.cam = cam
         self.identifier = identifier
+        self.backend = backend
         self.is_recovering = False
         self.mode: Modes = Modes.POSE_ESTIMATION
         self.setting_lock = Lock()
 
-        self.controller = Device(full_cam_path(identifier))
+        # Capture single channel luma instead of BGR (MJPG and YUYV only)
+        self.gray_capture: bool = False
+        self.fourcc: int = 0
+
+        # Search for tags on the frame downscaled by this factor (see
+        # TagProcessor.detect)
+        self.decimation: int = 1
+        # Tag detector backend
+        self.detector: Detectors = Detectors.ARUCO
+        # Aruco DetectorParameters profile (see processing.detector_tuning)
+        # and the parameters it overrides
+        self.detector_profile: str = DEFAULT_PROFILE
+        self.detector_params: dict = {}
+        # Search tiles x tiles parts of the frame in parallel
+        self.tiles: int = 1
+        # Only search where the robot's pose says tags are (see TagPredictor)
+        self.guided_search: bool = False
+        self.robot_to_camera: dict[str, float] = dict.fromkeys(EXTRINSICS, 0.0)
+        # Crop and blanked polygons (see DetectionMask), stored next to the
+        # camera config by Cameras.import_config
+        self.detection_mask: dict = DetectionMask.validate({})
+
+        # Calibration
+        self.K = K
+        self.D = D
+
+        self.calibration_path: str | None = None
+
+        self.init_device()
+
+    # Controls and formats, everything above is the same for every kind of
+    # camera
+    def init_device(self):
+        # Controls and formats come from the capability cache, only
+        # enumerated when the camera or driver changes
+        self.controller = load_device(self.identifier)
 
         # Modified with self.set()
-        self.controls: dict[str, Control] = {
+        self.controls: dict[str, CachedControl] = {
             c.name: c
             for c in self.controller.controls
             if EXPOSED_PROPERTIES.match(c.name)
         }
 
-        CameraInfo.logger.info(
-            "All Controls: " + str([c.name for c in self.controller.controls])
-        )
         CameraInfo.logger.info(f"Valid Controls: {list(self.controls)}")
 
+        # Last value successfully written to each control, what restore()
+        # puts back after a reopen (menus by item index)
+        self.control_values: dict[str, int] = {}
+
         self.valid_formats = {
             str(f): [(r.width, r.height) for r in res]
             for f, res in self.controller.available_formats.items()
@@ -65,12 +131,6 @@ class CameraInfo:
 
         self.get_format()
 
-        # Calibration
-        self.K = K
-        self.D = D
-
-        self.calibration_path: str | None = None
-
     def get_supported_resolutions(self):
         try:
             curr_format = self.controller.get_format()
@@ -113,6 +173,10 @@ class CameraInfo:
             time.sleep(0.1)
             self.get_format()
 
+            # The new format may not support gray capture
+            if self.gray_capture:
+                self.set_gray_capture(True)
+
             CameraInfo.logger.info(
                 f"Format set to {self.color_format} at {self.resolution} in camera {self.identifier} at {self.frame_rate} fps, wanted {color_format} at {resolution}"
             )
@@ -124,6 +188,103 @@ class CameraInfo:
 
         return False
 
+    def set_gray_capture(self, enabled: bool) -> bool:
+        if self.cam is None:
+            return False
+
+        if enabled and self.fourcc not in gray_capture.GRAY_FORMATS:
+            CameraInfo.logger.error(
+                f"Gray capture needs MJPG or YUYV, camera {self.identifier} is {self.color_format}"
+            )
+            enabled = False
+
+        # Raw frames are handed back undecoded and turned into luma by us
+        self.cam.set(cv2.CAP_PROP_CONVERT_RGB, 0 if enabled else 1)
+        self.gray_capture = enabled
+
+        CameraInfo.logger.info(
+            f"Gray capture {'enabled' if enabled else 'disabled'} for camera {self.identifier}"
+        )
+
+        return True
+
+    def set_decimation(self, decimation: int) -> bool:
+        if decimation not in DECIMATIONS:
+            CameraInfo.logger.error(
+                f"Decimation must be one of {DECIMATIONS}, got {decimation}"
+            )
+            return False
+
+        self.decimation = decimation
+        CameraInfo.logger.info(
+            f"Decimation set to {decimation} for camera {self.identifier}"
+        )
+
+        return True
+
+    def set_tiles(self, tiles: int) -> bool:
+        if tiles not in TILES:
+            CameraInfo.logger.error(f"Tiles must be one of {TILES}, got {tiles}")
+            return False
+
+        self.tiles = tiles
+        CameraInfo.logger.info(f"Tiles set to {tiles} for camera {self.identifier}")
+
+        return True
+
+    def set_detector_profile(self, name: str) -> bool:
+        if name == DEFAULT_PROFILE:
+            params = {}
+        else:
+            profiles = load_detector_profiles()
+            if name not in profiles:
+                CameraInfo.logger.error(
+                    f"Detector profile must be one of {[DEFAULT_PROFILE, *profiles]}, "
+                    f"got {name}"
+                )
+                return False
+
+            params = profiles[name]
+
+        self.detector_profile = name
+        self.detector_params = params
+        CameraInfo.logger.info(
+            f"Detector profile set to {name} for camera {self.identifier}"
+        )
+
+        return True
+
+    def set_extrinsic(self, name: str, value: float) -> bool:
+        minimum, maximum, _ = EXTRINSICS[name]
+        if not minimum <= value <= maximum:
+            CameraInfo.logger.error(
+                f"{name} must be between {minimum} and {maximum}, got {value}"
+            )
+            return False
+
+        self.robot_to_camera[name] = value
+        CameraInfo.logger.info(f"{name} set to {value} for camera {self.identifier}")
+
+        return True
+
+    # Extrinsics in EXTRINSICS order, see robot_to_camera_transform
+    def extrinsics(self) -> tuple[float, ...]:
+        return tuple(self.robot_to_camera[name] for name in EXTRINSICS)
+
+    # Extrinsics for CameraProcessor, None when guided search is off
+    def search_extrinsics(self) -> tuple[float, ...] | None:
+        if not self.guided_search:
+            return None
+
+        return self.extrinsics()
+
+    # Shape of the buffers frames should be read into
+    def frame_shape(self) -> tuple[int, ...]:
+        if self.gray_capture:
+            return gray_capture.buffer_shape(self.fourcc, self.resolution)
+
+        return (self.resolution[1], self.resolution[0], 3)
+
     def set_frame_rate(self, frame_rate: int):
         if self.cam is None:
             return False
@@ -146,6 +307,58 @@ class CameraInfo:
 
         return False
 
+    # Put a freshly reopened camera back in the last known-good state, all
+    # from memory: format and frame rate through the capture handle, then
+    # every control in a single VIDIOC_S_EXT_CTRLS. No sleeps and no
+    # read-backs, False if anything did not take
+    def restore(self) -> bool:
+        if self.cam is None or self.color_format not in self.valid_color_formats:
+            return False
+
+        applied = (
+            self.cam.set(
+                cv2.CAP_PROP_FOURCC,
+                self.valid_color_formats[self.color_format].pixelformat,
+            )
+            and self.cam.set(cv2.CAP_PROP_FRAME_WIDTH, self.resolution[0])
+            and self.cam.set(cv2.CAP_PROP_FRAME_HEIGHT, self.resolution[1])
+            and self.cam.set(cv2.CAP_PROP_FPS, self.frame_rate)
+        )
+
+        if not applied:
+            CameraInfo.logger.error(f"Failed to restore format of camera {self.identifier}")
+            return False
+
+        self.cam.set(cv2.CAP_PROP_CONVERT_RGB, 0 if self.gray_capture else 1)
+
+        values = {
+            self.controls[name]: value for name, value in self.control_values.items()
+        }
+
+        # Always manual exposure like on boot, first so the exposure time
+        # is writable when it is applied
+        exposure_auto = next(
+            (c for c in self.controls.values() if c.id == V4L2_CID_EXPOSURE_AUTO),
+            None,
+        )
+        if exposure_auto is not None:
+            values.pop(exposure_auto, None)
+            values = {exposure_auto: 1, **values}
+        else:
+            self.cam.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1)
+
+        try:
+            self.controller.set_control_values(list(values.items()))
+        except OSError as e:
+            error_idx = getattr(e, "error_idx", len(values))
+            failed = list(values)[error_idx].name if error_idx < len(values) else "batch"
+            CameraInfo.logger.error(
+                f"Failed to restore controls of camera {self.identifier} ({failed}): {e}"
+            )
+            return False
+
+        return True
+
     def set(self, control_name: str, value: int | str) -> bool:
         if self.cam is None:
             return False
@@ -158,7 +371,7 @@ class CameraInfo:
         try:
             control = self.controls[control_name]
 
-            if isinstance(control, Menu):
+            if isinstance(control, CachedMenu):
                 value = next(
                     filter(lambda menu_item: menu_item.name == value, control.items)
                 )
@@ -166,6 +379,9 @@ class CameraInfo:
                 value = int(value)
 
             self.controller.set_control_value(self.controls[control_name], value)
+            self.control_values[control_name] = (
+                value.index if isinstance(control, CachedMenu) else value
+            )
 
             CameraInfo.logger.info(
                 f"{control_name} set to {value} in camera {self.identifier} (actually {self.get(control_name)})"
@@ -193,6 +409,9 @@ class CameraInfo:
 
             self.color_format = curr_format[0].description
             self.resolution: tuple[int, int] = (curr_format[1].width, curr_format[1].height)
+
+            if self.cam is not None:
+                self.fourcc = int(self.cam.get(cv2.CAP_PROP_FOURCC))
             
         except FileNotFoundError:
             CameraInfo.logger.fatal(f"Camera {self.identifier} disconnected. Cannot read information.")
@@ -204,7 +423,7 @@ class CameraInfo:
         configs = {}
 
         for property, ctrl in self.controls.items():
-            if isinstance(ctrl, Menu):
+            if isinstance(ctrl, CachedMenu):
                 configs[property] = self.get(property).name
             else:
                 configs[property] = self.get(property)
@@ -213,6 +432,14 @@ class CameraInfo:
         configs["color_format"] = self.color_format
         configs["frame_rate"] = self.frame_rate
         configs["mode"] = self.mode.value
+        configs["gray_capture"] = self.gray_capture
+        configs["backend"] = self.backend.value
+        configs["decimation"] = self.decimation
+        configs["detector"] = self.detector.value
+        configs["detector_profile"] = self.detector_profile
+        configs["tiles"] = self.tiles
+        configs["guided_search"] = self.guided_search
+        configs.update(self.robot_to_camera)
 
         return configs
 
@@ -220,7 +447,7 @@ class CameraInfo:
         configs = {}
 
         for property, ctrl in self.controls.items():
-            if isinstance(ctrl, Menu):
+            if isinstance(ctrl, CachedMenu):
                 configs[property + "_MENU"] = list(map(lambda c: c.name, ctrl.items))
             else:
                 configs[property + "_RANGE"] = [ctrl.minimum, ctrl.maximum, ctrl.step]
@@ -230,5 +457,17 @@ class CameraInfo:
         configs["frame_rate" + "_MENU"] = list(
             map(lambda f: round(1 / float(f)), (self.valid_frame_rates.values()))
         )
+        configs["gray_capture" + "_MENU"] = [True, False]
+        configs["backend" + "_MENU"] = [backend.value for backend in self.BACKENDS]
+        configs["decimation" + "_MENU"] = list(DECIMATIONS)
+        configs["detector" + "_MENU"] = [detector.value for detector in Detectors]
+        configs["detector_profile" + "_MENU"] = [
+            DEFAULT_PROFILE,
+            *load_detector_profiles(),
+        ]
+        configs["tiles" + "_MENU"] = list(TILES)
+        configs["guided_search" + "_MENU"] = [True, False]
+        for name, value_range in EXTRINSICS.items():
+            configs[name + "_RANGE"] = list(value_range)
 
         return configs
@@ -0,0 +1,118 @@
+# Compare capture backends on a connected camera
+# Run from PiSideCode: python -m camera.capture_benchmark <identifier>
+import argparse
+import cv2
+import logging
+import os
+import time
+import numpy as np
+
+from camera.camera import Cameras
+from camera.camera_info import CameraInfo
+from directory import V4L_PATH
+
+
+def benchmark(cam_info: CameraInfo, frames: int, warmup: int) -> dict[str, float]:
+    for _ in range(warmup):
+        cam_info.cam.read()
+
+    read_times = []
+    frame_times = []
+
+    cpu_before = time.process_time()
+
+    for _ in range(frames):
+        before = time.perf_counter()
+        ret, _ = cam_info.cam.read()
+        after = time.perf_counter()
+
+        if not ret:
+            continue
+
+        read_times.append(after - before)
+        # Kernel timestamps for V4L2_MMAP, OpenCV reports the same clock
+        frame_times.append(cam_info.cam.get(cv2.CAP_PROP_POS_MSEC))
+
+    cpu = time.process_time() - cpu_before
+
+    if len(read_times) == 0:
+        return {"frames": 0}
+
+    intervals = np.diff(frame_times)
+
+    return {
+        "frames": len(read_times),
+        "read_ms": np.mean(read_times) * 1000,
+        "read_p99_ms": np.percentile(read_times, 99) * 1000,
+        "fps": 1000 / np.mean(intervals) if len(intervals) > 0 else 0.0,
+        "jitter_ms": np.std(intervals) if len(intervals) > 0 else 0.0,
+        "cpu_ms_per_frame": cpu / len(read_times) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare cv2.CAP_V4L2 and the V4L2 mmap backend"
+    )
+    parser.add_argument("identifier", help=f"Camera name in {V4L_PATH}")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument(
+        "--resolution",
+        type=int,
+        nargs=2,
+        metavar=("WIDTH", "HEIGHT"),
+        help="Defaults to the largest resolution of each format",
+    )
+    parser.add_argument("--frame-rate", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if not os.path.exists(os.path.join(V4L_PATH, args.identifier)):
+        parser.error(f"{args.identifier} not found in {V4L_PATH}")
+
+    print(
+        f"{'backend':<10} {'format':<20} {'resolution':<12} {'frames':>6} {'read ms':>8} "
+        f"{'p99 ms':>8} {'fps':>6} {'jitter ms':>9} {'cpu ms/f':>8}"
+    )
+
+    for backend in CameraInfo.BACKENDS:
+        cam = Cameras.open_capture(args.identifier, backend)
+        if not cam.isOpened():
+            print(f"{backend.value:<10} failed to open")
+            continue
+
+        cam_info = CameraInfo(cam, args.identifier, backend=backend)
+
+        for color_format, resolutions in cam_info.valid_formats.items():
+            resolution = (
+                tuple(args.resolution)
+                if args.resolution
+                else max(resolutions, key=lambda r: r[0] * r[1])
+            )
+
+            if not cam_info.set_format(color_format, resolution):
+                print(f"{backend.value:<10} {color_format:<20} unsupported at {resolution}")
+                continue
+
+            if args.frame_rate:
+                cam_info.set_frame_rate(args.frame_rate)
+
+            result = benchmark(cam_info, args.frames, args.warmup)
+
+            if result["frames"] == 0:
+                print(f"{backend.value:<10} {color_format:<20} no frames read")
+                continue
+
+            print(
+                f"{backend.value:<10} {color_format:<20} {'x'.join(map(str, resolution)):<12} "
+                f"{result['frames']:>6} {result['read_ms']:>8.2f} {result['read_p99_ms']:>8.2f} "
+                f"{result['fps']:>6.1f} {result['jitter_ms']:>9.2f} {result['cpu_ms_per_frame']:>8.2f}"
+            )
+
+        cam.release()
+
+
+if __name__ == "__main__":
+    main()
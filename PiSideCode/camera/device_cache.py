@@ -0,0 +1,309 @@
+from pyrav4l2 import Device, Menu
+import fcntl
+import json
+import logging
+import os
+import pathlib
+from fractions import Fraction
+
+from camera.v4l2_ioctl import (
+    V4L2_BUF_TYPE_VIDEO_CAPTURE,
+    V4L2_CTRL_WHICH_CUR_VAL,
+    VIDIOC_G_CTRL,
+    VIDIOC_G_FMT,
+    VIDIOC_G_PARM,
+    VIDIOC_QUERYCAP,
+    VIDIOC_S_CTRL,
+    VIDIOC_S_EXT_CTRLS,
+    v4l2_capability,
+    v4l2_control,
+    v4l2_ext_control,
+    v4l2_ext_controls,
+    v4l2_format,
+    v4l2_streamparm,
+)
+from directory import CAMERA_CONFIG_DIRECTORY, device_cache_path, full_cam_path
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cached layout changes
+CACHE_VERSION = 1
+
+# Read from the USB device the video node belongs to
+USB_DESCRIPTORS = ("idVendor", "idProduct", "bcdDevice", "serial", "product")
+
+
+class CachedItem:
+    def __init__(self, index: int, name: str):
+        self.index = index
+        self.name = name
+
+
+class CachedControl:
+    def __init__(
+        self,
+        id: int,
+        name: str,
+        minimum: int,
+        maximum: int,
+        step: int,
+        default: int,
+    ):
+        self.id = id
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.default = default
+
+
+class CachedMenu(CachedControl):
+    def __init__(self, items: list[CachedItem], **control):
+        super().__init__(**control)
+        self.items = items
+
+
+class CachedColorFormat:
+    def __init__(self, pixelformat: int, description: str):
+        self.pixelformat = pixelformat
+        self.description = description
+
+    def __str__(self) -> str:
+        return self.description
+
+
+class CachedFrameSize:
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+
+
+class CachedDevice:
+    """
+    The parts of pyrav4l2's Device used by CameraInfo, served from a
+    capability cache.
+
+    Enumerating controls, formats and frame intervals takes dozens of
+    ioctls per camera. They only change with the camera or driver, so they
+    are enumerated once and cached next to the camera configs. Current
+    values (format, frame interval, controls) are still read from the
+    device, one ioctl each.
+    """
+
+    def __init__(self, path: str, capabilities: dict):
+        self.path = path
+
+        self.controls: list[CachedControl] = []
+        for control in capabilities["controls"]:
+            if "items" in control:
+                items = [CachedItem(*item) for item in control["items"]]
+                fields = {k: v for k, v in control.items() if k != "items"}
+                self.controls.append(CachedMenu(items, **fields))
+            else:
+                self.controls.append(CachedControl(**control))
+
+        self.available_formats: dict[CachedColorFormat, list[CachedFrameSize]] = {}
+        self.frame_intervals: dict[tuple[int, int, int], list[Fraction]] = {}
+
+        for f in capabilities["formats"]:
+            color_format = CachedColorFormat(f["pixelformat"], f["description"])
+            self.available_formats[color_format] = []
+
+            for width, height, intervals in f["frame_sizes"]:
+                self.available_formats[color_format].append(
+                    CachedFrameSize(width, height)
+                )
+                self.frame_intervals[(f["pixelformat"], width, height)] = [
+                    Fraction(*interval) for interval in intervals
+                ]
+
+    def _ioctl(self, request: int, arg):
+        fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+        try:
+            fcntl.ioctl(fd, request, arg)
+        finally:
+            os.close(fd)
+        return arg
+
+    def get_format(self) -> tuple[CachedColorFormat, CachedFrameSize]:
+        pix = self._ioctl(
+            VIDIOC_G_FMT, v4l2_format(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        ).fmt.pix
+
+        color_format = next(
+            (f for f in self.available_formats if f.pixelformat == pix.pixelformat),
+            None,
+        )
+        if color_format is None:
+            raise ValueError(f"Unknown pixel format {pix.pixelformat:#x}")
+
+        return color_format, CachedFrameSize(pix.width, pix.height)
+
+    def get_available_frame_intervals(
+        self, color_format: CachedColorFormat, frame_size: CachedFrameSize
+    ) -> list[Fraction]:
+        return self.frame_intervals.get(
+            (color_format.pixelformat, frame_size.width, frame_size.height), []
+        )
+
+    def get_frame_interval(self) -> Fraction:
+        timeperframe = self._ioctl(
+            VIDIOC_G_PARM, v4l2_streamparm(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        ).parm.capture.timeperframe
+        return Fraction(timeperframe.numerator, max(timeperframe.denominator, 1))
+
+    def get_control_value(self, control: CachedControl) -> int | CachedItem:
+        value = self._ioctl(VIDIOC_G_CTRL, v4l2_control(id=control.id)).value
+
+        if isinstance(control, CachedMenu):
+            return next(
+                (item for item in control.items if item.index == value),
+                CachedItem(value, str(value)),
+            )
+
+        return value
+
+    def set_control_value(self, control: CachedControl, value: int | CachedItem):
+        if isinstance(value, CachedItem):
+            value = value.index
+
+        self._ioctl(VIDIOC_S_CTRL, v4l2_control(id=control.id, value=int(value)))
+
+    # Set several controls with one ioctl, applied in order
+    # Raises OSError with the index of the control that failed set on
+    # error_idx (count if the driver rejected the batch as a whole)
+    def set_control_values(self, values: list[tuple[CachedControl, int]]):
+        if len(values) == 0:
+            return
+
+        controls = (v4l2_ext_control * len(values))()
+        for i, (control, value) in enumerate(values):
+            controls[i].id = control.id
+            controls[i].v.value = int(value)
+
+        request = v4l2_ext_controls(
+            which=V4L2_CTRL_WHICH_CUR_VAL, count=len(values), controls=controls
+        )
+
+        try:
+            self._ioctl(VIDIOC_S_EXT_CTRLS, request)
+        except OSError as e:
+            e.error_idx = request.error_idx
+            raise
+
+
+def _read_sysfs(path: str) -> str | None:
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+# What the cache is valid for, any change re-enumerates the camera
+def device_key(identifier: str) -> dict:
+    path = full_cam_path(identifier)
+
+    fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+    try:
+        cap = v4l2_capability()
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, cap)
+    finally:
+        os.close(fd)
+
+    # /sys/class/video4linux/videoN/device is the USB interface, the
+    # descriptors live on its parent
+    video_node = os.path.basename(os.path.realpath(path))
+    usb_device = os.path.dirname(
+        os.path.realpath(os.path.join("/sys/class/video4linux", video_node, "device"))
+    )
+
+    return {
+        "version": CACHE_VERSION,
+        "path": identifier,
+        "driver": cap.driver.decode(errors="replace"),
+        "driver_version": cap.version,
+        "card": cap.card.decode(errors="replace"),
+        "bus_info": cap.bus_info.decode(errors="replace"),
+        "usb": {
+            name: _read_sysfs(os.path.join(usb_device, name))
+            for name in USB_DESCRIPTORS
+        },
+    }
+
+
+# Full enumeration through pyrav4l2, only on a cache miss
+def enumerate_capabilities(identifier: str) -> dict:
+    device = Device(full_cam_path(identifier))
+
+    controls = []
+    for c in device.controls:
+        control = {
+            "id": c.id,
+            "name": c.name,
+            "minimum": c.minimum,
+            "maximum": c.maximum,
+            "step": c.step,
+            "default": c.default,
+        }
+        if isinstance(c, Menu):
+            control["items"] = [[item.index, item.name] for item in c.items]
+        controls.append(control)
+
+    formats = []
+    for color_format, frame_sizes in device.available_formats.items():
+        formats.append(
+            {
+                "pixelformat": color_format.pixelformat,
+                "description": color_format.description,
+                "frame_sizes": [
+                    [
+                        size.width,
+                        size.height,
+                        [
+                            [interval.numerator, interval.denominator]
+                            for interval in map(
+                                Fraction,
+                                device.get_available_frame_intervals(
+                                    color_format, size
+                                ),
+                            )
+                        ],
+                    ]
+                    for size in frame_sizes
+                ],
+            }
+        )
+
+    logger.info(f"All Controls for {identifier}: {[c['name'] for c in controls]}")
+
+    return {"controls": controls, "formats": formats}
+
+
+def load_device(identifier: str) -> CachedDevice:
+    key = device_key(identifier)
+    cache_path = device_cache_path(identifier)
+
+    try:
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+
+        if cache["key"] == key:
+            logger.info(f"Using cached capabilities for {identifier}")
+            return CachedDevice(full_cam_path(identifier), cache["capabilities"])
+
+        logger.info(f"Camera or driver changed for {identifier}, re-enumerating")
+
+    except (FileNotFoundError, json.decoder.JSONDecodeError, KeyError, TypeError):
+        logger.info(f"No usable capability cache for {identifier}, enumerating")
+
+    capabilities = enumerate_capabilities(identifier)
+
+    try:
+        pathlib.Path(CAMERA_CONFIG_DIRECTORY).mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump({"key": key, "capabilities": capabilities}, f)
+    except OSError as e:
+        logger.error(f"Failed to write capability cache {cache_path}: {e}")
+
+    return CachedDevice(full_cam_path(identifier), capabilities)
@@ -0,0 +1,96 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+
+# From linux/inotify.h
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (
+    IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+# wd, mask, cookie, len, followed by len bytes of name
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class DeviceWatcher:
+    """
+    Waits for entries to appear in or disappear from a directory through
+    inotify, e.g. udev adding /dev/v4l/by-path links when a camera is plugged
+    in.
+
+    udev removes the directory itself with the last camera, the watch is
+    re-added once it exists again. Without inotify wait() degrades to a
+    plain sleep so callers end up polling.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd: int | None = None
+        self.watch: int | None = None
+
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            self.fd = fd
+        except (OSError, AttributeError) as e:
+            DeviceWatcher.logger.warning(f"inotify unavailable, polling {path}: {e}")
+
+    def _add_watch(self) -> bool:
+        if self.fd is None:
+            return False
+
+        watch = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(self.path), WATCH_MASK
+        )
+        if watch < 0:
+            # Not there yet
+            return False
+
+        self.watch = watch
+        return True
+
+    # Block until the directory changes or timeout seconds pass
+    def wait(self, timeout: float):
+        if self.watch is None and not self._add_watch():
+            time.sleep(timeout)
+            return
+
+        ready, _, _ = select.select((self.fd,), (), (), timeout)
+        if not ready:
+            return
+
+        try:
+            events = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(events):
+            _, mask, _, length = EVENT_HEADER.unpack_from(events, offset)
+            offset += EVENT_HEADER.size + length
+
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                # Directory is gone, watch it again once it is back
+                self.watch = None
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,106 @@
+import logging
+import numpy as np
+from threading import Lock
+
+
+class FrameRing:
+    """
+    Preallocated frame buffers for a single camera.
+
+    The capture loop reads into a free slot and publishes it as the latest
+    frame. Consumers borrow the latest slot with checkout() and give it back
+    with release(). A slot is only reused for writing once it is neither the
+    latest frame nor checked out, so borrowed frames are never overwritten.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    # One slot being written, one latest, one borrowed for processing and one
+    # borrowed for the web stream
+    DEFAULT_SIZE = 4
+
+    def __init__(self, shape: tuple[int, ...], size: int = DEFAULT_SIZE):
+        self.shape = shape
+        self.buffers: list[np.ndarray] = [
+            np.empty(shape, dtype=np.uint8) for _ in range(size)
+        ]
+        # What consumers see, either the buffer itself or a view into it
+        self.frames: list[np.ndarray] = list(self.buffers)
+        # Compressed frame as it came off the camera, when there is one
+        self.raw: list[np.ndarray | None] = [None] * size
+        self.checkouts: list[int] = [0] * size
+        self.latest: int | None = None
+        self.lock = Lock()
+
+    # shape changes the size of buffers handed out from now on
+    def acquire(self, shape: tuple[int, ...] | None = None) -> tuple[int, np.ndarray]:
+        with self.lock:
+            if shape is not None:
+                self.shape = shape
+
+            for slot in range(len(self.buffers)):
+                if slot != self.latest and self.checkouts[slot] == 0:
+                    break
+            else:
+                # Every slot is borrowed, grow rather than overwrite
+                slot = len(self.buffers)
+                self.buffers.append(np.empty(self.shape, dtype=np.uint8))
+                self.frames.append(self.buffers[slot])
+                self.raw.append(None)
+                self.checkouts.append(0)
+                FrameRing.logger.warning(f"Frame ring grown to {len(self.buffers)} slots")
+
+            # Free slots left over from a previous format are reallocated lazily
+            if self.buffers[slot].shape != self.shape:
+                self.buffers[slot] = np.empty(self.shape, dtype=np.uint8)
+
+            return slot, self.buffers[slot]
+
+    # Make a written slot the latest frame
+    # buffer replaces the slot buffer if the reader could not write in place
+    # (e.g. the resolution or format changed), frame is what consumers get
+    # if it differs from the buffer and raw is the compressed frame it was
+    # decoded from (owned by the ring from now on)
+    def publish(
+        self,
+        slot: int,
+        buffer: np.ndarray,
+        frame: np.ndarray | None = None,
+        raw: np.ndarray | None = None,
+    ):
+        with self.lock:
+            if buffer is not self.buffers[slot]:
+                self.buffers[slot] = buffer
+                self.shape = buffer.shape
+
+            self.frames[slot] = buffer if frame is None else frame
+            self.raw[slot] = raw
+            self.latest = slot
+
+    # Drop the latest frame (camera disconnected or recovering)
+    def clear(self):
+        with self.lock:
+            self.latest = None
+
+    def checkout(self) -> tuple[int | None, np.ndarray | None]:
+        with self.lock:
+            if self.latest is None:
+                return None, None
+
+            self.checkouts[self.latest] += 1
+            return self.latest, self.frames[self.latest]
+
+    # Compressed frame of a checked out slot, None if it was not kept
+    def raw_frame(self, slot: int | None) -> np.ndarray | None:
+        if slot is None:
+            return None
+
+        with self.lock:
+            return self.raw[slot]
+
+    def release(self, slot: int | None):
+        if slot is None:
+            return
+
+        with self.lock:
+            self.checkouts[slot] = max(0, self.checkouts[slot] - 1)
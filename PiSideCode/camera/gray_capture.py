@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+import simplejpeg
+
+# FourCCs as reported by cv2.CAP_PROP_FOURCC
+MJPG = cv2.VideoWriter.fourcc(*"MJPG")
+YUYV = cv2.VideoWriter.fourcc(*"YUYV")
+
+GRAY_FORMATS = (MJPG, YUYV)
+
+
+# Shape of the buffer a raw (CAP_PROP_CONVERT_RGB off) read should land in
+# MJPG frames vary in size so the ring holds the decoded luma instead
+def buffer_shape(fourcc: int, resolution: tuple[int, int]) -> tuple[int, ...]:
+    width, height = resolution
+
+    if fourcc == YUYV:
+        return (1, width * height * 2)
+
+    return (height, width)
+
+
+# Turn a raw frame into a single channel luma image
+# For MJPG the JPEG is decoded straight to gray into out, for YUYV a strided
+# view of the Y samples is returned without copying
+def to_luma(
+    raw: np.ndarray, fourcc: int, resolution: tuple[int, int], out: np.ndarray
+) -> np.ndarray:
+    width, height = resolution
+
+    if fourcc == YUYV:
+        return raw.reshape(-1)[::2].reshape(height, width)
+
+    return simplejpeg.decode_jpeg(
+        raw.reshape(-1),
+        colorspace="GRAY",
+        fastdct=True,
+        buffer=out.reshape(-1),
+    ).reshape(height, width)
+
+
+# Color is only produced when someone wants to look at the frame
+def to_color(img: np.ndarray) -> np.ndarray:
+    if img is None or img.ndim == 3:
+        return img
+
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
@@ -0,0 +1,242 @@
+import datetime
+import json
+import logging
+import numpy as np
+import os
+import pathlib
+import shutil
+import simplejpeg
+from queue import Queue, Full
+from threading import Thread
+import wpimath.geometry as wpi
+
+from camera.camera_info import CameraInfo
+from camera.replay_camera import CAMERA_METADATA, FRAME_INDEX
+from directory import RECORDING_DIRECTORY, clean_identifier
+
+
+class RecordedFrame:
+    """A frame waiting to be written, owns its pixels or JPEG bytes"""
+
+    def __init__(
+        self,
+        identifier: str,
+        index: int,
+        timestamp: float,
+        image: np.ndarray | None,
+        jpeg: np.ndarray | None,
+        metadata: dict,
+    ):
+        self.identifier = identifier
+        self.index = index
+        self.timestamp = timestamp
+        self.image = image
+        self.jpeg = jpeg
+        self.metadata = metadata
+        self.detections: dict | None = None
+
+
+class MatchRecorder:
+    """
+    Records frames, glass timestamps and detections in the replay layout
+    read by ReplayCamera (one directory per camera with a frames.jsonl).
+
+    The main loop only copies the frame (or keeps a reference to the JPEG
+    the camera sent) and hands it to a bounded queue, encoding and disk I/O
+    happen on a background writer thread. When the writer falls behind new
+    frames are dropped instead of blocking.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    QUEUE_SIZE = 16
+    JPEG_QUALITY = 90
+
+    # Stop writing before the SD card fills up, checked every
+    # DISK_CHECK_INTERVAL frames
+    MIN_FREE_BYTES = 512 * 1024 * 1024
+    DISK_CHECK_INTERVAL = 100
+
+    # every_n records one of every N frames per camera
+    def __init__(
+        self,
+        directory: str = RECORDING_DIRECTORY,
+        every_n: int = 1,
+        queue_size: int = QUEUE_SIZE,
+    ):
+        self.path = os.path.join(
+            directory, datetime.datetime.now().strftime("match_%Y-%m-%d_%H-%M-%S")
+        )
+        self.every_n = max(1, every_n)
+
+        self.queue: Queue[RecordedFrame | None] = Queue(maxsize=queue_size)
+
+        # Frames seen by begin() per camera, used for every_n and file names
+        self.frame_counts: dict[str, int] = {}
+        self.dropped = 0
+        self.written = 0
+        self.disk_full = False
+
+        self.writer = Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+        MatchRecorder.logger.info(
+            f"Recording every {self.every_n} frame(s) to {self.path}"
+        )
+
+    # Take a frame before it is processed (annotations are drawn in place)
+    # Returns None when the frame is skipped, otherwise pass the result to
+    # finish() once the detections are known
+    def begin(
+        self,
+        cam_info: CameraInfo,
+        image: np.ndarray,
+        jpeg: np.ndarray | None,
+        timestamp: float,
+    ) -> RecordedFrame | None:
+        identifier = cam_info.identifier
+        index = self.frame_counts.get(identifier, 0)
+        self.frame_counts[identifier] = index + 1
+
+        if index % self.every_n != 0 or image is None or self.disk_full:
+            return None
+
+        # Checked before copying so a slow disk costs nothing here
+        if self.queue.full():
+            self.dropped += 1
+            return None
+
+        return RecordedFrame(
+            identifier,
+            index,
+            timestamp,
+            # The camera's JPEG is never reused, only raw pixels need a copy
+            None if jpeg is not None else image.copy(),
+            jpeg,
+            {
+                "resolution": list(cam_info.resolution),
+                "mode": cam_info.mode.value,
+                "K": cam_info.K,
+                "dist": cam_info.D,
+                # Odometry guided search and joint poses need them on replay
+                **cam_info.robot_to_camera,
+            },
+        )
+
+    def finish(self, frame: RecordedFrame | None, detections: dict | None = None):
+        if frame is None:
+            return
+
+        frame.detections = detections
+
+        try:
+            self.queue.put_nowait(frame)
+        except Full:
+            self.dropped += 1
+
+    def close(self):
+        try:
+            self.queue.put(None, timeout=1.0)
+        except Full:
+            pass
+
+        self.writer.join(2.0)
+        MatchRecorder.logger.info(
+            f"Recording stopped: {self.written} frames written, {self.dropped} dropped"
+        )
+
+    @staticmethod
+    def _to_json(value):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        elif isinstance(value, np.generic):
+            return value.item()
+        elif isinstance(value, wpi.Pose3d):
+            q = value.rotation().getQuaternion()
+            return [value.X(), value.Y(), value.Z(), q.W(), q.X(), q.Y(), q.Z()]
+
+        raise TypeError(f"Cannot record {type(value)}")
+
+    def _write_loop(self):
+        indexes = {}
+
+        try:
+            while True:
+                frame = self.queue.get()
+
+                if frame is None:
+                    break
+
+                try:
+                    if frame.identifier not in indexes:
+                        indexes[frame.identifier] = self._start_camera(frame)
+
+                    self._write_frame(frame, indexes[frame.identifier])
+                except OSError as e:
+                    MatchRecorder.logger.error(f"Failed to record frame: {e}")
+                    self.dropped += 1
+
+        finally:
+            for index in indexes.values():
+                index.close()
+
+    def _camera_path(self, identifier: str) -> str:
+        return os.path.join(self.path, clean_identifier(identifier))
+
+    def _start_camera(self, frame: RecordedFrame):
+        path = self._camera_path(frame.identifier)
+        pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+
+        with open(os.path.join(path, CAMERA_METADATA), "w") as f:
+            json.dump(frame.metadata, f, default=MatchRecorder._to_json)
+
+        # Line buffered so a crash loses at most the frame being written
+        return open(os.path.join(path, FRAME_INDEX), "a", buffering=1)
+
+    def _write_frame(self, frame: RecordedFrame, index):
+        if self.written % MatchRecorder.DISK_CHECK_INTERVAL == 0:
+            self._check_disk()
+            if self.disk_full:
+                self.dropped += 1
+                return
+
+        if frame.jpeg is not None:
+            data = frame.jpeg
+        elif frame.image.ndim == 2:
+            data = simplejpeg.encode_jpeg(
+                frame.image[..., np.newaxis],
+                quality=MatchRecorder.JPEG_QUALITY,
+                colorspace="gray",
+                colorsubsampling="gray",
+            )
+        else:
+            data = simplejpeg.encode_jpeg(
+                frame.image, quality=MatchRecorder.JPEG_QUALITY, colorspace="BGR"
+            )
+
+        file_name = f"{frame.index:08d}.jpg"
+        with open(os.path.join(self._camera_path(frame.identifier), file_name), "wb") as f:
+            f.write(data)
+
+        index.write(
+            json.dumps(
+                {
+                    "file": file_name,
+                    "timestamp": frame.timestamp,
+                    "detections": frame.detections,
+                },
+                default=MatchRecorder._to_json,
+            )
+            + "\n"
+        )
+        self.written += 1
+
+    def _check_disk(self):
+        pathlib.Path(self.path).mkdir(parents=True, exist_ok=True)
+        free = shutil.disk_usage(self.path).free
+
+        if free < MatchRecorder.MIN_FREE_BYTES and not self.disk_full:
+            MatchRecorder.logger.error(
+                f"Only {free // (1024 * 1024)} MB free, recording stopped"
+            )
+        self.disk_full = free < MatchRecorder.MIN_FREE_BYTES
@@ -0,0 +1,289 @@
+import cv2
+import json
+import logging
+import numpy as np
+import os
+import simplejpeg
+import time
+from enum import Enum
+
+from camera import gray_capture
+from camera.camera_info import CameraInfo, Backends, Modes, EXTRINSICS
+from processing.detection_mask import load_detection_mask
+
+# Layout of a replay directory (also what match recordings are written as):
+#
+#   <replay directory>/
+#       <camera name>/
+#           camera.json     optional {"resolution": [w, h], "K": [...], "dist": [...], "mode": ...,
+#                           "camera_x": ..., ... (see EXTRINSICS)}
+#           frames.jsonl    optional, one {"file": ..., "timestamp": ms} per line
+#           labels.json     optional, one {"<tag id>": [[x, y] * 4]} per frame, the
+#                           known tags processing.detector_tuning scores against
+#           *.jpg / *.png   frames, in name order when frames.jsonl is missing
+#       <camera name>.mp4   or a video file per camera (.mp4, .avi, .mkv)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv")
+CAMERA_METADATA = "camera.json"
+FRAME_INDEX = "frames.jsonl"
+TAG_LABELS = "labels.json"
+
+
+class ReplayPace(Enum):
+    RECORDED = "recorded"  # Sleep so frames arrive at their recorded spacing
+    FAST = "fast"  # Hand out frames as fast as they are read
+
+
+def list_replay_sources(replay_path: str) -> list[str]:
+    sources = []
+
+    for name in sorted(os.listdir(replay_path)):
+        path = os.path.join(replay_path, name)
+
+        if os.path.isdir(path) or name.lower().endswith(VIDEO_EXTENSIONS):
+            sources.append(path)
+
+    return sources
+
+
+def load_metadata(source: str) -> dict:
+    try:
+        with open(os.path.join(source, CAMERA_METADATA), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, NotADirectoryError, json.decoder.JSONDecodeError):
+        return {}
+
+
+class ReplayCamera:
+    """
+    Plays back recorded frames in place of a cv2.VideoCapture.
+
+    Frames come from a directory of images or a video file and loop forever.
+    get(cv2.CAP_PROP_POS_MSEC) reports the time the frame was handed out on
+    the monotonic clock, like a live camera, and the original timestamp is
+    kept in recorded_timestamp_ms.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    DEFAULT_FRAME_INTERVAL_MS = 20.0
+
+    def __init__(self, source: str, pace: ReplayPace = ReplayPace.RECORDED):
+        self.source = source
+        self.pace = pace
+        self.convert_rgb = True
+        self.video: cv2.VideoCapture | None = None
+        self.frames: list[tuple[str, float]] = []
+
+        if os.path.isdir(source):
+            self.frames = self._load_frame_index(source)
+        else:
+            self.video = cv2.VideoCapture(source)
+
+        # Only JPEG sequences can hand out raw frames like an MJPG camera
+        self.is_jpeg = len(self.frames) > 0 and all(
+            path.lower().endswith((".jpg", ".jpeg")) for path, _ in self.frames
+        )
+
+        self.index = 0
+        self.timestamp_ms = 0.0
+        self.recorded_timestamp_ms = 0.0
+
+        # Monotonic time matching the first recorded timestamp of this loop
+        self.start_time_ms: float | None = None
+        self.start_recorded_ms = 0.0
+
+        self.frames_read = 0
+
+    @staticmethod
+    def _load_frame_index(source: str) -> list[tuple[str, float]]:
+        try:
+            with open(os.path.join(source, FRAME_INDEX), "r") as f:
+                return [
+                    (os.path.join(source, entry["file"]), float(entry["timestamp"]))
+                    for entry in map(json.loads, filter(str.strip, f))
+                ]
+        except FileNotFoundError:
+            files = sorted(
+                f for f in os.listdir(source) if f.lower().endswith(IMAGE_EXTENSIONS)
+            )
+            return [
+                (
+                    os.path.join(source, f),
+                    i * ReplayCamera.DEFAULT_FRAME_INTERVAL_MS,
+                )
+                for i, f in enumerate(files)
+            ]
+
+    # Back to the first frame, as if nothing was read yet
+    def rewind(self):
+        if self.video is not None:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+        self.index = 0
+        self.start_time_ms = None
+        self.frames_read = 0
+
+    def isOpened(self) -> bool:
+        if self.video is not None:
+            return self.video.isOpened()
+
+        return len(self.frames) > 0
+
+    def _next_frame(self, image: np.ndarray | None) -> tuple[bool, np.ndarray | None, float]:
+        if self.video is not None:
+            ret, img = self.video.read(image=image)
+
+            if not ret:
+                # Loop back to the start
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                self.start_time_ms = None
+                ret, img = self.video.read(image=image)
+
+            return ret, img, self.video.get(cv2.CAP_PROP_POS_MSEC)
+
+        if self.index >= len(self.frames):
+            self.index = 0
+            self.start_time_ms = None
+
+        path, recorded_ms = self.frames[self.index]
+        self.index += 1
+
+        if path.lower().endswith((".jpg", ".jpeg")):
+            with open(path, "rb") as f:
+                data = np.frombuffer(f.read(), dtype=np.uint8)
+
+            if not self.convert_rgb and self.is_jpeg:
+                # Raw JPEG, like an MJPG camera with CAP_PROP_CONVERT_RGB off
+                return True, data.reshape(1, -1), recorded_ms
+
+            height, width, _, _ = simplejpeg.decode_jpeg_header(data)
+            if image is None or image.shape != (height, width, 3):
+                image = np.empty((height, width, 3), dtype=np.uint8)
+
+            simplejpeg.decode_jpeg(data, colorspace="BGR", buffer=image.reshape(-1))
+            return True, image, recorded_ms
+
+        img = cv2.imread(path)
+        return img is not None, img, recorded_ms
+
+    def read(self, image: np.ndarray | None = None) -> tuple[bool, np.ndarray | None]:
+        ret, img, recorded_ms = self._next_frame(image)
+
+        if not ret:
+            ReplayCamera.logger.error(f"Failed to read replay frame from {self.source}")
+            return False, None
+
+        now_ms = time.monotonic() * 1000
+
+        if self.start_time_ms is None:
+            self.start_time_ms = now_ms
+            self.start_recorded_ms = recorded_ms
+
+        if self.pace == ReplayPace.RECORDED:
+            wait_ms = (recorded_ms - self.start_recorded_ms) - (now_ms - self.start_time_ms)
+            if wait_ms > 0:
+                time.sleep(wait_ms / 1000)
+                now_ms += wait_ms
+
+        self.timestamp_ms = now_ms
+        self.recorded_timestamp_ms = recorded_ms
+        self.frames_read += 1
+
+        return True, img
+
+    def get(self, prop: int) -> float:
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.timestamp_ms
+        elif prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.frames_read)
+        elif prop == cv2.CAP_PROP_FOURCC:
+            return float(gray_capture.MJPG if self.is_jpeg else 0)
+        elif prop == cv2.CAP_PROP_CONVERT_RGB:
+            return float(self.convert_rgb)
+        elif self.video is not None:
+            return self.video.get(prop)
+
+        return 0.0
+
+    def set(self, prop: int, value: float) -> bool:
+        if prop == cv2.CAP_PROP_CONVERT_RGB:
+            self.convert_rgb = bool(value) or not self.is_jpeg
+            return True
+
+        return False
+
+    def release(self):
+        if self.video is not None:
+            self.video.release()
+
+
+class ReplayCameraInfo(CameraInfo):
+    """CameraInfo for a replay source, there are no controls or formats to change"""
+
+    BACKENDS = (Backends.REPLAY,)
+
+    def __init__(self, cam: ReplayCamera, identifier: str):
+        # What was recorded with the frames
+        self.metadata = load_metadata(cam.source)
+
+        super().__init__(
+            cam,
+            identifier,
+            np.asarray(self.metadata["K"]) if "K" in self.metadata else None,
+            np.asarray(self.metadata["dist"]) if "dist" in self.metadata else None,
+            Backends.REPLAY,
+        )
+
+        self.mode = Modes(self.metadata.get("mode", Modes.POSE_ESTIMATION.value))
+        self.robot_to_camera = {
+            name: float(self.metadata.get(name, 0.0)) for name in EXTRINSICS
+        }
+        self.detection_mask = load_detection_mask(identifier)
+
+    # The recorded format, frames come at the recorded pace
+    def init_device(self):
+        # Videos know their size, image sequences peek at a frame when the
+        # resolution was not recorded
+        if "resolution" in self.metadata:
+            self.resolution = tuple(self.metadata["resolution"])
+        elif self.cam.video is not None:
+            self.resolution = (
+                int(self.cam.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(self.cam.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            )
+        else:
+            _, img = self.cam.read()
+            self.resolution = (img.shape[1], img.shape[0])
+            self.cam.rewind()
+
+        self.controller = None
+        self.controls = {}
+        self.control_values = {}
+
+        self.color_format = "Replay"
+        self.valid_formats = {self.color_format: [self.resolution]}
+        self.valid_color_formats = {self.color_format: None}
+        self.frame_rate = round(1000 / ReplayCamera.DEFAULT_FRAME_INTERVAL_MS)
+        self.valid_frame_rates = {
+            self.frame_rate: ReplayCamera.DEFAULT_FRAME_INTERVAL_MS / 1000
+        }
+        self.fourcc = int(self.cam.get(cv2.CAP_PROP_FOURCC))
+
+    def get_supported_resolutions(self):
+        return [self.resolution]
+
+    def set_format(self, color_format: str, resolution: tuple[int, int]) -> bool:
+        return color_format == self.color_format and tuple(resolution) == self.resolution
+
+    def set_frame_rate(self, frame_rate: int) -> bool:
+        return False
+
+    def set(self, control_name: str, value: int | str) -> bool:
+        return False
+
+    def get(self, control_name: str):
+        return 0
+
+    def get_format(self) -> None:
+        pass
@@ -0,0 +1,333 @@
+import cv2
+import ctypes
+import errno
+import fcntl
+import logging
+import mmap
+import numpy as np
+import os
+import select
+import simplejpeg
+
+from camera import gray_capture
+from camera.v4l2_ioctl import (
+    V4L2_BUF_TYPE_VIDEO_CAPTURE,
+    V4L2_CID_EXPOSURE_AUTO,
+    V4L2_FIELD_ANY,
+    V4L2_MEMORY_MMAP,
+    VIDIOC_DQBUF,
+    VIDIOC_G_FMT,
+    VIDIOC_G_PARM,
+    VIDIOC_QBUF,
+    VIDIOC_QUERYBUF,
+    VIDIOC_REQBUFS,
+    VIDIOC_S_CTRL,
+    VIDIOC_S_FMT,
+    VIDIOC_S_PARM,
+    VIDIOC_STREAMOFF,
+    VIDIOC_STREAMON,
+    v4l2_buffer,
+    v4l2_control,
+    v4l2_format,
+    v4l2_requestbuffers,
+    v4l2_streamparm,
+)
+
+
+class V4L2Capture:
+    """
+    Capture backend that streams straight from V4L2 mmap buffers.
+
+    Drop-in for the parts of cv2.VideoCapture that wallEYE uses. On top of
+    that every read exposes the kernel buffer timestamp (CLOCK_MONOTONIC,
+    stamped by uvcvideo when the first packet of the frame arrives) and the
+    driver's frame sequence number, so dropped frames and glass time can be
+    measured instead of guessed.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    DEFAULT_BUFFERS = 2
+    READ_TIMEOUT = 1.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd: int | None = None
+        self.buffers: list[mmap.mmap] = []
+        self.buffer_count = V4L2Capture.DEFAULT_BUFFERS
+        self.streaming = False
+        self.convert_rgb = True
+
+        # From the last dequeued buffer
+        self.timestamp_ms = 0.0
+        self.sequence = 0
+        # Compressed bytes of the last MJPG frame decoded by read()
+        self.last_jpeg: np.ndarray | None = None
+
+        try:
+            self.fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+            self._load_format()
+        except OSError as e:
+            V4L2Capture.logger.error(f"Failed to open {path}: {e}")
+            self.release()
+
+    def isOpened(self) -> bool:
+        return self.fd is not None
+
+    def _load_format(self):
+        fmt = v4l2_format(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        fcntl.ioctl(self.fd, VIDIOC_G_FMT, fmt)
+        self.width = fmt.fmt.pix.width
+        self.height = fmt.fmt.pix.height
+        self.fourcc = fmt.fmt.pix.pixelformat
+
+    def _set_format(self, width: int, height: int, fourcc: int):
+        self._stop()
+
+        fmt = v4l2_format(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        fcntl.ioctl(self.fd, VIDIOC_G_FMT, fmt)
+        fmt.fmt.pix.width = width
+        fmt.fmt.pix.height = height
+        fmt.fmt.pix.pixelformat = fourcc
+        fmt.fmt.pix.field = V4L2_FIELD_ANY
+        fcntl.ioctl(self.fd, VIDIOC_S_FMT, fmt)
+
+        self._load_format()
+
+    def _get_parm(self) -> v4l2_streamparm:
+        parm = v4l2_streamparm(type=V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        fcntl.ioctl(self.fd, VIDIOC_G_PARM, parm)
+        return parm
+
+    def _set_frame_rate(self, frame_rate: float):
+        self._stop()
+
+        parm = self._get_parm()
+        parm.parm.capture.timeperframe.numerator = 1
+        parm.parm.capture.timeperframe.denominator = int(frame_rate)
+        fcntl.ioctl(self.fd, VIDIOC_S_PARM, parm)
+
+    def _start(self):
+        request = v4l2_requestbuffers(
+            count=self.buffer_count,
+            type=V4L2_BUF_TYPE_VIDEO_CAPTURE,
+            memory=V4L2_MEMORY_MMAP,
+        )
+        fcntl.ioctl(self.fd, VIDIOC_REQBUFS, request)
+
+        for index in range(request.count):
+            buf = self._make_buffer(index)
+            fcntl.ioctl(self.fd, VIDIOC_QUERYBUF, buf)
+
+            self.buffers.append(
+                mmap.mmap(
+                    self.fd,
+                    buf.length,
+                    mmap.MAP_SHARED,
+                    mmap.PROT_READ | mmap.PROT_WRITE,
+                    offset=buf.m.offset,
+                )
+            )
+            fcntl.ioctl(self.fd, VIDIOC_QBUF, buf)
+
+        fcntl.ioctl(
+            self.fd, VIDIOC_STREAMON, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE)
+        )
+        self.streaming = True
+
+    def _stop(self):
+        if self.streaming:
+            fcntl.ioctl(
+                self.fd, VIDIOC_STREAMOFF, ctypes.c_int(V4L2_BUF_TYPE_VIDEO_CAPTURE)
+            )
+            self.streaming = False
+
+        for buffer in self.buffers:
+            buffer.close()
+        self.buffers = []
+
+        if self.fd is not None:
+            # Free the kernel buffers so the format can change
+            fcntl.ioctl(
+                self.fd,
+                VIDIOC_REQBUFS,
+                v4l2_requestbuffers(
+                    count=0,
+                    type=V4L2_BUF_TYPE_VIDEO_CAPTURE,
+                    memory=V4L2_MEMORY_MMAP,
+                ),
+            )
+
+    def _make_buffer(self, index: int = 0) -> v4l2_buffer:
+        return v4l2_buffer(
+            index=index, type=V4L2_BUF_TYPE_VIDEO_CAPTURE, memory=V4L2_MEMORY_MMAP
+        )
+
+    # Dequeue a filled buffer, None if there is none ready
+    def _dequeue(self) -> v4l2_buffer | None:
+        buf = self._make_buffer()
+        try:
+            fcntl.ioctl(self.fd, VIDIOC_DQBUF, buf)
+        except BlockingIOError:
+            return None
+        return buf
+
+    # Wait for a frame and return the newest one queued up
+    def _dequeue_latest(self) -> v4l2_buffer | None:
+        ready, _, _ = select.select((self.fd,), (), (), V4L2Capture.READ_TIMEOUT)
+        if not ready:
+            V4L2Capture.logger.warning(f"Timed out waiting for a frame from {self.path}")
+            return None
+
+        buf = self._dequeue()
+
+        # Older frames piled up, hand them straight back
+        while buf is not None and (newer := self._dequeue()) is not None:
+            fcntl.ioctl(self.fd, VIDIOC_QBUF, buf)
+            buf = newer
+
+        return buf
+
+    def read(self, image: np.ndarray | None = None) -> tuple[bool, np.ndarray | None]:
+        if self.fd is None:
+            return False, None
+
+        try:
+            if not self.streaming:
+                self._start()
+
+            buf = self._dequeue_latest()
+            if buf is None:
+                return False, None
+
+            try:
+                data = np.frombuffer(
+                    self.buffers[buf.index], dtype=np.uint8, count=buf.bytesused
+                )
+                img = self._convert(data, image)
+                del data
+            finally:
+                fcntl.ioctl(self.fd, VIDIOC_QBUF, buf)
+
+            self.timestamp_ms = (
+                buf.timestamp.tv_sec * 1000 + buf.timestamp.tv_usec / 1000
+            )
+            self.sequence = buf.sequence
+
+            return True, img
+
+        except (OSError, ValueError) as e:
+            if isinstance(e, OSError) and e.errno == errno.ENODEV:
+                V4L2Capture.logger.error(f"{self.path} disconnected")
+            else:
+                V4L2Capture.logger.error(f"Failed to read {self.path}: {e}")
+            return False, None
+
+    # Copy a frame out of the mmap buffer before it is requeued, the same way
+    # cv2.VideoCapture would hand it back
+    def _convert(self, data: np.ndarray, image: np.ndarray | None) -> np.ndarray:
+        self.last_jpeg = None
+
+        if not self.convert_rgb:
+            if self.fourcc == gray_capture.YUYV:
+                shape = (1, data.size)
+                if image is None or image.shape != shape:
+                    image = np.empty(shape, dtype=np.uint8)
+                np.copyto(image.reshape(-1), data)
+                return image
+
+            return data.reshape(1, -1).copy()
+
+        shape = (self.height, self.width, 3)
+        if image is None or image.shape != shape:
+            image = np.empty(shape, dtype=np.uint8)
+
+        if self.fourcc == gray_capture.MJPG:
+            simplejpeg.decode_jpeg(data, colorspace="BGR", buffer=image.reshape(-1))
+            # Small next to the decoded frame, lets recordings skip re-encoding
+            self.last_jpeg = data.copy()
+        elif self.fourcc == gray_capture.YUYV:
+            cv2.cvtColor(
+                data.reshape(self.height, self.width, 2),
+                cv2.COLOR_YUV2BGR_YUYV,
+                dst=image,
+            )
+        else:
+            raise ValueError(f"Unsupported pixel format {self.fourcc:#x}")
+
+        return image
+
+    def get(self, prop: int) -> float:
+        if self.fd is None:
+            return 0.0
+
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.timestamp_ms
+        elif prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.sequence)
+        elif prop == cv2.CAP_PROP_FOURCC:
+            return float(self.fourcc)
+        elif prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        elif prop == cv2.CAP_PROP_FPS:
+            timeperframe = self._get_parm().parm.capture.timeperframe
+            return timeperframe.denominator / max(timeperframe.numerator, 1)
+        elif prop == cv2.CAP_PROP_CONVERT_RGB:
+            return float(self.convert_rgb)
+        elif prop == cv2.CAP_PROP_BUFFERSIZE:
+            return float(self.buffer_count)
+
+        return 0.0
+
+    def set(self, prop: int, value: float) -> bool:
+        if self.fd is None:
+            return False
+
+        try:
+            if prop == cv2.CAP_PROP_FOURCC:
+                self._set_format(self.width, self.height, int(value))
+            elif prop == cv2.CAP_PROP_FRAME_WIDTH:
+                self._set_format(int(value), self.height, self.fourcc)
+            elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+                self._set_format(self.width, int(value), self.fourcc)
+            elif prop == cv2.CAP_PROP_FPS:
+                self._set_frame_rate(value)
+            elif prop == cv2.CAP_PROP_CONVERT_RGB:
+                self.convert_rgb = bool(value)
+            elif prop == cv2.CAP_PROP_AUTO_EXPOSURE:
+                # Same raw V4L2 menu value cv2.CAP_V4L2 passes through
+                fcntl.ioctl(
+                    self.fd,
+                    VIDIOC_S_CTRL,
+                    v4l2_control(id=V4L2_CID_EXPOSURE_AUTO, value=int(value)),
+                )
+            elif prop == cv2.CAP_PROP_BUFFERSIZE:
+                # Streaming needs at least two buffers, stale ones are
+                # dropped on read anyway
+                self._stop()
+                self.buffer_count = max(V4L2Capture.DEFAULT_BUFFERS, int(value))
+            else:
+                # Other controls go through pyrav4l2 in CameraInfo
+                return False
+
+            return True
+
+        except OSError as e:
+            V4L2Capture.logger.error(f"Failed to set {prop} to {value} on {self.path}: {e}")
+
+        return False
+
+    def release(self):
+        if self.fd is None:
+            return
+
+        try:
+            self._stop()
+        except OSError:
+            # Device is likely gone already
+            pass
+
+        os.close(self.fd)
+        self.fd = None
@@ -11,7 +11,9 @@ CONFIG_DATA_PATH = os.path.join(CONFIG_DIRECTORY, "system_data.json")
 LOG = os.path.join(PARENT, "walleye.log")
 CONFIG_ZIP = os.path.join(PARENT, "config.zip")
 TAG_LAYOUT_PATH = os.path.join(CONFIG_DIRECTORY, "april_tag_layout.json")
+DETECTOR_PROFILES_PATH = os.path.join(CONFIG_DIRECTORY, "detector_profiles.json")
 FALLBACK_TAG_LAYOUT_PATH = os.path.join("processing", "april_tag_layout.json")
+RECORDING_DIRECTORY = os.path.join(PARENT, "recordings")
 
 pathlib.Path(CONFIG_DIRECTORY).mkdir(parents=True, exist_ok=True)
 
@@ -37,5 +39,19 @@ def cam_config_path(identifier: str) -> str:
     )
 
 
+def device_cache_path(identifier: str) -> str:
+    return os.path.join(
+        CAMERA_CONFIG_DIRECTORY,
+        f"device_cache_{clean_identifier(identifier)}.json",
+    )
+
+
+def detection_mask_path(identifier: str) -> str:
+    return os.path.join(
+        CAMERA_CONFIG_DIRECTORY,
+        f"detection_mask_{clean_identifier(identifier)}.json",
+    )
+
+
 def full_cam_path(identifier: str) -> str:
     return os.path.join(V4L_PATH, identifier)
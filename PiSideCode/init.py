@@ -39,22 +39,46 @@ time.sleep(1.0)
 logger.info("Camera repower complete!")
 
 from state import walleye_data, States, CALIBRATION_STATES
-from processing.pose_processing import PoseProcessor
-from processing.tag_processing import TagProcessor
+from processing.camera_processor import CameraProcessor, thread_budget
 from camera.camera import Cameras
 from camera.camera_info import Modes
+from camera.gray_capture import to_color
+from processing.vision_worker import VisionWorker
+from processing.joint_pose import JointPoseSolver
+from camera.match_recorder import MatchRecorder
 from calibration.calibration import Calibrator
 
+# Vision workers are forked before capture, web and logging threads start
+# (see VisionWorker), only ntcore's client runs already and workers never
+# call into it. Cameras that don't open lose theirs below
+vision_workers = {}
+if walleye_data.use_worker_processes:
+    worker_identifiers = Cameras.find_identifiers(walleye_data.replay_path)
+    vision_workers = {
+        identifier: VisionWorker(
+            identifier,
+            thread_budget(len(worker_identifiers)),
+            walleye_data.apriltag_options(),
+        )
+        for identifier in worker_identifiers
+    }
+
 # Create and intialize cameras, save to local var
-cameras = walleye_data.cameras = Cameras()
+cameras = walleye_data.cameras = Cameras(
+    walleye_data.replay_path, walleye_data.replay_pace
+)
 camera_infos = walleye_data.cameras.info
-last_connected_time = {idx: time.time() for idx in camera_infos}
-disconnect_timeout = 5.0 # Give it 5 seconds to recover
+last_connected_time = {identifier: time.time() for identifier in camera_infos}
+disconnect_timeout = 5.0 # Give it 5 seconds to recover before reporting it
 
 for i in camera_infos:
     if i not in walleye_data.cam_nicknames:
         walleye_data.cam_nicknames[i] = i
 
+for identifier in list(vision_workers):
+    if identifier not in camera_infos:
+        vision_workers.pop(identifier).close()
+
 # Initialize web interface after walleye_data.cameras is set
 from web_interface.web_interface import (
     cam_buffers,
@@ -65,6 +89,8 @@ from web_interface.web_interface import (
 
 import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import cv2
 
 def get_temp_data():
     return subprocess.run(["sensors"], capture_output=True).stdout.decode("utf-8")
@@ -73,7 +99,7 @@ def log_performance(walleye_data):
     """Logs loop time and individual camera read times every 30 seconds"""
     while True:
         logger.info(
-            f"Loop time: {walleye_data.loop_time} | Cam delay: {walleye_data.cam_read_delay} | {get_temp_data()}"
+            f"Loop time: {walleye_data.loop_time} | Cam delay: {walleye_data.cam_read_delay} | Recovery ms: {walleye_data.cameras.recovery_time} | {get_temp_data()}"
         )
         eventlet.sleep(30)
 
@@ -94,6 +120,7 @@ web_server = threading.Thread(
     daemon=True,
 )
 
+recorder = None
 
 try:
     # Start threads
@@ -104,8 +131,32 @@ try:
 
     images = {}
     calibrators = {}
-    tag_processor = TagProcessor()
-    pose_estimator = PoseProcessor(tag_processor, walleye_data.tag_size)
+    # Detection and pose state of each camera processed in this process
+    camera_processors: dict[str, CameraProcessor] = {}
+    sweep_interval = (
+        walleye_data.roi_sweep_interval if walleye_data.roi_tracking else None
+    )
+    servo_interval = (
+        walleye_data.servo_detection_interval
+        if walleye_data.servo_tracking
+        else None
+    )
+
+    # Cameras are processed at the same time on this pool, OpenCV's own
+    # threads are split between them (see thread_budget)
+    pool_size = (os.cpu_count() or 1) if walleye_data.parallel_cameras else 1
+    processing_pool = ThreadPoolExecutor(
+        max_workers=pool_size, thread_name_prefix="camera_processing"
+    )
+    cv2_threads = None
+
+    # With worker processes the main loop only aggregates and publishes
+    if walleye_data.use_worker_processes:
+        logger.info(f"Started {len(vision_workers)} vision worker processes")
+
+    # Match recording, frames are written by a background thread
+    if walleye_data.recording:
+        recorder = MatchRecorder(every_n=walleye_data.record_every_n)
     # walleye_data.make_publisher(
     #     walleye_data.team_number, walleye_data.table_name, walleye_data.udp_port)
     walleye_data.current_state = States.PROCESSING  # Default state is PROCESSING
@@ -126,6 +177,8 @@ try:
         # Use when reading for readability
         curr_state = walleye_data.current_state
         curr_calib_cam = walleye_data.camera_in_calibration
+        # Cameras come and go at runtime
+        camera_infos = cameras.info
 
         # State changes
         # Pre-Calibration
@@ -219,8 +272,7 @@ try:
 
         # AprilTag processing state
         elif curr_state == States.PROCESSING:
-            # Set tag size, grab camera frames, and grab image timestamp
-            pose_estimator.set_tag_size(walleye_data.tag_size)
+            # Grab camera frames and image timestamps
 
             # image_time = walleye_data.robot_publisher.get_time()
 
@@ -228,25 +280,35 @@ try:
                 cameras.get_frames_for_processing()
             )
 
-            for idx, is_connected in enumerate(connections.values()):
+            # Drop frames of cameras unplugged since
+            camera_infos = cameras.info
+            images = {
+                identifier: image
+                for identifier, image in images.items()
+                if identifier in camera_infos
+            }
+
+            for identifier, is_connected in connections.items():
+                # Indices stay with the camera through unplugs and replugs
+                idx = cameras.index[identifier]
                 was_connected = walleye_data.robot_publisher.get_connection_value(idx)
 
                 if is_connected:
                     # Is connected so update 'last connected time' and publisher
-                    last_connected_time[idx] = time.time()
+                    last_connected_time[identifier] = time.time()
                     walleye_data.robot_publisher.set_connection_value(idx, True)
                 elif was_connected:
                     # Not connected but was connected = lost it
 
                     # Calculate down time
-                    down_duration = time.time() - last_connected_time[idx]
+                    down_duration = time.time() - last_connected_time.get(identifier, 0)
 
-                    # Only kill app if it stays disconnected for a while
+                    # Only report it once it stays disconnected for a while,
+                    # the camera supervisor keeps trying to bring it back and
+                    # the other cameras keep running
                     if down_duration >= disconnect_timeout:
                         walleye_data.robot_publisher.set_connection_value(idx, False)
-                        
-                        logger.critical(f"Camera unrecoverable! Quitting!!")
-                        raise RuntimeError("A camera has disconnected and not recovered: Restarting wallEYE!!")
+                        logger.error(f"Camera {identifier} lost, waiting for it to come back")
 
             # Use the pose_estimator class to find the pose, tags, and ambiguity
             # poses, tags, ambig, tag_centers = pose_estimator.get_pose(
@@ -255,68 +317,250 @@ try:
             #     walleye_data.cameras.list_d(),
             #     np.asarray([i.resolution for i in walleye_data.cameras.info.values()]),
             # )
-            poses, tags, ambig, tag_corners = [], [], [], []
+            poses, tags, ambig, tag_corners, pose_cams = [], [], [], [], []
+            servo_tags, servo_corners, servo_cams = [], [], []
+            web_img_info = {}
+
+            # Copy frames to record before annotations are drawn on them
+            recorded = {}
+            if recorder is not None:
+                for identifier, image in images.items():
+                    recorded[identifier] = recorder.begin(
+                        camera_infos[identifier],
+                        image,
+                        cameras.get_raw_frame(identifier),
+                        img_time[identifier],
+                    )
 
-            for identifier, image in images.items():
-                curr_mode = camera_infos[identifier].mode
-                if curr_mode == Modes.POSE_ESTIMATION:
-                    img_pose, img_tags, img_tag_corners, img_ambig = pose_estimator.get_pose(
+            # Gray frames only get color when there is someone to draw for
+            if walleye_data.should_update_web_stream:
+                for identifier, image in images.items():
+                    images[identifier] = to_color(image)
+
+            # Mode each frame is processed in, the web interface may change it
+            # while frames are in flight
+            frame_modes = {
+                identifier: camera_infos[identifier].mode for identifier in images
+            }
+
+            # Odometry for cameras with guided search, once for all of them
+            robot_pose = walleye_data.robot_publisher.get_robot_pose()
+
+            # Frames without a worker result (none, no worker processes or a
+            # camera plugged in after start up) are processed in this process
+            # below
+            worker_results = {}
+            # What each POSE_ESTIMATION camera's pose was solved on
+            camera_solves = {}
+
+            if vision_workers:
+                # Hand every frame off before waiting so the workers overlap
+                submitted = []
+                for identifier, image in images.items():
+                    curr_mode = frame_modes[identifier]
+                    if (
+                        image is None
+                        or curr_mode == Modes.DISABLED
+                        or identifier not in vision_workers
+                    ):
+                        continue
+
+                    vision_workers[identifier].submit(
                         image,
+                        curr_mode,
                         camera_infos[identifier].K,
                         camera_infos[identifier].D,
                         walleye_data.should_update_web_stream,
                         walleye_data.valid_tags,
+                        walleye_data.tag_size,
+                        sweep_interval,
+                        camera_infos[identifier].decimation,
+                        camera_infos[identifier].detector,
+                        camera_infos[identifier].tiles,
+                        robot_pose,
+                        camera_infos[identifier].search_extrinsics(),
+                        camera_infos[identifier].detection_mask,
+                        servo_interval,
+                        camera_infos[identifier].detector_params,
+                        walleye_data.pose_tracking,
                     )
-
-
-                    poses.append(img_pose)
-                    tags.append(img_tags)
-                    tag_corners.append(img_tag_corners)
-                    ambig.append(img_ambig)
-
-                elif curr_mode == Modes.TAG_SERVOING:
-                    img_ids, img_tag_corners = tag_processor.get_tags(
-                        image,
-                        walleye_data.valid_tags,
-                        walleye_data.should_update_web_stream,
+                    submitted.append(identifier)
+
+                for identifier in submitted:
+                    try:
+                        worker_results[identifier] = vision_workers[identifier].collect()
+                        camera_solves[identifier] = vision_workers[identifier].camera_solve
+                    except (RuntimeError, EOFError, OSError) as e:
+                        # Only this camera loses its worker, process it here from now on
+                        logger.error(f"Vision worker for {identifier} failed: {e}")
+                        vision_workers.pop(identifier).close()
+                        continue
+
+                    # Annotations were drawn into the worker's copy
+                    if walleye_data.should_update_web_stream:
+                        images[identifier] = vision_workers[identifier].frame
+
+            # Forget cameras that were unplugged
+            for identifier in list(camera_processors):
+                if identifier not in camera_infos:
+                    del camera_processors[identifier]
+
+            to_process = [
+                identifier
+                for identifier in images
+                if identifier not in worker_results
+                and frame_modes[identifier] != Modes.DISABLED
+            ]
+
+            # Split OpenCV's threads between the cameras running at once
+            budget = thread_budget(min(len(to_process), pool_size))
+            if budget != cv2_threads:
+                cv2.setNumThreads(budget)
+                cv2_threads = budget
+
+            processing = {}
+            for identifier in to_process:
+                if identifier not in camera_processors:
+                    camera_processors[identifier] = CameraProcessor(
+                        identifier, walleye_data.apriltag_options()
                     )
-                    tags.append(img_ids)
-                    tag_corners.append(img_tag_corners)
 
-                else:
-                    pass
+                processing[identifier] = processing_pool.submit(
+                    camera_processors[identifier].process,
+                    images[identifier],
+                    frame_modes[identifier],
+                    camera_infos[identifier].K,
+                    camera_infos[identifier].D,
+                    walleye_data.should_update_web_stream,
+                    walleye_data.valid_tags,
+                    walleye_data.tag_size,
+                    sweep_interval,
+                    camera_infos[identifier].decimation,
+                    camera_infos[identifier].detector,
+                    camera_infos[identifier].tiles,
+                    robot_pose,
+                    camera_infos[identifier].search_extrinsics(),
+                    camera_infos[identifier].detection_mask,
+                    servo_interval,
+                    camera_infos[identifier].detector_params,
+                    walleye_data.pose_tracking,
+                )
+
+            # Results are gathered in camera order, whichever finished first
+            for identifier, image in images.items():
+                curr_mode = frame_modes[identifier]
+                detections = None
+
+                # A bad frame or calibration only costs this camera this frame
+                try:
+                    if identifier in worker_results:
+                        result = worker_results[identifier]
+                    elif identifier in processing:
+                        result = processing[identifier].result()
+                        camera_solves[identifier] = camera_processors[
+                            identifier
+                        ].camera_solve()
+
+                    if curr_mode == Modes.POSE_ESTIMATION:
+                        img_pose, img_tags, img_tag_corners, img_ambig = result
+
+                        poses.append(img_pose)
+                        tags.append(img_tags)
+                        tag_corners.append(img_tag_corners)
+                        ambig.append(img_ambig)
+                        pose_cams.append(identifier)
+                        web_img_info[identifier] = img_pose
+
+                        detections = {
+                            "ids": img_tags,
+                            "corners": img_tag_corners,
+                            "poses": img_pose,
+                            "ambiguity": img_ambig,
+                        }
+
+                    elif curr_mode == Modes.TAG_SERVOING:
+                        img_ids, img_tag_corners = result
+
+                        servo_tags.append(img_ids)
+                        servo_corners.append(img_tag_corners)
+                        servo_cams.append(identifier)
+                        web_img_info[identifier] = (img_ids, img_tag_corners)
+
+                        detections = {"ids": img_ids, "corners": img_tag_corners}
+
+                    else:
+                        pass
+
+                except Exception as e:
+                    logger.error(f"Processing failed for {identifier}", exc_info=e)
+
+                if recorder is not None:
+                    recorder.finish(recorded[identifier], detections)
             
             # Pose mode
+            # One robot pose from all POSE_ESTIMATION cameras, besides theirs
+            if walleye_data.joint_pose and len(pose_cams) > 0:
+                robot_pose_result = None
+                try:
+                    robot_pose_result = JointPoseSolver.solve(
+                        {
+                            identifier: (
+                                camera_solves.get(identifier),
+                                camera_infos[identifier].extrinsics(),
+                                img_time[identifier],
+                            )
+                            for identifier in pose_cams
+                        }
+                    )
+                except Exception as e:
+                    logger.error("Joint pose solve failed", exc_info=e)
+
+                if robot_pose_result is not None:
+                    pose, error, solved_cams, solved_time = robot_pose_result
+                    walleye_data.robot_publisher.udp_robot_pose_publish(
+                        pose,
+                        error,
+                        [
+                            walleye_data.cam_nicknames.get(identifier, identifier)
+                            for identifier in solved_cams
+                        ],
+                        [tags[pose_cams.index(identifier)] for identifier in solved_cams],
+                        solved_time,
+                    )
+
             if len(poses) > 0:
                 # Publish camera number, timestamp, poses, tags, ambiguity and increase the update number
                 # for i in range(len(poses)):
                 #     if poses[i][0].X() < 2000: # TODO what is this doing here?
                 walleye_data.robot_publisher.udp_pose_publish(
-                    [walleye_data.cam_nicknames[identifier] for identifier in images.keys()],
+                    [cameras.index[identifier] for identifier in pose_cams],
+                    [walleye_data.cam_nicknames.get(identifier, identifier) for identifier in pose_cams],
                     [pose[0] for pose in poses],
                     [pose[1] for pose in poses],
                     ambig,
                     # [image_time] * len(poses),
-                    list(img_time.values()),
+                    [img_time[identifier] for identifier in pose_cams],
                     tags,
                     tag_corners
                 )
 
             # Tag servoing mode
-            elif len(tag_corners) > 0:
-                walleye_data.robot_publisher.udp_tag_publish([walleye_data.cam_nicknames[identifier] for identifier in images.keys()], tags, tag_corners, list(img_time.values()))
+            if len(servo_corners) > 0:
+                walleye_data.robot_publisher.udp_tag_publish(
+                    [cameras.index[identifier] for identifier in servo_cams],
+                    [walleye_data.cam_nicknames.get(identifier, identifier) for identifier in servo_cams],
+                    servo_tags,
+                    servo_corners,
+                    [img_time[identifier] for identifier in servo_cams],
+                )
 
             # Update video stream for web interface
             if walleye_data.should_update_web_stream:
-                for i, (identifier, img) in enumerate(images.items()):
+                for identifier, img in images.items():
                     if curr_state != States.CALIBRATION_CAPTURE: 
                         cam_buffers[identifier].update(img)
-                    if camera_infos[
-                        identifier
-                    ].mode == Modes.POSE_ESTIMATION and i < len(poses):
-                        walleye_data.set_web_img_info(identifier, poses[i])
-                    elif camera_infos[identifier].mode == Modes.TAG_SERVOING:
-                        walleye_data.set_web_img_info(identifier, (tags[i], tag_corners[i]))
+                    if identifier in web_img_info:
+                        walleye_data.set_web_img_info(identifier, web_img_info[identifier])
                     # if walleye_data.visualizing_poses:
                     #     visualization_buffers[identifier].update(
                     #         (poses[i][0].X(), poses[i][0].Y(), poses[i][0].Z()),
@@ -326,6 +570,11 @@ try:
         # Ends the WallEye program through the web interface
         elif curr_state == States.SHUTDOWN:
             logger.info("Shutting down")
+            for worker in vision_workers.values():
+                worker.close()
+            processing_pool.shutdown(wait=False)
+            if recorder is not None:
+                recorder.close()
             socketio.stop()
             logging.shutdown()
             break
@@ -345,6 +594,10 @@ except Exception as e:
     display_info(f"CRITICAL ERROR: {e}")
     logging.critical(e, exc_info=True)
     logger.info("Shutting down")
+    for worker in vision_workers.values():
+        worker.close()
+    if recorder is not None:
+        recorder.close()
     walleye_data.robot_publisher.destroy()
     socketio.stop()
     logging.shutdown()
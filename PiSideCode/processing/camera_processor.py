@@ -0,0 +1,185 @@
+import cv2
+import logging
+import os
+import numpy as np
+
+from camera.camera_info import Modes
+from processing.pose_processing import CameraSolve, PoseProcessor
+from processing.pose_tracker import PoseTracker
+from processing.roi_tracker import RoiTracker
+from processing.servo_tracker import ServoTracker
+from processing.tag_detectors import Detectors
+from processing.tag_prediction import TagPredictor
+from processing.tag_processing import TagProcessor
+
+
+# OpenCV threads for each of the cameras processed at the same time, so together
+# they use every core once instead of each spawning one thread per core
+def thread_budget(cameras: int) -> int:
+    return max(1, (os.cpu_count() or 1) // max(1, cameras))
+
+
+class CameraProcessor:
+    """
+    Detection and pose solving state for one camera: its own TagProcessor
+    (detector backends are not safe to share between threads), PoseProcessor
+    and ROI tracker, the odometry based TagPredictor, the PoseTracker
+    continuing its last pose and, for TAG_SERVOING, the optical flow
+    ServoTracker.
+
+    Cameras never share one, so processors of different cameras can run at
+    the same time, on threads (see init.py) or in vision worker processes.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, identifier: str, apriltag_options: dict | None = None):
+        self.identifier = identifier
+        self.tag_processor = TagProcessor(apriltag_options)
+        # Loads the tag layout, only done once the camera estimates poses
+        self.pose_processor: PoseProcessor | None = None
+        self.tracker: RoiTracker | None = None
+        self.predictor = TagPredictor()
+        self.servo_tracker: ServoTracker | None = None
+        self.pose_tracker: PoseTracker | None = None
+
+    # None turns ROI tracking off
+    def set_sweep_interval(self, sweep_interval: int | None):
+        if sweep_interval is None:
+            self.tracker = None
+        elif self.tracker is None or self.tracker.sweep_interval != sweep_interval:
+            self.tracker = RoiTracker(sweep_interval)
+
+    # None turns optical flow tracking in TAG_SERVOING off
+    def set_servo_interval(self, servo_interval: int | None):
+        if servo_interval is None:
+            self.servo_tracker = None
+        elif (
+            self.servo_tracker is None
+            or self.servo_tracker.detection_interval != servo_interval
+        ):
+            self.servo_tracker = ServoTracker(servo_interval)
+
+    def set_pose_tracking(self, pose_tracking: bool):
+        if not pose_tracking:
+            self.pose_tracker = None
+        elif self.pose_tracker is None:
+            self.pose_tracker = PoseTracker()
+
+    # What the last POSE_ESTIMATION frame's pose was solved on, for
+    # JointPoseSolver
+    def camera_solve(self) -> CameraSolve | None:
+        if self.pose_processor is None:
+            return None
+
+        return self.pose_processor.camera_solve
+
+    def get_pose_processor(self, tag_size: float) -> PoseProcessor:
+        if self.pose_processor is None:
+            self.pose_processor = PoseProcessor(self.tag_processor, tag_size)
+        self.pose_processor.set_tag_size(tag_size)
+
+        return self.pose_processor
+
+    # Returns what get_pose (POSE_ESTIMATION) or get_tags (TAG_SERVOING)
+    # return, None when the camera is disabled
+    # With robot_to_camera (see CameraInfo.search_extrinsics) and the robot's
+    # pose only the tags odometry puts in view are searched for
+    def process(
+        self,
+        image: np.ndarray | None,
+        mode: Modes,
+        K: np.ndarray | None,
+        D: np.ndarray | None,
+        draw: bool,
+        valid_tags: np.ndarray,
+        tag_size: float,
+        sweep_interval: int | None = None,
+        decimation: int = 1,
+        detector: Detectors = Detectors.ARUCO,
+        tiles: int = 1,
+        robot_pose: tuple[float, float, float] | None = None,
+        robot_to_camera: tuple[float, ...] | None = None,
+        detection_mask: dict | None = None,
+        servo_interval: int | None = None,
+        detector_params: dict | None = None,
+        pose_tracking: bool = False,
+    ):
+        self.set_sweep_interval(sweep_interval)
+        self.set_servo_interval(servo_interval)
+        self.set_pose_tracking(pose_tracking)
+
+        # Frames in other modes break the camera's pose track
+        if mode != Modes.POSE_ESTIMATION:
+            if self.pose_tracker is not None:
+                self.pose_tracker.reset()
+            if self.pose_processor is not None:
+                self.pose_processor.camera_solve = None
+
+        self.tag_processor.set_detection_mask(detection_mask)
+        self.tag_processor.set_detector_profile(detector_params)
+
+        guide = None
+        if (
+            mode != Modes.DISABLED
+            and image is not None
+            and robot_to_camera is not None
+        ):
+            guide = self.predictor.predict(
+                image.shape,
+                K,
+                D,
+                robot_pose,
+                robot_to_camera,
+                self.get_pose_processor(tag_size).layout,
+                valid_tags,
+            )
+
+        if mode == Modes.POSE_ESTIMATION:
+            return self.get_pose_processor(tag_size).get_pose(
+                image,
+                K,
+                D,
+                draw,
+                valid_tags,
+                self.tracker,
+                decimation,
+                detector,
+                tiles,
+                guide,
+                self.pose_tracker,
+            )
+
+        elif mode == Modes.TAG_SERVOING:
+            # Between full detections tags are followed with optical flow
+            gray = None
+            if self.servo_tracker is not None and image is not None:
+                # A copy for color frames, annotations don't end up in it
+                gray = (
+                    image
+                    if image.ndim == 2
+                    else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                )
+                tracked = self.servo_tracker.track(gray)
+                if tracked is not None:
+                    if draw:
+                        TagProcessor.draw_tags(image, *tracked)
+                    return tracked
+
+            ids, corners = self.tag_processor.get_tags(
+                image,
+                valid_tags,
+                draw,
+                self.tracker,
+                decimation,
+                detector,
+                tiles,
+                guide,
+            )
+
+            if gray is not None:
+                self.servo_tracker.update(gray, ids, corners)
+
+            return (ids, corners)
+
+        return None
@@ -0,0 +1,139 @@
+# Compare decimated tag detection (and detector backends) against full
+# resolution aruco on a replay
+# Run from PiSideCode: python -m processing.decimation_report <replay directory>
+import argparse
+import cv2
+import logging
+import time
+import numpy as np
+
+from camera.camera_info import DECIMATIONS
+from camera.replay_camera import ReplayCamera, ReplayPace, list_replay_sources
+from processing.tag_detectors import Detectors
+from processing.tag_processing import TagProcessor
+
+
+def read_frames(source: str) -> list[np.ndarray]:
+    cam = ReplayCamera(source, ReplayPace.FAST)
+
+    if cam.video is not None:
+        count = int(cam.video.get(cv2.CAP_PROP_FRAME_COUNT))
+    else:
+        count = len(cam.frames)
+
+    frames = []
+    for _ in range(count):
+        ret, frame = cam.read()
+        if ret:
+            frames.append(frame)
+
+    cam.release()
+    return frames
+
+
+def detect_all(
+    tag_processor: TagProcessor,
+    frames: list[np.ndarray],
+    valid_tags: np.ndarray,
+    decimation: int,
+    detector: Detectors = Detectors.ARUCO,
+) -> tuple[list[dict[int, np.ndarray]], float]:
+    detections = []
+    before = time.perf_counter()
+
+    for frame in frames:
+        ids, corners = tag_processor.get_tags(
+            frame, valid_tags, False, decimation=decimation, detector=detector
+        )
+        detections.append(dict(zip(map(int, ids), corners)))
+
+    elapsed = time.perf_counter() - before
+    return detections, elapsed / max(len(frames), 1) * 1000
+
+
+# Tags found by aruco at full resolution are the reference
+def compare(
+    reference: list[dict[int, np.ndarray]], detections: list[dict[int, np.ndarray]]
+) -> dict[str, float]:
+    expected = found = extra = 0
+    errors = []
+
+    for ref, det in zip(reference, detections):
+        expected += len(ref)
+        for tag_id, corners in det.items():
+            if tag_id in ref:
+                found += 1
+                errors.extend(np.linalg.norm(corners - ref[tag_id], axis=1))
+            else:
+                extra += 1
+
+    return {
+        "recall": found / expected if expected > 0 else 1.0,
+        "extra": extra,
+        "corner_err_px": np.mean(errors) if len(errors) > 0 else 0.0,
+        "corner_err_max_px": np.max(errors) if len(errors) > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recall and corner error of decimated detection vs full resolution"
+    )
+    parser.add_argument("replay", help="Replay or match recording directory")
+    parser.add_argument(
+        "--decimation", type=int, nargs="+", default=list(DECIMATIONS[1:])
+    )
+    parser.add_argument(
+        "--detector",
+        choices=[detector.value for detector in Detectors],
+        default=Detectors.ARUCO.value,
+    )
+    parser.add_argument("--valid-tags", type=int, nargs="+", default=range(1, 33))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    tag_processor = TagProcessor()
+    valid_tags = np.asarray(args.valid_tags)
+    detector = Detectors(args.detector)
+
+    print(
+        f"{'camera':<24} {'decimation':>10} {'frames':>6} {'tags':>6} {'recall':>7} "
+        f"{'extra':>6} {'err px':>7} {'max px':>7} {'ms/f':>7}"
+    )
+
+    for source in list_replay_sources(args.replay):
+        frames = read_frames(source)
+        if len(frames) == 0:
+            continue
+
+        name = source.rstrip("/").split("/")[-1]
+        reference, full_ms = detect_all(tag_processor, frames, valid_tags, 1)
+        tag_count = sum(map(len, reference))
+
+        print(
+            f"{name:<24} {1:>10} {len(frames):>6} {tag_count:>6} {1:>7.3f} "
+            f"{0:>6} {0:>7.3f} {0:>7.3f} {full_ms:>7.2f}"
+        )
+
+        decimations = args.decimation
+        # Full resolution of another backend is worth comparing too
+        if detector != Detectors.ARUCO:
+            decimations = [1] + decimations
+
+        for decimation in decimations:
+            detections, ms = detect_all(
+                tag_processor, frames, valid_tags, decimation, detector
+            )
+            result = compare(reference, detections)
+
+            print(
+                f"{name:<24} {decimation:>10} {len(frames):>6} "
+                f"{sum(map(len, detections)):>6} {result['recall']:>7.3f} "
+                f"{result['extra']:>6} {result['corner_err_px']:>7.3f} "
+                f"{result['corner_err_max_px']:>7.3f} {ms:>7.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
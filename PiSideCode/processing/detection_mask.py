@@ -0,0 +1,161 @@
+import cv2
+import json
+import logging
+import numpy as np
+import pathlib
+
+from directory import CAMERA_CONFIG_DIRECTORY, detection_mask_path
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionMask:
+    """
+    Parts of one camera's frames where tags are searched for: an optional
+    crop rectangle, with polygons inside it blanked out (robot structure,
+    bumpers, ceiling). Both are fractions of the frame's width and height so
+    they survive resolution changes.
+
+    Cropping only takes a view of the frame, blanking copies the crop once
+    per frame. Detections are moved back to full frame coordinates by
+    TagProcessor.
+    """
+
+    # Outline color when drawn on the web stream
+    COLOR = (255, 0, 255)
+
+    def __init__(self, spec: dict):
+        spec = DetectionMask.validate(spec)
+        self.crop = spec["crop"]
+        self.polygons = spec["polygons"]
+
+        # Pixel crop (x0, y0, x1, y1) and pixels to keep inside it, for
+        # frames of shape
+        self.shape: tuple[int, ...] | None = None
+        self.box: np.ndarray | None = None
+        self.keep: np.ndarray | None = None
+
+    # Clean up a spec from the web interface or disk, ValueError if it makes
+    # no sense. Specs are what is stored on disk and in
+    # CameraInfo.detection_mask: "crop" is [x0, y0, x1, y1] or None and
+    # "polygons" a list of [[x, y], ...], {} is no mask
+    @staticmethod
+    def validate(spec: dict) -> dict:
+        crop = spec.get("crop")
+        polygons = spec.get("polygons") or []
+
+        if crop is not None:
+            crop = [min(max(float(v), 0.0), 1.0) for v in crop]
+            if len(crop) != 4 or crop[2] <= crop[0] or crop[3] <= crop[1]:
+                raise ValueError(f"Crop must be [x0, y0, x1, y1], got {crop}")
+
+        cleaned = []
+        for polygon in polygons:
+            points = [[float(x), float(y)] for x, y in polygon]
+            if len(points) < 3:
+                raise ValueError(f"Polygons need at least 3 points, got {points}")
+            cleaned.append(points)
+
+        return {"crop": crop, "polygons": cleaned}
+
+    @staticmethod
+    def is_empty(spec: dict | None) -> bool:
+        return spec is None or (
+            spec.get("crop") is None and len(spec.get("polygons") or []) == 0
+        )
+
+    def spec(self) -> dict:
+        return {"crop": self.crop, "polygons": self.polygons}
+
+    # Gray and color frames of a camera share the same mask
+    def prepare(self, shape: tuple[int, ...]):
+        shape = shape[:2]
+        if shape == self.shape:
+            return
+
+        self.shape = shape
+        height, width = shape
+        scale = np.asarray((width, height))
+
+        if self.crop is None:
+            self.box = np.asarray((0, 0, width, height))
+        else:
+            box = np.asarray(self.crop) * np.tile(scale, 2)
+            self.box = np.round(box).astype(int)
+
+        self.keep = None
+        if len(self.polygons) > 0:
+            x0, y0, x1, y1 = self.box
+            self.keep = np.full((y1 - y0, x1 - x0), 255, dtype=np.uint8)
+            cv2.fillPoly(
+                self.keep,
+                [
+                    np.round(np.asarray(polygon) * scale - (x0, y0)).astype(np.int32)
+                    for polygon in self.polygons
+                ],
+                0,
+            )
+
+    # The part of img to search and where it starts in the frame
+    def apply(self, img: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        self.prepare(img.shape)
+
+        x0, y0, x1, y1 = self.box
+        searched = img[y0:y1, x0:x1]
+
+        if self.keep is not None:
+            searched = cv2.bitwise_and(searched, searched, mask=self.keep)
+
+        return (searched, np.asarray((x0, y0), dtype=np.float32))
+
+    # Full frame (x0, y0, x1, y1) rows to the crop's coordinates, regions
+    # left empty by the crop are dropped
+    def to_crop(self, regions: np.ndarray) -> np.ndarray:
+        x0, y0, x1, y1 = self.box
+        regions = np.clip(
+            np.asarray(regions) - (x0, y0, x0, y0),
+            0,
+            (x1 - x0, y1 - y0, x1 - x0, y1 - y0),
+        )
+
+        return regions[
+            (regions[:, 2] > regions[:, 0]) & (regions[:, 3] > regions[:, 1])
+        ]
+
+    def draw(self, img: np.ndarray):
+        self.prepare(img.shape)
+        x0, y0, x1, y1 = self.box
+        height, width = img.shape[:2]
+
+        if self.crop is not None:
+            cv2.rectangle(img, (x0, y0), (x1 - 1, y1 - 1), DetectionMask.COLOR, 2)
+        cv2.polylines(
+            img,
+            [
+                np.round(np.asarray(polygon) * (width, height)).astype(np.int32)
+                for polygon in self.polygons
+            ],
+            True,
+            DetectionMask.COLOR,
+            2,
+        )
+
+
+def load_detection_mask(identifier: str) -> dict:
+    try:
+        with open(detection_mask_path(identifier), "r") as f:
+            return DetectionMask.validate(json.load(f))
+
+    except FileNotFoundError:
+        pass
+    except (json.decoder.JSONDecodeError, ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Ignoring detection mask of {identifier}: {e}")
+
+    return DetectionMask.validate({})
+
+
+def write_detection_mask(identifier: str, spec: dict):
+    pathlib.Path(CAMERA_CONFIG_DIRECTORY).mkdir(parents=True, exist_ok=True)
+
+    with open(detection_mask_path(identifier), "w") as f:
+        json.dump(spec, f)
@@ -0,0 +1,269 @@
+# Sweep aruco DetectorParameters over replays with known tags, report recall,
+# corner error and latency of each profile and save the Pareto front as
+# detector profiles cameras can be set to (CameraInfo.detector_profile)
+# Run from PiSideCode: python -m processing.detector_tuning <replay directory>
+import argparse
+import cv2
+import itertools
+import json
+import logging
+import os
+import random
+import numpy as np
+
+from camera.replay_camera import TAG_LABELS, list_replay_sources
+from processing.decimation_report import compare, detect_all, read_frames
+from processing.tag_detectors import (
+    ARUCO_PARAMS,
+    ArucoTagDetector,
+    load_detector_profiles,
+    validate_detector_profile,
+    write_detector_profiles,
+)
+from processing.tag_processing import TagProcessor
+
+# Values tried for each parameter, the others keep ARUCO_PARAMS
+PARAMETER_GRID = {
+    "adaptiveThreshWinSizeMin": [3, 5, 13],
+    "adaptiveThreshWinSizeStep": [10, 20],
+    "adaptiveThreshConstant": [7, 10, 13],
+    "minMarkerPerimeterRate": [0.02, 0.03, 0.05],
+    "perspectiveRemovePixelPerCell": [4, 8],
+    "cornerRefinementMaxIterations": [10, 30],
+}
+
+# Labels made without a labels file, the slow but most accurate aruco
+# settings. Check them before trusting the corner errors against them
+REFERENCE_PROFILE = {
+    "adaptiveThreshWinSizeMin": 3,
+    "adaptiveThreshWinSizeMax": 23,
+    "adaptiveThreshWinSizeStep": 10,
+    "adaptiveThreshConstant": 7,
+    "cornerRefinementMethod": cv2.aruco.CORNER_REFINE_APRILTAG,
+}
+
+
+# One {tag id: (4, 2) corners} per frame, in replay order
+def load_labels(source: str) -> list[dict[int, np.ndarray]] | None:
+    try:
+        with open(os.path.join(source, TAG_LABELS), "r") as f:
+            labels = json.load(f)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+    return [
+        {
+            int(tag_id): np.asarray(corners, dtype=np.float32)
+            for tag_id, corners in frame.items()
+        }
+        for frame in labels
+    ]
+
+
+def write_labels(source: str, labels: list[dict[int, np.ndarray]]):
+    with open(os.path.join(source, TAG_LABELS), "w") as f:
+        json.dump(
+            [
+                {str(tag_id): corners.tolist() for tag_id, corners in frame.items()}
+                for frame in labels
+            ],
+            f,
+        )
+
+
+def label_frames(
+    frames: list[np.ndarray], valid_tags: np.ndarray
+) -> list[dict[int, np.ndarray]]:
+    detector = ArucoTagDetector(REFERENCE_PROFILE)
+    detector.set_valid_tags(valid_tags)
+
+    labels = []
+    for frame in frames:
+        ids, corners = detector.detect(frame)
+        labels.append(dict(zip(map(int, ids), corners)))
+
+    return labels
+
+
+# The baseline (ARUCO_PARAMS, {}) first, then up to samples other
+# combinations of the grid
+def candidate_profiles(grid: dict[str, list], samples: int, seed: int) -> list[dict]:
+    combinations = [
+        dict(zip(grid, values)) for values in itertools.product(*grid.values())
+    ]
+    random.Random(seed).shuffle(combinations)
+
+    profiles = [{}]
+    for combination in combinations:
+        # Only what differs from ARUCO_PARAMS is stored
+        profile = {
+            name: value
+            for name, value in combination.items()
+            if ARUCO_PARAMS.get(name) != value
+        }
+        if profile not in profiles:
+            profiles.append(profile)
+
+        if len(profiles) > samples:
+            break
+
+    return profiles
+
+
+# Results no other result beats on recall, corner error and latency all at
+# once, fastest first
+def pareto_front(results: list[dict]) -> list[dict]:
+    def dominates(a: dict, b: dict) -> bool:
+        at_least = (
+            a["recall"] >= b["recall"]
+            and a["corner_err_px"] <= b["corner_err_px"]
+            and a["ms"] <= b["ms"]
+        )
+        better = (
+            a["recall"] > b["recall"]
+            or a["corner_err_px"] < b["corner_err_px"]
+            or a["ms"] < b["ms"]
+        )
+        return at_least and better
+
+    front = [
+        result
+        for result in results
+        if not any(dominates(other, result) for other in results)
+    ]
+
+    return sorted(front, key=lambda result: result["ms"])
+
+
+def parse_grid(overrides: list[str]) -> dict[str, list]:
+    grid = dict(PARAMETER_GRID)
+
+    for override in overrides:
+        name, _, values = override.partition("=")
+        grid[name] = [
+            validate_detector_profile({name: float(value)})[name]
+            for value in values.split(",")
+        ]
+
+    return grid
+
+
+def print_result(result: dict, marker: str = " "):
+    print(
+        f"{marker} {result['recall']:>7.3f} {result['extra']:>6} "
+        f"{result['corner_err_px']:>7.3f} {result['corner_err_max_px']:>7.3f} "
+        f"{result['ms']:>7.2f}  {json.dumps(result['profile'])}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pareto front of aruco detector parameters on labeled replays"
+    )
+    parser.add_argument("replay", help="Replay or match recording directory")
+    parser.add_argument("--decimation", type=int, default=1)
+    parser.add_argument("--valid-tags", type=int, nargs="+", default=range(1, 33))
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=40,
+        help="Profiles tried besides the current parameters",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--grid",
+        nargs="+",
+        default=[],
+        metavar="NAME=V1,V2",
+        help="Values to try for a DetectorParameters attribute",
+    )
+    parser.add_argument(
+        "--write-labels",
+        action="store_true",
+        help=f"Save reference detections as {TAG_LABELS} where it is missing",
+    )
+    parser.add_argument(
+        "--save",
+        metavar="PREFIX",
+        help="Save the front as detector profiles PREFIX_1 (fastest) and up",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    valid_tags = np.asarray(args.valid_tags)
+
+    frames = []
+    labels = []
+    for source in list_replay_sources(args.replay):
+        source_frames = read_frames(source)
+        source_labels = load_labels(source)
+
+        if source_labels is None:
+            print(f"No {TAG_LABELS} in {source}, labeling with reference settings")
+            source_labels = label_frames(source_frames, valid_tags)
+            if args.write_labels:
+                write_labels(source, source_labels)
+
+        if len(source_labels) != len(source_frames):
+            print(
+                f"Skipping {source}: {len(source_labels)} labels for "
+                f"{len(source_frames)} frames"
+            )
+            continue
+
+        frames.extend(source_frames)
+        labels.extend(source_labels)
+
+    if len(frames) == 0:
+        print("No frames to tune on")
+        return
+
+    print(
+        f"{len(frames)} frames, {sum(map(len, labels))} labeled tags, "
+        f"decimation {args.decimation}"
+    )
+    print(
+        f"  {'recall':>7} {'extra':>6} {'err px':>7} {'max px':>7} {'ms/f':>7}  "
+        f"profile"
+    )
+
+    results = []
+    for profile in candidate_profiles(
+        parse_grid(args.grid), args.samples, args.seed
+    ):
+        tag_processor = TagProcessor()
+        tag_processor.set_detector_profile(profile)
+
+        # Detectors are created and set up on the first frame
+        tag_processor.get_tags(
+            frames[0], valid_tags, False, decimation=args.decimation
+        )
+        detections, ms = detect_all(
+            tag_processor, frames, valid_tags, args.decimation
+        )
+
+        result = {**compare(labels, detections), "ms": ms, "profile": profile}
+        results.append(result)
+        print_result(result)
+
+    front = pareto_front(results)
+
+    print("\nPareto front, fastest first:")
+    for result in front:
+        print_result(result, "*" if result["profile"] == {} else " ")
+
+    if args.save is not None:
+        profiles = load_detector_profiles()
+        for i, result in enumerate(front):
+            profiles[f"{args.save}_{i + 1}"] = result["profile"]
+
+        write_detector_profiles(profiles)
+        print(
+            f"Saved {len(front)} profiles as {args.save}_1 to "
+            f"{args.save}_{len(front)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
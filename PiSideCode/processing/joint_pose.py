@@ -0,0 +1,241 @@
+import cv2
+import logging
+import numpy as np
+import wpimath.geometry as wpi
+
+from processing.pose_processing import CameraSolve
+from processing.tag_layout import WPILIB_TO_CV2
+from processing.tag_prediction import robot_to_camera_transform
+
+
+class JointPoseSolver:
+    """
+    Solves one robot pose on the field from the tags every POSE_ESTIMATION
+    camera saw in a loop, each camera placed on the robot by its extrinsics
+    (CameraInfo.robot_to_camera).
+
+    Works on what PoseProcessor.get_pose already undistorted and solved for
+    each camera (CameraSolve). Every camera's own pose (both IPPE poses for
+    an unresolved single tag) is moved to the robot's center and scored on
+    all cameras' corners, the best one is refined with Levenberg-Marquardt
+    on the reprojection error of all corners at once.
+
+    Cameras whose frames are more than MAX_FRAME_SPREAD_MS older than the
+    newest are left out, the robot moved in between.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    MAX_FRAME_SPREAD_MS = 25.0
+    # At least this many tags between all cameras, one tag is ambiguous
+    MIN_TAGS = 2
+    # RMS reprojection error (pixels) above which the pose is not published,
+    # usually wrong extrinsics
+    MAX_ERROR = 4.0
+
+    MAX_ITERATIONS = 20
+    # LM damping, grows when a step makes the error worse
+    INITIAL_DAMPING = 1e-3
+    MIN_STEP = 1e-9
+
+    # observations are (CameraSolve, extrinsics in EXTRINSICS order, frame
+    # time ms) by camera
+    # Returns the robot's pose, RMS reprojection error, the cameras used and
+    # their mean frame time, None when there is nothing good to publish
+    @staticmethod
+    def solve(
+        observations: dict[str, tuple[CameraSolve | None, tuple[float, ...], float]]
+    ) -> tuple[wpi.Pose3d, float, list[str], float] | None:
+        observations = {
+            identifier: observation
+            for identifier, observation in observations.items()
+            if observation[0] is not None
+        }
+        if len(observations) == 0:
+            return None
+
+        newest = max(observation[2] for observation in observations.values())
+
+        # Per point arrays, cams is the index of the point's camera
+        cameras = []
+        field_points, image_points, cams = [], [], []
+        intrinsics, rotations, translations = [], [], []
+        guesses = []
+
+        for identifier, (camera_solve, extrinsics, frame_time) in (
+            observations.items()
+        ):
+            if newest - frame_time > JointPoseSolver.MAX_FRAME_SPREAD_MS:
+                continue
+
+            rotation, translation = JointPoseSolver.robot_to_camera_cv2(extrinsics)
+
+            field_points.append(camera_solve.field_corners.reshape(-1, 3))
+            image_points.append(camera_solve.image_corners.reshape(-1, 2))
+            cams.append(np.full(len(image_points[-1]), len(cameras)))
+            intrinsics.append(camera_solve.K)
+            rotations.append(rotation)
+            translations.append(translation)
+            cameras.append(identifier)
+
+            # The camera's own poses, field to camera back to field to robot
+            for cam_rotation, cam_translation in camera_solve.poses:
+                guesses.append(
+                    (
+                        rotation.T @ cam_rotation,
+                        rotation.T @ (cam_translation - translation),
+                    )
+                )
+
+        if sum(map(len, field_points)) < 4 * JointPoseSolver.MIN_TAGS:
+            return None
+
+        # Everything by point so no step indexes by camera again
+        cams = np.concatenate(cams)
+        intrinsics = np.asarray(intrinsics)
+        problem = (
+            np.concatenate(field_points),
+            np.concatenate(image_points).astype(float),
+            intrinsics[cams][:, (0, 1), (0, 1)],
+            intrinsics[cams][:, (0, 1), (2, 2)],
+            np.asarray(rotations)[cams],
+            np.asarray(translations)[cams],
+        )
+
+        rotation, translation = min(
+            guesses, key=lambda guess: JointPoseSolver.cost(problem, *guess)[0]
+        )
+        rotation, translation = JointPoseSolver.refine(problem, rotation, translation)
+
+        error = np.sqrt(
+            JointPoseSolver.cost(problem, rotation, translation)[0] / len(problem[0])
+        )
+        if not error <= JointPoseSolver.MAX_ERROR:
+            JointPoseSolver.logger.debug(
+                f"Joint pose rejected, {error:.2f} px RMS from {cameras}"
+            )
+            return None
+
+        frame_time = np.mean([observations[identifier][2] for identifier in cameras])
+
+        return (
+            JointPoseSolver.to_field_pose(rotation, translation),
+            float(error),
+            cameras,
+            float(frame_time),
+        )
+
+    # Robot to camera on OpenCV axes, like TagPredictor
+    @staticmethod
+    def robot_to_camera_cv2(
+        extrinsics: tuple[float, ...]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        transform = robot_to_camera_transform(extrinsics)
+        rot = transform.rotation().toMatrix().T
+        translation = np.asarray((transform.X(), transform.Y(), transform.Z()))
+
+        return (
+            WPILIB_TO_CV2 @ rot @ WPILIB_TO_CV2.T,
+            -WPILIB_TO_CV2 @ rot @ translation,
+        )
+
+    # Field points moved by the field to robot transform, in the robot and
+    # in their camera (OpenCV axes)
+    @staticmethod
+    def in_cameras(
+        problem: tuple, rotation: np.ndarray, translation: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        field_points, _, _, _, rotations, translations = problem
+
+        in_robot = field_points @ rotation.T + translation
+        in_camera = np.einsum("nij,nj->ni", rotations, in_robot) + translations
+
+        return (in_robot, in_camera)
+
+    # Sum of squared reprojection errors and the errors (N * 2), inf with
+    # corners behind a camera
+    @staticmethod
+    def cost(
+        problem: tuple, rotation: np.ndarray, translation: np.ndarray
+    ) -> tuple[float, np.ndarray]:
+        _, image_points, focal, center, _, _ = problem
+        in_robot, in_camera = JointPoseSolver.in_cameras(problem, rotation, translation)
+        if (in_camera[:, 2] <= 0).any():
+            return (np.inf, None)
+
+        residuals = (
+            in_camera[:, :2] / in_camera[:, 2:] * focal + center - image_points
+        ).ravel()
+
+        return (float(residuals @ residuals), (residuals, in_robot, in_camera))
+
+    # Levenberg-Marquardt on the field to robot transform, steps rotate and
+    # move the robot's frame
+    @staticmethod
+    def refine(
+        problem: tuple, rotation: np.ndarray, translation: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        _, _, focal, _, rotations, _ = problem
+        damping = JointPoseSolver.INITIAL_DAMPING
+        cost, (residuals, in_robot, in_camera) = JointPoseSolver.cost(
+            problem, rotation, translation
+        )
+
+        for _ in range(JointPoseSolver.MAX_ITERATIONS):
+            # Projection by camera point, (N, 2, 3)
+            x, y, z = in_camera.T
+            projection = np.zeros((len(z), 2, 3))
+            projection[:, 0, 0] = focal[:, 0] / z
+            projection[:, 0, 2] = -focal[:, 0] * x / z**2
+            projection[:, 1, 1] = focal[:, 1] / z
+            projection[:, 1, 2] = -focal[:, 1] * y / z**2
+
+            # Robot point by step, (N, 3, 6)
+            step = np.zeros((len(z), 3, 6))
+            step[:, 0, 1], step[:, 0, 2] = in_robot[:, 2], -in_robot[:, 1]
+            step[:, 1, 0], step[:, 1, 2] = -in_robot[:, 2], in_robot[:, 0]
+            step[:, 2, 0], step[:, 2, 1] = in_robot[:, 1], -in_robot[:, 0]
+            step[:, :, 3:] = np.eye(3)
+
+            jacobian = (projection @ rotations @ step).reshape(-1, 6)
+            hessian = jacobian.T @ jacobian
+            gradient = jacobian.T @ residuals
+            diagonal = np.diag(np.diag(hessian))
+
+            while True:
+                delta = np.linalg.solve(hessian + damping * diagonal, -gradient)
+                delta_rotation, _ = cv2.Rodrigues(delta[:3])
+                new_rotation = delta_rotation @ rotation
+                new_translation = delta_rotation @ translation + delta[3:]
+                new_cost, state = JointPoseSolver.cost(
+                    problem, new_rotation, new_translation
+                )
+
+                if new_cost < cost:
+                    damping = max(damping / 10, 1e-12)
+                    break
+
+                damping *= 10
+                if damping > 1e6:
+                    return (rotation, translation)
+
+            rotation, translation = new_rotation, new_translation
+            residuals, in_robot, in_camera = state
+            improvement = cost - new_cost
+            cost = new_cost
+
+            if (
+                np.abs(delta).max() < JointPoseSolver.MIN_STEP
+                or improvement < 1e-10 * cost
+            ):
+                break
+
+        return (rotation, translation)
+
+    # Field to robot on OpenCV axes to the robot's pose on the field
+    @staticmethod
+    def to_field_pose(rotation: np.ndarray, translation: np.ndarray) -> wpi.Pose3d:
+        rot = WPILIB_TO_CV2.T @ rotation.T @ WPILIB_TO_CV2
+        position = -WPILIB_TO_CV2.T @ rotation.T @ translation
+
+        return wpi.Pose3d(wpi.Translation3d(*position), wpi.Rotation3d(rot))
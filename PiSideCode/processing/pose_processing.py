@@ -1,10 +1,12 @@
 import cv2
-import json
 import logging
 import wpimath.geometry as wpi
 import numpy as np
-import math
-from directory import TAG_LAYOUT_PATH, FALLBACK_TAG_LAYOUT_PATH
+from processing.pose_tracker import PoseTracker
+from processing.roi_tracker import RoiTracker
+from processing.tag_detectors import Detectors
+from processing.tag_layout import TagLayout, get_tag_layout
+from processing.undistortion import Undistortion
 
 # from numba import njit
 # import faulthandler
@@ -12,96 +14,106 @@ from directory import TAG_LAYOUT_PATH, FALLBACK_TAG_LAYOUT_PATH
 
 cv2.setNumThreads(3)
 
+
+class TagSolutions:
+    """
+    Both IPPE_SQUARE poses of every tag of a frame relative to the camera,
+    solved once and shared by axis drawing, single tag poses and ambiguity.
+
+    Row i is tag i: rvecs and tvecs (N, 2, 3) and reprojection errors
+    (N, 2) in pixels, better solution first. OpenCV's solver stays per tag,
+    a numpy IPPE over all tags at once costs more than ten of its solves.
+    """
+
+    # corners are undistorted (see Undistortion), K is the pinhole camera
+    def __init__(self, tag_corners: np.ndarray, corners: np.ndarray, K: np.ndarray):
+        self.rvecs = np.empty((len(corners), 2, 3))
+        self.tvecs = np.empty((len(corners), 2, 3))
+        self.errors = np.empty((len(corners), 2))
+
+        for i, image_corners in enumerate(corners):
+            _, rvecs, tvecs, errors = cv2.solvePnPGeneric(
+                tag_corners,
+                image_corners,
+                K,
+                None,
+                flags=cv2.SOLVEPNP_IPPE_SQUARE,
+            )
+            self.rvecs[i] = np.reshape(rvecs, (2, 3))
+            self.tvecs[i] = np.reshape(tvecs, (2, 3))
+            self.errors[i] = np.ravel(errors)
+
+    # Better over worse reprojection error, near 1 the two poses can't be
+    # told apart
+    def ambiguity(self) -> np.ndarray:
+        return self.errors[:, 0] / self.errors[:, 1]
+
+    # Draw axis on the tags, through the camera's distortion
+    def draw(self, image: np.ndarray, K: np.ndarray, D: np.ndarray):
+        for rvec, tvec in zip(self.rvecs[:, 0], self.tvecs[:, 0]):
+            cv2.drawFrameAxes(image, K, D, rvec, tvec, 0.1)
+
+
+class CameraSolve:
+    """
+    What get_pose placed one camera with in a frame, for solving the robot's
+    pose from all cameras at once (see JointPoseSolver) without undistorting
+    or solving anything again.
+
+    field_corners (N, 4, 3) are the tags' corners on the field (OpenCV
+    axes), image_corners (N, 4, 2) where the pinhole camera K saw them and
+    poses the field to camera (rotation, translation) solutions, both IPPE
+    ones for a single tag the camera's track couldn't tell apart.
+    """
+
+    def __init__(
+        self,
+        field_corners: np.ndarray,
+        image_corners: np.ndarray,
+        K: np.ndarray,
+        poses: list[tuple[np.ndarray, np.ndarray]],
+    ):
+        self.field_corners = field_corners
+        self.image_corners = image_corners
+        self.K = K
+        self.poses = poses
+
+
 class PoseProcessor:
     logger = logging.getLogger(__name__)
-    CORNER_POSE_ORDER = np.asarray([(-1, -1), (1, -1), (1, 1), (-1, 1)])
-    CORNER_DRAW_ORDER = np.asarray([(-1, 1, 0), (1, 1, 0), (1, -1, 0), (-1, -1, 0)])
     BAD_POSE = wpi.Pose3d(wpi.Translation3d(2767, 2767, 2767), wpi.Rotation3d())
-    MIN_TAG = 1
-    MAX_TAG = 32
 
     def __init__(self, tag_processor, tag_length):
-        # Open tag layout for tag poses
-        try:
-            with open(TAG_LAYOUT_PATH, "r") as f:
-                self.tag_layout = json.load(f)["tags"]
-                PoseProcessor.logger.info("Tag layout loaded")
-
-        except (FileNotFoundError, json.decoder.JSONDecodeError, KeyError):
-            with open(FALLBACK_TAG_LAYOUT_PATH, "r") as f:
-                self.tag_layout = json.load(f)["tags"]
-                PoseProcessor.logger.warning("FALLBACK Tag layout loaded")
-
         self.tag_processor = tag_processor
 
-        self.square_length = tag_length
-        self.tag_corner = np.asarray([tag_length, tag_length, 0]) / 2
-
-        self.corner_locs = np.empty((4, 3))
-
-        for i, j in enumerate(PoseProcessor.CORNER_DRAW_ORDER):
-            self.corner_locs[i] = self.tag_corner * j
-
-        self.all_corner_poses = {}
-        self.tag_transforms = {}
-
-        # Grab tag pose and calcualte each corner location
-        for tag_id in range(PoseProcessor.MIN_TAG, PoseProcessor.MAX_TAG + 1):
-            pose = PoseProcessor.make_pose_object(
-                self.tag_layout[int(tag_id - 1)]["pose"]
-            )
-
-            corner_poses = np.empty((4, 3))
-
-            for corner_index, j in enumerate(PoseProcessor.CORNER_POSE_ORDER):
-                corner_poses[corner_index] = PoseProcessor.wpilib_to_cv2_coords(
-                    pose
-                    + wpi.Transform3d(
-                        wpi.Translation3d(0, *(j * self.tag_corner[:2])),
-                        wpi.Rotation3d(),
-                    )
-                )
+        # Compiled tag layout (see get_tag_layout)
+        self.layout: TagLayout = get_tag_layout(tag_length)
 
-            self.all_corner_poses[tag_id] = corner_poses
+        # The camera's calibration, see get_undistortion
+        self.undistortion: Undistortion | None = None
 
-            rot = pose.rotation().rotateBy(wpi.Rotation3d(0, 0, np.pi))
-            translation = np.asarray((pose.X(), pose.Y(), pose.Z())).reshape(3, 1)
-            self.tag_transforms[tag_id] = PoseProcessor.get_transform(translation, rot.toMatrix())
+        # Last frame's solve, None without a pose
+        self.camera_solve: CameraSolve | None = None
 
-    # Set AprilTag side length in meters
+    # Set AprilTag side length in meters, the layout is only recompiled when
+    # it or the layout file changed
     def set_tag_size(self, size: float):
-        self.square_length = size
-        self.tag_corner = np.asarray([size, size, 0]) / 2
-
-        self.corner_locs = np.empty((4, 3))
+        self.layout = get_tag_layout(size)
 
-        for i, j in enumerate(PoseProcessor.CORNER_DRAW_ORDER):
-            self.corner_locs[i] = self.tag_corner * j
-
-    # A method that translates the WPILib coordinate system to the openCV
-    # coordinate system
-    @staticmethod
-    def wpilib_to_cv2_coords(translation: wpi.Translation3d) -> np.ndarray[float]:
-        return np.asarray([-translation.Y(), -translation.Z(), translation.X()])
+    # Only rebuilt when the camera's calibration changes, poses tracked
+    # with the old one are dropped
+    def get_undistortion(
+        self,
+        K: np.ndarray,
+        D: np.ndarray,
+        pose_tracker: PoseTracker | None = None,
+    ) -> Undistortion:
+        if self.undistortion is None or not self.undistortion.matches(K, D):
+            self.undistortion = Undistortion(K, D)
+            if pose_tracker is not None:
+                pose_tracker.reset()
 
-    # Grab AprilTag pose information
-    @staticmethod
-    def make_pose_object(pose_dict):
-        return wpi.Transform3d(
-            wpi.Translation3d(
-                pose_dict["translation"]["x"],
-                pose_dict["translation"]["y"],
-                pose_dict["translation"]["z"],
-            ),
-            wpi.Rotation3d(
-                wpi.Quaternion(
-                    pose_dict["rotation"]["quaternion"]["W"],
-                    pose_dict["rotation"]["quaternion"]["X"],
-                    pose_dict["rotation"]["quaternion"]["Y"],
-                    pose_dict["rotation"]["quaternion"]["Z"],
-                )
-            ).rotateBy(wpi.Rotation3d(0, 0, math.radians(180))),
-        )
+        return self.undistortion
 
     # ROT MUST BE A 3x3 ROTATION MATRIX
     @staticmethod
@@ -129,7 +141,7 @@ class PoseProcessor:
     #     )
 
     def get_trans_rots(
-        self, tvecs: np.ndarray, rvecs: np.ndarray, tag_id: int
+        self, tvecs: np.ndarray, rvecs: np.ndarray, world_2_tag: np.ndarray
     ) -> tuple[np.ndarray, np.ndarray]:
         cam_tvecs = tvecs
         cam_rvecs = rvecs
@@ -142,7 +154,6 @@ class PoseProcessor:
 
         cam_rot_mat, _ = cv2.Rodrigues(cam_rvecs)
         cam_2_tag = PoseProcessor.get_transform(cam_tvecs, cam_rot_mat)
-        world_2_tag = self.tag_transforms[tag_id]
 
         world_2_cam = np.dot(world_2_tag, np.linalg.inv(cam_2_tag))
 
@@ -150,7 +161,8 @@ class PoseProcessor:
         rvecs = PoseProcessor.get_rot_from_transform(world_2_cam)
         return (trans_vec, rvecs)
 
-    # Find AprilTags and calculate the camera's pose
+    # Find AprilTags and calculate the camera's pose, with pose_tracker from
+    # the camera's last pose where it can
     def get_pose(
         self,
         image: np.ndarray,
@@ -158,14 +170,23 @@ class PoseProcessor:
         D: np.ndarray,
         draw: bool,
         valid_tags: np.ndarray,
+        tracker: RoiTracker | None = None,
+        decimation: int = 1,
+        detector: Detectors = Detectors.ARUCO,
+        tiles: int = 1,
+        guide: tuple[np.ndarray | None, np.ndarray] | None = None,
+        pose_tracker: PoseTracker | None = None,
     ) -> tuple[tuple[wpi.Pose3d, wpi.Pose3d], list[int], float]:
         pose1, pose2 = PoseProcessor.BAD_POSE, PoseProcessor.BAD_POSE
         ambig = 2767
         tagCorners = (np.asarray([]), np.asarray([]), np.asarray([]), np.asarray([]))
+        self.camera_solve = None
 
         # If an invalid image is given or no calibration return an error
         # pose
         if image is None or K is None or D is None:
+            if pose_tracker is not None:
+                pose_tracker.reset()
             return (
                 (PoseProcessor.BAD_POSE, PoseProcessor.BAD_POSE),
                 [],
@@ -173,84 +194,133 @@ class PoseProcessor:
                 2767,
             )
 
-        ids, corners = self.tag_processor.get_tags(image, valid_tags, draw)
+        # One layout for the whole frame, it may be swapped meanwhile
+        layout = self.layout
+
+        ids, corners = self.tag_processor.get_tags(
+            image, valid_tags, draw, tracker, decimation, detector, tiles, guide
+        )
 
         if corners.shape[0] > 0:
             tagCorners = corners
 
-        # If you have corners, find pose
-        if len(corners) > 0:
-            img_tag_corner_poses = None
-            img_corner_locs = None
-
-            # Loop through each id
-            # Extract corner information
-            for tag_count, tag_id in enumerate(ids):
-                # Do basic solvePNP
-                # Only for drawing axes
-                if draw:
-                    _, rvec, tvec, _ = cv2.solvePnPGeneric(
-                        self.corner_locs,
-                        corners[tag_count],
-                        K,
-                        D,
-                        flags=cv2.SOLVEPNP_IPPE_SQUARE,
-                    )
-                    # Draw axis on the tags
-                    cv2.drawFrameAxes(image, K, D, rvec[0], tvec[0], 0.1)
+        # Tags missing from the layout can't place the camera
+        rows = layout.rows(ids) if len(ids) > 0 else np.empty(0, dtype=int)
+        known = rows >= 0
 
-                # Store image and object points
-                if img_tag_corner_poses is None:
-                    img_corner_locs = corners[tag_count]
-                    img_tag_corner_poses = self.all_corner_poses[tag_id]
-                else:
-                    img_corner_locs = np.concatenate(
-                        (img_corner_locs, corners[tag_count]), axis=0
-                    )
-                    img_tag_corner_poses = np.concatenate(
-                        (img_tag_corner_poses, self.all_corner_poses[tag_id])
-                    )
-            # Single Tag
-            if len(ids) == 1:
-                _, rvecs, tvecs, reproj = cv2.solvePnPGeneric(
-                    self.corner_locs,
-                    corners[0],
-                    K,
-                    D,
-                    flags=cv2.SOLVEPNP_IPPE_SQUARE,
+        # If you have corners, find pose
+        if known.any():
+            rows = rows[known]
+
+            # Every solve below uses the pinhole camera on these
+            undistortion = self.get_undistortion(K, D, pose_tracker)
+            known_corners = undistortion.undistort(corners[known])
+
+            # Image and object points of every tag
+            img_corner_locs = known_corners.reshape(-1, 2)
+            img_tag_corner_poses = layout.corners[rows].reshape(-1, 3)
+
+            # Each tag on its own, only for drawing axes and single tags
+            solutions = None
+            if draw or len(rows) == 1:
+                solutions = TagSolutions(
+                    layout.tag_corners, known_corners, undistortion.K
                 )
 
-                ambig = reproj[0][0] / reproj[1][0]
+            if draw:
+                solutions.draw(image, K, D)
 
-                t1, r1 = self.get_trans_rots(tvecs[0].reshape(3, 1), rvecs[0], ids[0])
-                t2, r2 = self.get_trans_rots(tvecs[1].reshape(3, 1), rvecs[1], ids[0])
+            # Single Tag
+            if len(rows) == 1:
+                ambig = solutions.ambiguity()[0]
+
+                world_2_tag = layout.transforms[rows[0]]
+                t1, r1 = self.get_trans_rots(
+                    solutions.tvecs[0, 0].reshape(3, 1),
+                    solutions.rvecs[0, 0],
+                    world_2_tag,
+                )
+                t2, r2 = self.get_trans_rots(
+                    solutions.tvecs[0, 1].reshape(3, 1),
+                    solutions.rvecs[0, 1],
+                    world_2_tag,
+                )
 
                 pose1 = wpi.Pose3d(wpi.Translation3d(*t1), wpi.Rotation3d(r1))
                 pose2 = wpi.Pose3d(wpi.Translation3d(*t2), wpi.Rotation3d(r2))
 
+                camera_poses = [
+                    layout.field_to_camera(rows[0], rvec, tvec)
+                    for rvec, tvec in zip(solutions.rvecs[0], solutions.tvecs[0])
+                ]
+
+                # The pose continuing the camera's track, nothing ambiguous
+                # is left to send
+                if pose_tracker is not None:
+                    choice = pose_tracker.resolve(
+                        layout,
+                        rows[0],
+                        solutions.rvecs[0],
+                        solutions.tvecs[0],
+                        ambig,
+                    )
+                    if choice is not None:
+                        pose1 = pose2 = (pose1, pose2)[choice]
+                        camera_poses = [camera_poses[choice]]
+                        ambig = 0.0
+
+                self.camera_solve = CameraSolve(
+                    layout.corners[rows], known_corners, undistortion.K, camera_poses
+                )
+
             # Multi-tag
             else:
                 # Calculate robot pose with 2d and 3d points
                 # Sometimes dies:  point_coordinate_variance >=
                 # POINT_VARIANCE_THRESHOLD in function 'computeOmega'
 
-                try:
-                    _, rvecs, tvecs = cv2.solvePnP(
+                # The tracked pose refined when the tags didn't change
+                refined = None
+                if pose_tracker is not None:
+                    refined = pose_tracker.refine(
+                        layout,
+                        rows,
                         img_tag_corner_poses,
                         img_corner_locs,
-                        K,
-                        D,
-                        flags=cv2.SOLVEPNP_SQPNP,
+                        undistortion.K,
                     )
+
+                try:
+                    if refined is not None:
+                        rvecs, tvecs = refined
+                    else:
+                        _, rvecs, tvecs = cv2.solvePnP(
+                            img_tag_corner_poses,
+                            img_corner_locs,
+                            undistortion.K,
+                            None,
+                            flags=cv2.SOLVEPNP_SQPNP,
+                        )
                 except BaseException as e:
                     PoseProcessor.logger.error(f"solvePnP error?! Details: {e}")
                     pose1 = pose2 = PoseProcessor.BAD_POSE
                     ambig = 2767
 
+                    if pose_tracker is not None:
+                        pose_tracker.reset()
                     return ((pose1, pose2), ids, tagCorners, ambig)
                 else:
+                    if pose_tracker is not None:
+                        pose_tracker.accept(layout, rows, rvecs, tvecs)
+
                     # Grab the rotation matrix and find the translation vector
                     rot_mat, _ = cv2.Rodrigues(rvecs)
+                    self.camera_solve = CameraSolve(
+                        layout.corners[rows],
+                        known_corners,
+                        undistortion.K,
+                        [(rot_mat, np.ravel(tvecs))],
+                    )
                     trans_vec = -np.dot(np.transpose(rot_mat), tvecs)
                     trans_vec = np.asarray([trans_vec[2], -trans_vec[0], -trans_vec[1]])
                     trans_vec = np.squeeze(trans_vec)
@@ -266,6 +336,10 @@ class PoseProcessor:
                         rot3D,
                     )
 
+        # No tags, nothing to continue from
+        elif pose_tracker is not None:
+            pose_tracker.reset()
+
         return (
             (pose1, pose2),
             ids,
@@ -0,0 +1,144 @@
+import cv2
+import math
+import numpy as np
+
+from processing.tag_layout import TagLayout
+
+
+class PoseTracker:
+    """
+    The last pose of one POSE_ESTIMATION camera PoseProcessor.get_pose
+    accepted, field (OpenCV axes) to camera as solvePnP returns it.
+
+    While the camera keeps seeing the same tags, the next multi-tag pose is
+    that pose refined by a few Gauss-Newton iterations instead of a full
+    SQPnP solve, and a single tag's two IPPE poses are told apart by
+    which one continues it. Refinements leaving more than MAX_ERROR pixels
+    RMS fall back to the full solve, frames without a pose end the track.
+    """
+
+    # Gauss-Newton steps from the last pose, OpenCV's VVS refinement costs
+    # half of its LM one here and a third of SQPnP
+    CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 5, 1e-6)
+    # RMS reprojection error (pixels) a refined pose may leave
+    MAX_ERROR = 1.5
+
+    # Furthest the camera moves between two frames of one track, meters and
+    # radians
+    MAX_JUMP = 0.3
+    MAX_TURN = math.radians(15)
+    # The other IPPE pose must be this many times further from the track
+    CONTINUITY_MARGIN = 3.0
+    # Single tags with a lower ambiguity start a track on their own
+    MAX_AMBIGUITY = 0.2
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.layout: TagLayout | None = None
+        self.rows: np.ndarray | None = None
+        self.rvec: np.ndarray | None = None
+        self.tvec: np.ndarray | None = None
+
+    def accept(
+        self, layout: TagLayout, rows: np.ndarray, rvec: np.ndarray, tvec: np.ndarray
+    ):
+        self.layout = layout
+        self.rows = np.sort(rows)
+        self.rvec = np.asarray(rvec, dtype=float).reshape(3, 1)
+        self.tvec = np.asarray(tvec, dtype=float).reshape(3, 1)
+
+    # Same layout and tags as the tracked pose
+    def is_stable(self, layout: TagLayout, rows: np.ndarray) -> bool:
+        return (
+            self.rvec is not None
+            and layout is self.layout
+            and np.array_equal(np.sort(rows), self.rows)
+        )
+
+    # The tracked pose refined on this frame's corners, None when a full
+    # solve is due. Points are undistorted, K is the pinhole camera
+    def refine(
+        self,
+        layout: TagLayout,
+        rows: np.ndarray,
+        object_points: np.ndarray,
+        image_points: np.ndarray,
+        K: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray] | None:
+        if not self.is_stable(layout, rows):
+            return None
+
+        rvec, tvec = self.rvec.copy(), self.tvec.copy()
+        cv2.solvePnPRefineVVS(
+            object_points,
+            image_points,
+            K,
+            None,
+            rvec,
+            tvec,
+            PoseTracker.CRITERIA,
+        )
+
+        projected, _ = cv2.projectPoints(object_points, rvec, tvec, K, None)
+        error = np.sqrt(
+            np.mean(np.sum((projected.reshape(-1, 2) - image_points) ** 2, axis=1))
+        )
+        if not error <= PoseTracker.MAX_ERROR:
+            return None
+
+        return (rvec, tvec)
+
+    # Index of the IPPE solution (rvecs, tvecs (2, 3) of the camera relative
+    # to the tag in row, see TagSolutions) continuing the track, None when
+    # the track can't tell them apart. Tracks the chosen one, or with a low
+    # ambiguity the better one
+    def resolve(
+        self,
+        layout: TagLayout,
+        row: int,
+        rvecs: np.ndarray,
+        tvecs: np.ndarray,
+        ambiguity: float,
+    ) -> int | None:
+        # Field to camera of both solutions
+        candidates = [
+            layout.field_to_camera(row, rvec, tvec) for rvec, tvec in zip(rvecs, tvecs)
+        ]
+
+        choice = None
+        if self.rvec is not None and layout is self.layout:
+            tracked_rot, _ = cv2.Rodrigues(self.rvec)
+            tracked_position = -tracked_rot.T @ self.tvec.ravel()
+
+            # Larger of the jump and turn, each relative to its limit
+            distances = []
+            for rot, tvec in candidates:
+                jump = np.linalg.norm(-rot.T @ tvec - tracked_position)
+                cos = (np.trace(rot @ tracked_rot.T) - 1) / 2
+                turn = math.acos(min(1.0, max(-1.0, cos)))
+                distances.append(
+                    max(jump / PoseTracker.MAX_JUMP, turn / PoseTracker.MAX_TURN)
+                )
+
+            closer = int(distances[1] < distances[0])
+            if (
+                distances[closer] <= 1
+                and distances[1 - closer]
+                >= PoseTracker.CONTINUITY_MARGIN * distances[closer]
+            ):
+                choice = closer
+
+        if choice is not None:
+            tracked = choice
+        elif ambiguity <= PoseTracker.MAX_AMBIGUITY:
+            tracked = 0
+        else:
+            self.reset()
+            return None
+
+        rot, tvec = candidates[tracked]
+        self.accept(layout, np.asarray([row]), cv2.Rodrigues(rot)[0], tvec)
+
+        return choice
@@ -0,0 +1,128 @@
+import numpy as np
+
+
+class TagTrack:
+    """Bounding box of one tag in the last frame it was seen in"""
+
+    def __init__(self, box: np.ndarray):
+        # x0, y0, x1, y1 in full frame pixels
+        self.box = box
+        # Pixels the box center moved since the previous frame
+        self.velocity = np.zeros(2)
+
+    def update(self, box: np.ndarray):
+        self.velocity = (box[:2] + box[2:]) / 2 - (self.box[:2] + self.box[2:]) / 2
+        self.box = box
+
+    # Where the box should be in the next frame, assuming constant velocity
+    def predict(self) -> np.ndarray:
+        return self.box + np.tile(self.velocity, 2)
+
+
+class RoiTracker:
+    """
+    Predicts where the tags found in the last frame of one camera will be in
+    the next, so TagProcessor only has to search padded crops around them.
+
+    New tags are only found by full frame sweeps. A sweep runs every
+    sweep_interval frames, when nothing is tracked and when a tracked tag is
+    not found in its crop (TagProcessor then sweeps the same frame again).
+    """
+
+    SWEEP_INTERVAL = 10
+
+    # Crops grow by this fraction of the tag's size on every side, plus how
+    # far the tag moved since the last frame
+    PAD_SCALE = 0.5
+    MIN_PAD = 16
+
+    # Searching most of the frame in crops costs more than one sweep
+    MAX_AREA_FRACTION = 0.5
+
+    def __init__(self, sweep_interval: int = SWEEP_INTERVAL):
+        self.sweep_interval = max(1, sweep_interval)
+        self.tracks: dict[int, TagTrack] = {}
+        self.frames_since_sweep = 0
+        self.shape: tuple[int, ...] | None = None
+
+    def reset(self):
+        self.tracks = {}
+        self.frames_since_sweep = 0
+
+    # Crops to search in the next frame as (x0, y0, x1, y1) rows, or None for
+    # a full frame sweep
+    def regions(self, shape: tuple[int, ...]) -> np.ndarray | None:
+        # Resolution changed, old boxes mean nothing
+        if shape != self.shape:
+            self.shape = shape
+            self.reset()
+
+        if len(self.tracks) == 0 or self.frames_since_sweep >= self.sweep_interval:
+            return None
+
+        height, width = shape[:2]
+        boxes = []
+        for track in self.tracks.values():
+            box = track.predict()
+            size = max(box[2] - box[0], box[3] - box[1])
+            pad = max(RoiTracker.PAD_SCALE * size, RoiTracker.MIN_PAD) + np.abs(
+                track.velocity
+            ).max()
+            boxes.append(box + (-pad, -pad, pad, pad))
+
+        boxes = np.asarray(boxes)
+        boxes = np.clip(boxes, 0, (width, height, width, height)).astype(int)
+        boxes = RoiTracker.merge(boxes)
+
+        area = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1).sum()
+        if area > RoiTracker.MAX_AREA_FRACTION * width * height:
+            return None
+
+        return boxes
+
+    # Union overlapping boxes so no tag is searched (and found) twice
+    @staticmethod
+    def merge(boxes: np.ndarray) -> np.ndarray:
+        boxes = list(boxes)
+
+        i = 0
+        while i < len(boxes):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = np.concatenate(
+                        (np.minimum(a[:2], b[:2]), np.maximum(a[2:], b[2:]))
+                    )
+                    del boxes[j]
+                    # The grown box may now overlap ones already checked
+                    i = 0
+                    break
+            else:
+                i += 1
+
+        return np.asarray(boxes)
+
+    # True when a tag that was searched for in a crop was not found
+    def lost(self, ids: np.ndarray) -> bool:
+        return not set(self.tracks).issubset(int(i) for i in ids)
+
+    # True when all of these tags are being tracked
+    def tracking(self, ids: np.ndarray) -> bool:
+        return set(int(i) for i in ids).issubset(self.tracks)
+
+    # Record the tags found in a frame, corners in full frame pixels
+    def update(self, ids: np.ndarray, corners: np.ndarray, full_sweep: bool):
+        self.frames_since_sweep = 0 if full_sweep else self.frames_since_sweep + 1
+
+        tracks = {}
+        for tag_id, tag_corners in zip(ids, corners):
+            tag_id = int(tag_id)
+            box = np.concatenate((tag_corners.min(axis=0), tag_corners.max(axis=0)))
+
+            if tag_id in self.tracks:
+                tracks[tag_id] = self.tracks[tag_id]
+                tracks[tag_id].update(box)
+            else:
+                tracks[tag_id] = TagTrack(box)
+
+        self.tracks = tracks
@@ -0,0 +1,153 @@
+import cv2
+import numpy as np
+
+
+class ServoTracker:
+    """
+    Follows the corners of the tags of one TAG_SERVOING camera between full
+    detections with pyramidal Lucas-Kanade optical flow.
+
+    Only a padded crop around the tags of the last frame is kept and
+    tracked. Every tracked quad is checked by reading its bits back from
+    the frame; when any of them doesn't read as its tag anymore, or every
+    detection_interval frames, a full detection is due (track returns None).
+    """
+
+    DETECTION_INTERVAL = 5
+
+    # Crops grow by this fraction of the largest tag on every side, how far
+    # tags may move between two frames
+    PAD_SCALE = 0.5
+    MIN_PAD = 16
+
+    LK_WIN_SIZE = (21, 21)
+    LK_MAX_LEVEL = 2
+    LK_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+
+    # Tags are read back at this many pixels per bit
+    CELL_SIZE = 4
+    # Bits (border included) a tracked tag may read wrong
+    MAX_BIT_ERRORS = 2
+    # Darkest to brightest cell, less is no tag
+    MIN_CONTRAST = 20
+
+    def __init__(self, detection_interval: int = DETECTION_INTERVAL):
+        self.detection_interval = max(1, detection_interval)
+
+        self.dictionary = cv2.aruco.getPredefinedDictionary(
+            cv2.aruco.DICT_APRILTAG_36H11
+        )
+        # Expected bits of each tag with its black border, read once
+        self.tag_bits: dict[int, np.ndarray] = {}
+
+        self.reset()
+
+    def reset(self):
+        self.ids: np.ndarray | None = None
+        self.corners: np.ndarray | None = None
+        self.frames_since_detection = 0
+        self.shape: tuple[int, ...] | None = None
+
+        # Last frame's gray crop the tags are tracked from and where it is
+        self.patch: np.ndarray | None = None
+        self.box: np.ndarray | None = None
+
+    # Corners of the tracked tags in a gray frame, None when a full
+    # detection is due
+    def track(self, gray: np.ndarray) -> tuple[np.ndarray, np.ndarray] | None:
+        if (
+            self.ids is None
+            or gray.shape != self.shape
+            or self.frames_since_detection >= self.detection_interval
+        ):
+            return None
+
+        x0, y0, x1, y1 = self.box
+        offset = np.asarray((x0, y0), dtype=np.float32)
+        points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.patch,
+            gray[y0:y1, x0:x1],
+            (self.corners.reshape(-1, 2) - offset).reshape(-1, 1, 2),
+            None,
+            winSize=ServoTracker.LK_WIN_SIZE,
+            maxLevel=ServoTracker.LK_MAX_LEVEL,
+            criteria=ServoTracker.LK_CRITERIA,
+        )
+
+        if not status.all():
+            return None
+
+        corners = points.reshape(-1, 4, 2) + offset
+
+        for tag_id, tag_corners in zip(self.ids, corners):
+            if not self.verify(gray, int(tag_id), tag_corners):
+                return None
+
+        self.remember(gray, self.ids, corners)
+        self.frames_since_detection += 1
+
+        return (self.ids, corners)
+
+    # Start tracking the tags found by a full detection in a gray frame,
+    # taken before anything was drawn on it
+    def update(self, gray: np.ndarray, ids: np.ndarray, corners: np.ndarray):
+        self.frames_since_detection = 0
+
+        if len(ids) == 0:
+            self.ids = None
+            return
+
+        self.remember(gray, ids, np.asarray(corners, dtype=np.float32))
+
+    def remember(self, gray: np.ndarray, ids: np.ndarray, corners: np.ndarray):
+        height, width = gray.shape
+        size = (corners.max(axis=1) - corners.min(axis=1)).max()
+        pad = max(ServoTracker.PAD_SCALE * size, ServoTracker.MIN_PAD)
+
+        points = corners.reshape(-1, 2)
+        box = np.concatenate((points.min(axis=0) - pad, points.max(axis=0) + pad))
+        x0, y0, x1, y1 = np.clip(box, 0, (width, height, width, height)).astype(int)
+
+        self.ids = ids
+        self.corners = corners
+        self.shape = gray.shape
+        self.box = np.asarray((x0, y0, x1, y1))
+        # The frame buffer is reused for later frames
+        self.patch = gray[y0:y1, x0:x1].copy()
+
+    # Read the tag's bits at its tracked corners, True when they (mostly)
+    # match the tag
+    def verify(self, gray: np.ndarray, tag_id: int, corners: np.ndarray) -> bool:
+        if tag_id not in self.tag_bits:
+            bits = cv2.aruco.Dictionary.getBitsFromByteList(
+                self.dictionary.bytesList[tag_id : tag_id + 1],
+                self.dictionary.markerSize,
+            )
+            self.tag_bits[tag_id] = np.pad(bits, 1)
+
+        cells = self.tag_bits[tag_id].shape[0]
+        side = cells * ServoTracker.CELL_SIZE
+
+        transform = cv2.getPerspectiveTransform(
+            corners.astype(np.float32),
+            np.float32(((0, 0), (side, 0), (side, side), (0, side))),
+        )
+        tag = cv2.warpPerspective(gray, transform, (side, side))
+
+        # Mean of each cell's inner half, edges blur into their neighbours
+        quarter = ServoTracker.CELL_SIZE // 4
+        cell_values = (
+            tag.reshape(cells, ServoTracker.CELL_SIZE, cells, ServoTracker.CELL_SIZE)[
+                :, quarter:-quarter, :, quarter:-quarter
+            ]
+            .mean(axis=(1, 3))
+        )
+
+        darkest, brightest = cell_values.min(), cell_values.max()
+        if brightest - darkest < ServoTracker.MIN_CONTRAST:
+            return False
+
+        bits = cell_values > (darkest + brightest) / 2
+        errors = np.count_nonzero(bits != self.tag_bits[tag_id])
+
+        return errors <= ServoTracker.MAX_BIT_ERRORS
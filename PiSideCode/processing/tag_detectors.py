@@ -0,0 +1,352 @@
+import cv2
+import json
+import logging
+import numpy as np
+from enum import Enum
+
+from directory import DETECTOR_PROFILES_PATH
+
+try:
+    import robotpy_apriltag
+except ImportError:
+    robotpy_apriltag = None
+
+
+class Detectors(Enum):
+    ARUCO = "ARUCO"
+    APRILTAG = "APRILTAG"
+
+
+# DetectorParameters of ArucoTagDetector, detector profiles override some of
+# them (see processing.detector_tuning)
+ARUCO_PARAMS = {
+    "adaptiveThreshWinSizeMin": 3,  # default=3, 13 seems ok
+    "adaptiveThreshWinSizeMax": 23,  # default=23
+    "adaptiveThreshWinSizeStep": 10,  # default=10
+    # Setting threshold constant to 13 reduces latency by cutting down the
+    # number of contours
+    "adaptiveThreshConstant": 13,  # default=7
+    "minMarkerPerimeterRate": 0.03,  # default=0.03
+    # "maxMarkerPerimeterRate": 4.00,
+    "perspectiveRemovePixelPerCell": 4,
+    # Method should be CORNER_REFINE_CONTOUR or CORNER_REFINE_SUBPIX, not
+    # CORNER_REFINE_APRILTAG (verrry slow)
+    "cornerRefinementMethod": cv2.aruco.CORNER_REFINE_SUBPIX,
+    "cornerRefinementMinAccuracy": 0.1,
+    "cornerRefinementMaxIterations": 30,
+}
+
+# Profile name of ARUCO_PARAMS as they are
+DEFAULT_PROFILE = "DEFAULT"
+
+
+class TagDetector:
+    """
+    Finds AprilTag 36h11 tags in an image.
+
+    detect() returns (ids, corners) like TagProcessor.get_tags: ids as an
+    (N,) int array and corners as an (N, 4, 2) float32 array in image
+    pixels, clockwise from the top left corner of each tag (OpenCV's aruco
+    order). Nothing is filtered or drawn here.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def empty() -> tuple[np.ndarray, np.ndarray]:
+        return (np.empty(0, dtype=int), np.empty((0, 4, 2), dtype=np.float32))
+
+    # Backends that can use it only look for these ids, others are filtered
+    # by TagProcessor anyway
+    def set_valid_tags(self, valid_tags: np.ndarray):
+        pass
+
+    # decimation > 1 searches for tags on the image downscaled by that factor
+    def detect(
+        self, img: np.ndarray, decimation: int = 1
+    ) -> tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+
+class ArucoTagDetector(TagDetector):
+    """OpenCV's cv2.aruco.ArucoDetector"""
+
+    # profile overrides ARUCO_PARAMS (see validate_detector_profile)
+    def __init__(self, profile: dict | None = None):
+        self.full_dictionary = cv2.aruco.getPredefinedDictionary(
+            cv2.aruco.DICT_APRILTAG_36H11
+        )
+        # Row i of the dictionary in use is tag tag_ids[i], None for the
+        # full dictionary where rows are ids
+        self.tag_ids: np.ndarray | None = None
+
+        # Create an aruco detector (finds the tags in images)
+        self.aruco_detector = cv2.aruco.ArucoDetector()
+        self.aruco_detector.setDictionary(self.full_dictionary)
+
+        # Change params to balance speed and accuracy
+        aruco_params = cv2.aruco.DetectorParameters()
+        for name, value in {**ARUCO_PARAMS, **(profile or {})}.items():
+            setattr(aruco_params, name, value)
+        self.aruco_detector.setDetectorParameters(aruco_params)
+
+        # Finds quads on downscaled images, refining corners there is wasted
+        # since they are refined again at full resolution
+        self.decimated_detector = cv2.aruco.ArucoDetector()
+        self.decimated_detector.setDictionary(self.aruco_detector.getDictionary())
+        decimated_params = self.aruco_detector.getDetectorParameters()
+        decimated_params.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_NONE
+        self.decimated_detector.setDetectorParameters(decimated_params)
+
+        self.subpix_win_size = aruco_params.cornerRefinementWinSize
+        self.subpix_criteria = (
+            cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER,
+            aruco_params.cornerRefinementMaxIterations,
+            aruco_params.cornerRefinementMinAccuracy,
+        )
+
+    # Candidates are matched against every dictionary entry, with only the
+    # valid tags in it that is a few dozen instead of 587 and codes of
+    # other tags can not be mistaken for them
+    def set_valid_tags(self, valid_tags: np.ndarray):
+        valid_tags = np.unique(np.asarray(valid_tags, dtype=int))
+        valid_tags = valid_tags[
+            (valid_tags >= 0) & (valid_tags < len(self.full_dictionary.bytesList))
+        ]
+
+        # A dictionary needs at least one marker, nothing can be found anyway
+        if len(valid_tags) == 0:
+            self.tag_ids = valid_tags
+            return
+
+        dictionary = cv2.aruco.Dictionary(
+            self.full_dictionary.bytesList[valid_tags],
+            self.full_dictionary.markerSize,
+            self.full_dictionary.maxCorrectionBits,
+        )
+        self.aruco_detector.setDictionary(dictionary)
+        self.decimated_detector.setDictionary(dictionary)
+        self.tag_ids = valid_tags
+
+    # Dictionary rows to tag ids
+    def to_tag_ids(self, ids: np.ndarray) -> np.ndarray:
+        return ids if self.tag_ids is None else self.tag_ids[ids]
+
+    # With decimation > 1 quads are found on the downscaled image and their
+    # corners refined sub-pixel on the original. Adaptive thresholding, the
+    # largest cost, shrinks with the square of the factor
+    def detect(
+        self, img: np.ndarray, decimation: int = 1
+    ) -> tuple[np.ndarray, np.ndarray]:
+        if self.tag_ids is not None and len(self.tag_ids) == 0:
+            return TagDetector.empty()
+
+        if decimation <= 1:
+            corners, ids, _ = self.aruco_detector.detectMarkers(img)
+
+            if ids is None:
+                return TagDetector.empty()
+
+            return (self.to_tag_ids(ids[:, 0]), np.concatenate(corners))
+
+        # Both the downscale and corner refinement work on one channel
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        height, width = gray.shape
+        small = cv2.resize(
+            gray,
+            (width // decimation, height // decimation),
+            interpolation=cv2.INTER_AREA,
+        )
+        corners, ids, _ = self.decimated_detector.detectMarkers(small)
+
+        if ids is None:
+            return TagDetector.empty()
+
+        # Pixel centers of the downscaled image to the original's
+        points = (np.concatenate(corners).reshape(-1, 2) + 0.5) * decimation - 0.5
+
+        win_size = max(self.subpix_win_size, decimation)
+        points = cv2.cornerSubPix(
+            gray,
+            points.astype(np.float32),
+            (win_size, win_size),
+            (-1, -1),
+            self.subpix_criteria,
+        )
+
+        return (self.to_tag_ids(ids[:, 0]), points.reshape(-1, 4, 2))
+
+
+class AprilTagDetector(TagDetector):
+    """
+    The AprilTag 3 detector through WPILib's robotpy-apriltag.
+
+    Its quad detector is much cheaper than aruco's adaptive thresholding on
+    ARM. decimation is passed on as quad_decimate.
+    """
+
+    FAMILY = "tag36h11"
+
+    # Bit errors to correct, more finds damaged tags but also false ones.
+    # Past 3 the decoder's tables take too much memory
+    BITS_CORRECTED = 1
+    MAX_BITS_CORRECTED = 3
+    # Detections the decoder is less sure of than this are dropped
+    MIN_DECISION_MARGIN = 25.0
+
+    # Corners come top right, top left, bottom left, bottom right in the
+    # image, this reorders them like aruco
+    CORNER_ORDER = [1, 0, 3, 2]
+
+    NUM_THREADS = 2
+    QUAD_SIGMA = 0.0
+
+    # Arguments are checked by validate_apriltag_options
+    def __init__(
+        self,
+        num_threads: int = NUM_THREADS,
+        quad_sigma: float = QUAD_SIGMA,
+        bits_corrected: int = BITS_CORRECTED,
+        min_decision_margin: float = MIN_DECISION_MARGIN,
+    ):
+        if robotpy_apriltag is None:
+            raise RuntimeError("robotpy-apriltag is not installed")
+
+        self.min_decision_margin = min_decision_margin
+
+        self.detector = robotpy_apriltag.AprilTagDetector()
+        if not self.detector.addFamily(AprilTagDetector.FAMILY, bits_corrected):
+            raise RuntimeError(f"Could not add tag family {AprilTagDetector.FAMILY}")
+
+        self.config = robotpy_apriltag.AprilTagDetector.Config()
+        self.config.numThreads = num_threads
+        self.config.quadSigma = quad_sigma
+        self.config.quadDecimate = 1.0
+        self.config.refineEdges = True
+        self.detector.setConfig(self.config)
+
+    def detect(
+        self, img: np.ndarray, decimation: int = 1
+    ) -> tuple[np.ndarray, np.ndarray]:
+        if self.config.quadDecimate != decimation:
+            self.config.quadDecimate = float(decimation)
+            self.detector.setConfig(self.config)
+
+        # Crops of gray frames are views, the detector wants packed rows
+        gray = np.ascontiguousarray(
+            img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        )
+
+        ids = []
+        corners = []
+        for detection in self.detector.detect(gray):
+            if detection.getDecisionMargin() < self.min_decision_margin:
+                continue
+
+            ids.append(detection.getId())
+            corners.append(
+                np.asarray(detection.getCorners((0.0,) * 8)).reshape(4, 2)[
+                    AprilTagDetector.CORNER_ORDER
+                ]
+            )
+
+        if len(ids) == 0:
+            return TagDetector.empty()
+
+        # AprilTag puts pixel centers at .5, OpenCV at whole numbers
+        return (np.asarray(ids), np.asarray(corners, dtype=np.float32) - 0.5)
+
+
+# Backends fall back to aruco when they can not be created
+# aruco_profile is passed on to ArucoTagDetector, options to AprilTagDetector
+def make_detector(
+    detector: Detectors, aruco_profile: dict | None = None, **options
+) -> TagDetector:
+    if detector == Detectors.APRILTAG:
+        try:
+            return AprilTagDetector(**options)
+        except RuntimeError as e:
+            TagDetector.logger.error(f"AprilTag detector unavailable, using aruco: {e}")
+
+    return ArucoTagDetector(aruco_profile)
+
+
+# Profiles are {DetectorParameters attribute: value}, ValueError for
+# attributes that don't exist or values of the wrong kind
+def validate_detector_profile(profile: dict) -> dict:
+    defaults = cv2.aruco.DetectorParameters()
+    cleaned = {}
+
+    for name, value in profile.items():
+        if name.startswith("_") or not hasattr(defaults, name):
+            raise ValueError(f"Unknown detector parameter {name}")
+
+        kind = type(getattr(defaults, name))
+        if kind not in (int, float, bool) or isinstance(value, (list, dict, str)):
+            raise ValueError(f"Can't set detector parameter {name} to {value}")
+
+        cleaned[name] = kind(value)
+
+    return cleaned
+
+
+# AprilTagDetector options are {constructor argument: value}, ValueError for
+# arguments that don't exist or values of the wrong kind or out of range
+def validate_apriltag_options(options: dict) -> dict:
+    # Kind, lowest and highest value (None is unbounded)
+    limits = {
+        "num_threads": (int, 1, None),
+        "quad_sigma": (float, None, None),
+        "bits_corrected": (int, 0, AprilTagDetector.MAX_BITS_CORRECTED),
+        "min_decision_margin": (float, 0.0, None),
+    }
+    cleaned = {}
+
+    for name, value in options.items():
+        if name not in limits:
+            raise ValueError(f"Unknown AprilTag option {name}")
+
+        kind, low, high = limits[name]
+        if (
+            isinstance(value, bool)
+            or not isinstance(value, (int, float))
+            or not np.isfinite(value)
+            or (kind is int and not float(value).is_integer())
+        ):
+            raise ValueError(f"Can't set AprilTag option {name} to {value}")
+        if low is not None and value < low:
+            raise ValueError(f"AprilTag option {name} must be at least {low}")
+        if high is not None and value > high:
+            raise ValueError(f"AprilTag option {name} must be at most {high}")
+
+        cleaned[name] = kind(value)
+
+    return cleaned
+
+
+# Named profiles from disk, written by processing.detector_tuning
+def load_detector_profiles() -> dict[str, dict]:
+    try:
+        with open(DETECTOR_PROFILES_PATH, "r") as f:
+            profiles = json.load(f)
+
+    except FileNotFoundError:
+        return {}
+    except json.decoder.JSONDecodeError as e:
+        TagDetector.logger.error(f"Ignoring detector profiles: {e}")
+        return {}
+
+    valid = {}
+    for name, profile in profiles.items():
+        try:
+            valid[name] = validate_detector_profile(profile)
+        except (ValueError, TypeError, AttributeError) as e:
+            TagDetector.logger.error(f"Ignoring detector profile {name}: {e}")
+
+    return valid
+
+
+def write_detector_profiles(profiles: dict[str, dict]):
+    with open(DETECTOR_PROFILES_PATH, "w") as f:
+        json.dump(profiles, f, indent=4)
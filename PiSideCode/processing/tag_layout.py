@@ -0,0 +1,205 @@
+import cv2
+import json
+import logging
+import math
+import os
+import threading
+import numpy as np
+import wpimath.geometry as wpi
+
+from directory import TAG_LAYOUT_PATH, FALLBACK_TAG_LAYOUT_PATH
+
+logger = logging.getLogger(__name__)
+
+
+# WPILib (x forward, y left, z up) to OpenCV (x right, y down, z forward)
+# axes
+WPILIB_TO_CV2 = np.asarray([[0, -1, 0], [0, 0, -1], [1, 0, 0]], dtype=float)
+
+
+class TagLayout:
+    """
+    A field's tag layout (WPILib AprilTagFieldLayout json) compiled for one
+    tag size.
+
+    Tag i of the layout is row i of every array: ids (N,), corners (N, 4, 3)
+    in field coordinates on OpenCV axes and in the order aruco detects them,
+    transforms (N, 4, 4) field to tag and their inverses, and
+    ippe_rotations (N, 3, 3) and ippe_translations (N, 3) from the field on
+    OpenCV axes to the frame IPPE_SQUARE solves a single tag in
+    (tag_corners). rows() maps any non-negative tag ids to rows, so object
+    points of a frame's tags are one fancy index.
+
+    Never changed once built, get_tag_layout hands out a new one when the
+    layout file or the tag size changes.
+    """
+
+    # Corners (y, z) on a tag facing the field, in aruco's detection order
+    CORNER_POSE_ORDER = np.asarray([(-1, -1), (1, -1), (1, 1), (-1, 1)])
+    # The same corners in the tag's own OpenCV frame, for IPPE_SQUARE
+    CORNER_DRAW_ORDER = np.asarray([(-1, 1, 0), (1, 1, 0), (1, -1, 0), (-1, -1, 0)])
+
+    # tags is the layout's "tags" list, ValueError when ids repeat or are
+    # negative
+    def __init__(self, tags: list[dict], tag_size: float):
+        self.tag_size = tag_size
+
+        self.ids = np.asarray([int(tag["ID"]) for tag in tags], dtype=int)
+        if (self.ids < 0).any() or len(np.unique(self.ids)) != len(self.ids):
+            raise ValueError(f"Tag ids must be unique and >= 0, got {self.ids}")
+
+        # Tag id to row, -1 for ids not in the layout
+        self.lookup = np.full(self.ids.max(initial=-1) + 1, -1, dtype=int)
+        self.lookup[self.ids] = np.arange(len(self.ids))
+
+        half = tag_size / 2
+        self.tag_corners = TagLayout.CORNER_DRAW_ORDER * (half, half, 0)
+
+        # Corners around the tag's center in its frame, WPILib axes
+        offsets = np.zeros((4, 3))
+        offsets[:, 1:] = TagLayout.CORNER_POSE_ORDER * half
+
+        self.corners = np.empty((len(tags), 4, 3))
+        self.transforms = np.empty((len(tags), 4, 4))
+
+        for row, tag in enumerate(tags):
+            pose = TagLayout.make_pose_object(tag["pose"])
+            translation = np.asarray((pose.X(), pose.Y(), pose.Z()))
+
+            corners = translation + offsets @ pose.rotation().toMatrix().T
+            self.corners[row] = corners @ WPILIB_TO_CV2.T
+
+            rot = pose.rotation().rotateBy(wpi.Rotation3d(0, 0, np.pi))
+            self.transforms[row] = np.eye(4)
+            self.transforms[row, :3, :3] = rot.toMatrix()
+            self.transforms[row, :3, 3] = translation
+
+        self.inverses = np.linalg.inv(self.transforms)
+
+        # Rigid fit of each tag's field corners onto tag_corners, centered on
+        # the tag, so camera poses solved on one tag chain onto the field
+        centers = self.corners.mean(axis=1)
+        covariance = np.swapaxes(self.corners - centers[:, np.newaxis], 1, 2)
+        u, _, vt = np.linalg.svd(covariance @ self.tag_corners)
+        reflection = np.ones((len(tags), 3))
+        reflection[:, 2] = np.sign(np.linalg.det(u @ vt))
+        self.ippe_rotations = (
+            np.swapaxes(vt, 1, 2) * reflection[:, np.newaxis]
+        ) @ np.swapaxes(u, 1, 2)
+        self.ippe_translations = -np.einsum(
+            "nij,nj->ni", self.ippe_rotations, centers
+        )
+
+    # Rows of tag ids, -1 for ids not in the layout
+    def rows(self, ids: np.ndarray) -> np.ndarray:
+        ids = np.asarray(ids, dtype=int)
+        rows = np.full(ids.shape, -1, dtype=int)
+
+        known = (ids >= 0) & (ids < len(self.lookup))
+        rows[known] = self.lookup[ids[known]]
+
+        return rows
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        return self.rows(ids) >= 0
+
+    # Field (OpenCV axes) to camera from a camera pose IPPE_SQUARE solved on
+    # the tag in row, as a rotation matrix and translation
+    def field_to_camera(
+        self, row: int, rvec: np.ndarray, tvec: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        rot, _ = cv2.Rodrigues(rvec)
+        return (
+            rot @ self.ippe_rotations[row],
+            rot @ self.ippe_translations[row] + np.ravel(tvec),
+        )
+
+    # Grab AprilTag pose information
+    @staticmethod
+    def make_pose_object(pose_dict) -> wpi.Transform3d:
+        return wpi.Transform3d(
+            wpi.Translation3d(
+                pose_dict["translation"]["x"],
+                pose_dict["translation"]["y"],
+                pose_dict["translation"]["z"],
+            ),
+            wpi.Rotation3d(
+                wpi.Quaternion(
+                    pose_dict["rotation"]["quaternion"]["W"],
+                    pose_dict["rotation"]["quaternion"]["X"],
+                    pose_dict["rotation"]["quaternion"]["Y"],
+                    pose_dict["rotation"]["quaternion"]["Z"],
+                )
+            ).rotateBy(wpi.Rotation3d(0, 0, math.radians(180))),
+        )
+
+
+# Layouts compiled by this process, by tag size, and the layout file they
+# were read from (path, modification time, size)
+_layouts: dict[float, TagLayout] = {}
+_layout_file: tuple | None = None
+_layouts_lock = threading.Lock()
+
+
+# The uploaded layout, or the one shipped with wallEYE without one
+def layout_file() -> tuple:
+    for path in (TAG_LAYOUT_PATH, FALLBACK_TAG_LAYOUT_PATH):
+        try:
+            stat = os.stat(path)
+            return (path, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            pass
+
+    return (FALLBACK_TAG_LAYOUT_PATH, 0, 0)
+
+
+def read_tag_layout(tag_size: float) -> TagLayout:
+    try:
+        with open(TAG_LAYOUT_PATH, "r") as f:
+            layout = TagLayout(json.load(f)["tags"], tag_size)
+            logger.info("Tag layout loaded")
+            return layout
+
+    except (
+        FileNotFoundError,
+        json.decoder.JSONDecodeError,
+        KeyError,
+        TypeError,
+        ValueError,
+    ):
+        with open(FALLBACK_TAG_LAYOUT_PATH, "r") as f:
+            layout = TagLayout(json.load(f)["tags"], tag_size)
+            logger.warning("FALLBACK Tag layout loaded")
+            return layout
+
+
+# Called every frame, only a stat of the layout file unless it or the tag
+# size changed
+def get_tag_layout(tag_size: float) -> TagLayout:
+    global _layout_file
+
+    current = layout_file()
+    layout = _layouts.get(tag_size)
+    if layout is not None and current == _layout_file:
+        return layout
+
+    with _layouts_lock:
+        if current != _layout_file:
+            _layouts.clear()
+            _layout_file = current
+
+        if tag_size not in _layouts:
+            _layouts[tag_size] = read_tag_layout(tag_size)
+
+        return _layouts[tag_size]
+
+
+# Check an uploaded layout compiles before replacing the current one, readers
+# see either the old or the new file, never part of one
+def write_tag_layout(contents: str):
+    TagLayout(json.loads(contents)["tags"], 1.0)
+
+    temporary = TAG_LAYOUT_PATH + ".tmp"
+    with open(temporary, "w") as f:
+        f.write(contents)
+    os.replace(temporary, TAG_LAYOUT_PATH)
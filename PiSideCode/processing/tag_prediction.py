@@ -0,0 +1,150 @@
+import cv2
+import math
+import numpy as np
+import wpimath.geometry as wpi
+
+from processing.roi_tracker import RoiTracker
+from processing.tag_layout import WPILIB_TO_CV2, TagLayout
+
+
+# Camera extrinsics as stored by CameraInfo: x, y, z in meters and roll,
+# pitch, yaw in degrees of the camera relative to the robot's center
+def robot_to_camera_transform(values: tuple[float, ...]) -> wpi.Transform3d:
+    x, y, z, roll, pitch, yaw = values
+    return wpi.Transform3d(
+        wpi.Translation3d(x, y, z),
+        wpi.Rotation3d(math.radians(roll), math.radians(pitch), math.radians(yaw)),
+    )
+
+
+class TagPredictor:
+    """
+    Predicts which tags one camera should see and where from the robot's
+    pose on the field (see NetworkIO.get_robot_pose), where the camera sits
+    on the robot and the tag layout, so TagProcessor only has to search
+    padded crops around them for those ids.
+
+    Odometry drifts and extrinsics are never exact, so a full frame sweep
+    still runs every sweep_interval frames and whenever the predicted tags
+    are not found (see TagProcessor.get_tags).
+    """
+
+    SWEEP_INTERVAL = 15
+
+    # Crops grow by this fraction of the tag's predicted size on every
+    # side, and at least by ANGLE_PAD of pose error seen from the camera
+    PAD_SCALE = 0.5
+    ANGLE_PAD = math.radians(5)
+
+    # Corners closer than this (meters) or further off the optical axis than
+    # this (tangent of the angle) are not projected, the distortion model
+    # means nothing out there
+    MIN_DEPTH = 0.1
+    MAX_TAN = 1.5
+
+    def __init__(self, sweep_interval: int = SWEEP_INTERVAL):
+        self.sweep_interval = max(1, sweep_interval)
+        self.frames_since_sweep = 0
+
+    # Crops as (x0, y0, x1, y1) rows and the ids expected in them, None for a
+    # full frame sweep, also when no tag is expected in view (odometry or the
+    # extrinsics may be off). Crops are None when the tags cover too much of
+    # the frame, then only the ids are restricted
+    # robot_pose is (x, y, yaw) on the field
+    def predict(
+        self,
+        shape: tuple[int, ...],
+        K: np.ndarray | None,
+        D: np.ndarray | None,
+        robot_pose: tuple[float, float, float] | None,
+        robot_to_camera: tuple[float, ...],
+        layout: TagLayout,
+        valid_tags: np.ndarray,
+    ) -> tuple[np.ndarray | None, np.ndarray] | None:
+        if (
+            robot_pose is None
+            or K is None
+            or D is None
+            or self.frames_since_sweep >= self.sweep_interval
+        ):
+            self.frames_since_sweep = 0
+            return None
+
+        self.frames_since_sweep += 1
+
+        x, y, yaw = robot_pose
+        camera_pose = wpi.Pose3d(
+            wpi.Translation3d(x, y, 0), wpi.Rotation3d(0, 0, yaw)
+        ).transformBy(robot_to_camera_transform(robot_to_camera))
+
+        # Field (OpenCV axes, like the layout corners) to camera
+        rot = camera_pose.rotation().toMatrix().T
+        translation = np.asarray(
+            (camera_pose.X(), camera_pose.Y(), camera_pose.Z())
+        )
+        rot_cv2 = WPILIB_TO_CV2 @ rot @ WPILIB_TO_CV2.T
+        translation_cv2 = -WPILIB_TO_CV2 @ rot @ translation
+
+        ids = np.asarray(valid_tags, dtype=int)
+        rows = layout.rows(ids)
+        ids = ids[rows >= 0]
+        if len(ids) == 0:
+            return None
+
+        corners = layout.corners[rows[rows >= 0]]
+        in_camera = corners @ rot_cv2.T + translation_cv2
+
+        depth = in_camera[..., 2]
+        in_view = (depth > TagPredictor.MIN_DEPTH).all(axis=1)
+        in_view &= (
+            np.abs(in_camera[..., :2]) < TagPredictor.MAX_TAN * depth[..., np.newaxis]
+        ).all(axis=(1, 2))
+
+        ids = ids[in_view]
+        if len(ids) == 0:
+            return None
+
+        projected, _ = cv2.projectPoints(
+            in_camera[in_view].reshape(-1, 3),
+            np.zeros(3),
+            np.zeros(3),
+            K,
+            D,
+        )
+        projected = projected.reshape(-1, 4, 2)
+
+        # Corners are clockwise in the image only when the tag faces the
+        # camera, the back of a tag can't be detected
+        rolled = np.roll(projected, -1, axis=1)
+        area = (
+            projected[..., 0] * rolled[..., 1] - rolled[..., 0] * projected[..., 1]
+        ).sum(axis=1)
+        ids = ids[area > 0]
+        projected = projected[area > 0]
+
+        height, width = shape[:2]
+        boxes = np.concatenate((projected.min(axis=1), projected.max(axis=1)), axis=1)
+        size = (boxes[:, 2:] - boxes[:, :2]).max(axis=1)
+        pad = np.maximum(
+            TagPredictor.PAD_SCALE * size,
+            K[0, 0] * math.tan(TagPredictor.ANGLE_PAD),
+        )[:, np.newaxis]
+        boxes = boxes + np.concatenate((-pad, -pad, pad, pad), axis=1)
+        boxes = np.clip(boxes, 0, (width, height, width, height)).astype(int)
+
+        # Entirely outside the frame
+        inside = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+        ids = ids[inside]
+        boxes = boxes[inside]
+
+        if len(ids) == 0:
+            return None
+
+        boxes = RoiTracker.merge(boxes)
+
+        # Searching most of the frame in crops costs more than one sweep
+        area = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1).sum()
+        if area > RoiTracker.MAX_AREA_FRACTION * width * height:
+            return (None, ids)
+
+        return (boxes, ids)
@@ -2,71 +2,312 @@ import cv2
 import logging
 import numpy as np
 import json
+from concurrent.futures import ThreadPoolExecutor
+
+from processing.detection_mask import DetectionMask
+from processing.roi_tracker import RoiTracker
+from processing.tag_detectors import (
+    ArucoTagDetector,
+    Detectors,
+    TagDetector,
+    make_detector,
+)
 
 
 class TagProcessor:
     logger = logging.getLogger(__name__)
+
+    # Tiles overlap by this fraction of the frame height, tags larger than
+    # that crossing a seam are not found whole in any tile
+    TILE_OVERLAP = 0.25
+    # Detections of one tag found in two overlapping tiles, mean corner
+    # distance in pixels
+    DUPLICATE_DISTANCE = 4.0
     
     # Create a pose estimator
-    def __init__(self):
-        # Create an aruco detector (finds the tags in images)
-        self.aruco_detector = cv2.aruco.ArucoDetector()
-        self.aruco_detector.setDictionary(
-            cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_APRILTAG_36H11)
-        )
+    # apriltag_options are passed on to AprilTagDetector
+    def __init__(self, apriltag_options: dict | None = None):
+        self.apriltag_options = apriltag_options or {}
+
+        # Backends are created the first time a camera asks for them, one per
+        # tile since tiles are detected at the same time
+        self.detectors: dict[tuple[Detectors, int], TagDetector] = {
+            (Detectors.ARUCO, 0): make_detector(Detectors.ARUCO)
+        }
+
+        # Valid tags the backends were last told about
+        self.valid_tags: np.ndarray | None = None
+
+        # Started with the first tiled frame, one thread per tile
+        self.tile_pool: ThreadPoolExecutor | None = None
+        self.tile_pool_size = 0
+
+        # Only this part of frames is searched (see set_detection_mask)
+        self.mask: DetectionMask | None = None
+
+        # DetectorParameters overrides of the aruco backends (see
+        # set_detector_profile)
+        self.aruco_profile: dict = {}
+
+    def get_detector(self, detector: Detectors, tile: int = 0) -> TagDetector:
+        if (detector, tile) not in self.detectors:
+            self.detectors[(detector, tile)] = make_detector(
+                detector, self.aruco_profile, **self.apriltag_options
+            )
+            if self.valid_tags is not None:
+                self.detectors[(detector, tile)].set_valid_tags(self.valid_tags)
+
+        return self.detectors[(detector, tile)]
+
+    # Backends are only rebuilt when the set changes (Data.set_valid_tags)
+    def set_valid_tags(self, valid_tags: np.ndarray):
+        if valid_tags is self.valid_tags or (
+            self.valid_tags is not None and np.array_equal(valid_tags, self.valid_tags)
+        ):
+            return
+
+        TagProcessor.logger.debug(f"Detecting tags {np.asarray(valid_tags).tolist()}")
+
+        self.valid_tags = valid_tags
+        for backend in self.detectors.values():
+            backend.set_valid_tags(valid_tags)
+
+    # spec is CameraInfo.detection_mask, rebuilt only when it changes
+    def set_detection_mask(self, spec: dict | None):
+        if DetectionMask.is_empty(spec):
+            self.mask = None
+        elif self.mask is None or self.mask.spec() != spec:
+            self.mask = DetectionMask(spec)
 
-        # Change params to balance speed and accuracy
-        aruco_params = cv2.aruco.DetectorParameters()
-        aruco_params.adaptiveThreshWinSizeMin = 3 #default=3, 13 seems ok
-        aruco_params.adaptiveThreshWinSizeMax = 23 #default=23
-        aruco_params.adaptiveThreshWinSizeStep = 10 #default=10
-        # Setting threshold constant to 13 reduces latency by cutting down the number of contours
-        aruco_params.adaptiveThreshConstant = 13 #default=7
-        aruco_params.minMarkerPerimeterRate = 0.03 #default=0.03
-        #aruco_params.maxMarkerPerimeterRate = 4.00
-        aruco_params.perspectiveRemovePixelPerCell = 4
-        # Method should be CORNER_REFINE_CONTOUR or CORNER_REFINE_SUBPIX, not CORNER_REFINE_APRILTAG (verrry slow)
-        aruco_params.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_SUBPIX
-        aruco_params.cornerRefinementMinAccuracy = 0.1
-        aruco_params.cornerRefinementMaxIterations = 30
-        self.aruco_detector.setDetectorParameters(aruco_params)
-
-    def get_tags(self, img: np.ndarray, valid_tags: np.ndarray, draw: bool):
+    # profile is CameraInfo.detector_params, aruco backends are recreated
+    # when it changes
+    def set_detector_profile(self, profile: dict | None):
+        profile = profile or {}
+        if profile == self.aruco_profile:
+            return
+
+        TagProcessor.logger.info(f"Aruco detector parameters {profile}")
+
+        self.aruco_profile = profile
+        self.detectors = {
+            key: backend
+            for key, backend in self.detectors.items()
+            if not isinstance(backend, ArucoTagDetector)
+        }
+
+    # Find tags, with a tracker only the regions it predicts are searched
+    # guide is what TagPredictor.predict returned, searched instead when the
+    # tracker has nothing to follow or odometry expects tags it doesn't track
+    def get_tags(
+        self,
+        img: np.ndarray,
+        valid_tags: np.ndarray,
+        draw: bool,
+        tracker: RoiTracker | None = None,
+        decimation: int = 1,
+        detector: Detectors = Detectors.ARUCO,
+        tiles: int = 1,
+        guide: tuple[np.ndarray | None, np.ndarray] | None = None,
+    ):
         if img is None:
             return (np.asarray([]), np.asarray([]))
 
-        corners, ids, _ = self.aruco_detector.detectMarkers(img)
+        regions = None if tracker is None else tracker.regions(img.shape)
+        search_tags = None
+        guided = guide is not None and (
+            regions is None or not tracker.tracking(guide[1])
+        )
 
-        if ids is None:
-            return (np.asarray([]), np.asarray([]))
+        if guided:
+            regions, search_tags = guide
+
+        ids, corners = self.find_tags(
+            img, valid_tags, regions, decimation, detector, tiles, search_tags
+        )
 
-        ids = np.asarray(ids.squeeze())
+        # Predicted tags were not where odometry put them or a tracked tag
+        # left its crop, look for them everywhere
+        if (guided and len(ids) == 0) or (
+            tracker is not None and regions is not None and tracker.lost(ids)
+        ):
+            regions = None
+            guided = False
+            ids, corners = self.find_tags(
+                img, valid_tags, regions, decimation, detector, tiles
+            )
 
-        if ids.shape == 0:
+        # Guided searches cover every tag expected in the frame, they count
+        # as sweeps
+        if tracker is not None:
+            tracker.update(ids, corners, regions is None or guided)
+
+        if draw and self.mask is not None:
+            self.mask.draw(img)
+
+        if len(corners) == 0:
+            # No tags
             return (np.asarray([]), np.asarray([]))
 
-        mask = np.isin(ids, valid_tags)
+        if draw:
+            TagProcessor.draw_tags(img, ids, corners)
+
+        return (ids, corners)
+
+    # Draw lines around tags for ease of seeing (website)
+    @staticmethod
+    def draw_tags(img: np.ndarray, ids: np.ndarray, corners: np.ndarray):
+        if len(corners) == 0 or len(corners) != len(ids):
+            return
+
+        try:
+            cv2.aruco.drawDetectedMarkers(img, corners[:, np.newaxis], ids)
+        except cv2.error:
+            TagProcessor.logger.error(
+                f"Could not draw tags: {ids} with corners {corners}"
+            )
+
+    # Run the detector on each region, corners are moved back to full frame
+    # coordinates
+    def detect_regions(
+        self,
+        backend: TagDetector,
+        img: np.ndarray,
+        regions: np.ndarray,
+        decimation: int = 1,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        return TagProcessor.join_regions(
+            [
+                backend.detect(img[y0:y1, x0:x1], decimation)
+                for x0, y0, x1, y1 in regions
+            ],
+            regions,
+        )
+
+    # Move detections made in regions back to full frame coordinates
+    @staticmethod
+    def join_regions(
+        detections: list[tuple[np.ndarray, np.ndarray]], regions: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        if len(detections) == 0:
+            return TagDetector.empty()
+
+        ids = np.concatenate([tag_ids for tag_ids, _ in detections])
+        corners = np.concatenate(
+            [
+                tag_corners + np.asarray((x0, y0), dtype=np.float32)
+                for (_, tag_corners), (x0, y0, _, _) in zip(detections, regions)
+            ]
+        )
+
+        return (ids, corners)
+
+    # tiles x tiles overlapping (x0, y0, x1, y1) rows covering the frame
+    @staticmethod
+    def tile_regions(shape: tuple[int, ...], tiles: int) -> np.ndarray:
+        height, width = shape[:2]
+        pad = TagProcessor.TILE_OVERLAP * height / 2
+
+        xs = np.linspace(0, width, tiles + 1)
+        ys = np.linspace(0, height, tiles + 1)
+
+        regions = [
+            (xs[i] - pad, ys[j] - pad, xs[i + 1] + pad, ys[j + 1] + pad)
+            for j in range(tiles)
+            for i in range(tiles)
+        ]
+
+        return np.clip(regions, 0, (width, height, width, height)).astype(int)
+
+    # Detect each tile on its own thread. Tags inside an overlap are found
+    # by both tiles and only kept once
+    def detect_tiles(
+        self, detector: Detectors, img: np.ndarray, tiles: int, decimation: int = 1
+    ) -> tuple[np.ndarray, np.ndarray]:
+        regions = TagProcessor.tile_regions(img.shape, tiles)
+
+        if self.tile_pool_size < len(regions):
+            if self.tile_pool is not None:
+                self.tile_pool.shutdown(wait=False)
+            self.tile_pool = ThreadPoolExecutor(
+                max_workers=len(regions), thread_name_prefix="tag_tiles"
+            )
+            self.tile_pool_size = len(regions)
+
+        # Each tile has its own detector, backends are not thread safe
+        futures = [
+            self.tile_pool.submit(
+                self.get_detector(detector, tile).detect,
+                img[y0:y1, x0:x1],
+                decimation,
+            )
+            for tile, (x0, y0, x1, y1) in enumerate(regions)
+        ]
+
+        ids, corners = TagProcessor.join_regions(
+            [future.result() for future in futures], regions
+        )
+
+        return TagProcessor.remove_duplicates(ids, corners)
+
+    # Same id with corners within DUPLICATE_DISTANCE of a tag already kept
+    @staticmethod
+    def remove_duplicates(
+        ids: np.ndarray, corners: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        keep = []
+
+        for i in range(len(ids)):
+            if not any(
+                ids[j] == ids[i]
+                and np.linalg.norm(corners[j] - corners[i], axis=1).mean()
+                < TagProcessor.DUPLICATE_DISTANCE
+                for j in keep
+            ):
+                keep.append(i)
+
+        return (ids[keep], corners[keep])
+
+    # Detect valid tags in the whole image (regions is None), split into
+    # tiles x tiles tiles, or in regions. Only inside the detection mask if
+    # there is one
+    # Backends decode valid_tags, the per-frame search_tags of a guided
+    # search are only filtered for so their dictionaries are not rebuilt
+    # Returns ids and their corners as an (N, 4, 2) array
+    def find_tags(
+        self,
+        img: np.ndarray,
+        valid_tags: np.ndarray,
+        regions: np.ndarray | None,
+        decimation: int = 1,
+        detector: Detectors = Detectors.ARUCO,
+        tiles: int = 1,
+        search_tags: np.ndarray | None = None,
+    ):
+        self.set_valid_tags(valid_tags)
+        backend = self.get_detector(detector)
+
+        if self.mask is not None:
+            # Searched crop starts at offset in the frame
+            img, offset = self.mask.apply(img)
+            if regions is not None:
+                regions = self.mask.to_crop(regions)
+
+        if regions is not None:
+            ids, corners = self.detect_regions(backend, img, regions, decimation)
+        elif tiles > 1:
+            ids, corners = self.detect_tiles(detector, img, tiles, decimation)
+        else:
+            ids, corners = backend.detect(img, decimation)
+
+        if self.mask is not None:
+            corners = corners + offset
+
+        mask = np.isin(ids, valid_tags if search_tags is None else search_tags)
 
         # if not mask.all():
         #     TagProcessor.logger.warning(f"Invalid Tags: {ids[~mask]}")
 
-        ids = ids[mask]
-        corners = np.asarray(corners)[mask]
-
-        if len(corners.shape) == 5 and len(corners) > 0:
-            corners = corners[0]
-
-        if len(corners) > 0:
-            # Draw lines around tags for ease of seeing (website)
-            if draw and len(corners) == len(ids):
-                try:
-                    cv2.aruco.drawDetectedMarkers(img, corners, ids)
-                except cv2.error:
-                    TagProcessor.logger.error(
-                        f"Could not draw tags: {ids} with corners {corners}"
-                    )
-        else:
-            # No tags
+        if not mask.any():
             return (np.asarray([]), np.asarray([]))
 
-        return (ids, corners[:, 0])
+        return (ids[mask], corners[mask])
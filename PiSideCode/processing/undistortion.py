@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+
+
+class Undistortion:
+    """
+    One camera's calibration as pose solving uses it. Tag corners are
+    undistorted once per frame in one call, every solve after that uses the
+    ideal pinhole camera K without distortion instead of undistorting the
+    same points again and projecting through the distortion model.
+
+    PoseProcessor keeps one per camera and only replaces it when K or D
+    change (Cameras.set_calibration, from a new or imported calibration or
+    another resolution's).
+    """
+
+    def __init__(self, K: np.ndarray, D: np.ndarray):
+        # What the camera's calibration was when built, vision workers get
+        # copies of the same arrays every frame
+        self.source_K = K
+        self.source_D = D
+
+        self.K = np.asarray(K, dtype=float)
+        self.D = np.asarray(D, dtype=float).ravel()
+        self.distorted = bool(np.any(self.D != 0))
+
+    def matches(self, K: np.ndarray, D: np.ndarray) -> bool:
+        if K is self.source_K and D is self.source_D:
+            return True
+
+        return np.array_equal(K, self.source_K) and np.array_equal(D, self.source_D)
+
+    # Pixel points (..., 2) to where the pinhole camera K sees them
+    def undistort(self, points: np.ndarray) -> np.ndarray:
+        if not self.distorted or len(points) == 0:
+            return points
+
+        return cv2.undistortPoints(
+            points.reshape(-1, 1, 2), self.K, self.D, P=self.K
+        ).reshape(points.shape)
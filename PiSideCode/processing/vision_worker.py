@@ -0,0 +1,221 @@
+import cv2
+import logging
+import multiprocessing as mp
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import wpimath.geometry as wpi
+
+from camera.camera_info import Modes
+from processing.tag_detectors import Detectors
+
+
+# wpimath geometry does not pickle, send poses as plain tuples
+def pose_to_tuple(pose: wpi.Pose3d) -> tuple[float, ...]:
+    q = pose.rotation().getQuaternion()
+    return (pose.X(), pose.Y(), pose.Z(), q.W(), q.X(), q.Y(), q.Z())
+
+
+def pose_from_tuple(values: tuple[float, ...]) -> wpi.Pose3d:
+    x, y, z, qw, qx, qy, qz = values
+    return wpi.Pose3d(
+        wpi.Translation3d(x, y, z), wpi.Rotation3d(wpi.Quaternion(qw, qx, qy, qz))
+    )
+
+
+def _worker_main(
+    identifier: str,
+    requests: Connection,
+    results: Connection,
+    num_threads: int,
+    apriltag_options: dict | None,
+):
+    # Imported here so the parent only pays for them once per worker
+    from processing.camera_processor import CameraProcessor
+
+    logger = logging.getLogger(__name__)
+    logger.info(f"Vision worker started for {identifier}")
+
+    cv2.setNumThreads(num_threads)
+
+    processor = CameraProcessor(identifier, apriltag_options)
+    shm = None
+
+    while True:
+        request = requests.recv()
+
+        # Parent is shutting us down
+        if request is None:
+            break
+
+        # Everything after the shape is passed on to CameraProcessor.process
+        shm_name, shape, mode, *options = request
+
+        if shm is None or shm.name != shm_name:
+            if shm is not None:
+                shm.close()
+
+            shm = SharedMemory(shm_name)
+            # The parent owns the block, don't let this process unlink it
+            resource_tracker.unregister(shm._name, "shared_memory")
+
+        image = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+
+        result = processor.process(image, mode, *options)
+
+        if mode == Modes.POSE_ESTIMATION:
+            (pose1, pose2), ids, corners, ambig = result
+            result = (
+                (pose_to_tuple(pose1), pose_to_tuple(pose2)),
+                ids,
+                corners,
+                ambig,
+            )
+
+        # Drop our view before the parent may resize the block
+        del image
+        results.send((result, processor.camera_solve()))
+
+    if shm is not None:
+        shm.close()
+
+
+class VisionWorker:
+    """
+    Detection and pose solving for one camera in its own process.
+
+    Frames are copied once into a shared memory block owned by this object,
+    requests and results go over one-way pipes (single producer, single
+    consumer so no locking). Annotations drawn by the worker land in the
+    shared block, available through frame after collect().
+    """
+
+    logger = logging.getLogger(__name__)
+
+    # Fork so the worker does not re-run init.py (spawn and forkserver
+    # children import the main script again). Workers must be created before
+    # the parent starts capture, web or logging threads or uses OpenCV's
+    # thread pool, a lock held by one of them at fork time stays held in the
+    # child
+    CONTEXT = mp.get_context("fork")
+
+    def __init__(
+        self,
+        identifier: str,
+        num_threads: int = 1,
+        apriltag_options: dict | None = None,
+    ):
+        self.identifier = identifier
+
+        request_recv, self.requests = VisionWorker.CONTEXT.Pipe(duplex=False)
+        self.results, result_send = VisionWorker.CONTEXT.Pipe(duplex=False)
+
+        self.process = VisionWorker.CONTEXT.Process(
+            target=_worker_main,
+            args=(
+                identifier,
+                request_recv,
+                result_send,
+                num_threads,
+                apriltag_options,
+            ),
+            name=f"vision_{identifier}",
+            daemon=True,
+        )
+        self.process.start()
+
+        self.shm: SharedMemory | None = None
+        self.frame: np.ndarray | None = None
+        self.mode: Modes | None = None
+        # CameraProcessor.camera_solve of the last collected frame
+        self.camera_solve = None
+
+    # sweep_interval turns on ROI tracking (see RoiTracker) in the worker
+    def submit(
+        self,
+        image: np.ndarray,
+        mode: Modes,
+        K: np.ndarray | None,
+        D: np.ndarray | None,
+        draw: bool,
+        valid_tags: np.ndarray,
+        tag_size: float,
+        sweep_interval: int | None = None,
+        decimation: int = 1,
+        detector: Detectors = Detectors.ARUCO,
+        tiles: int = 1,
+        robot_pose: tuple[float, float, float] | None = None,
+        robot_to_camera: tuple[float, ...] | None = None,
+        detection_mask: dict | None = None,
+        servo_interval: int | None = None,
+        detector_params: dict | None = None,
+        pose_tracking: bool = False,
+    ):
+        if self.shm is None or self.shm.size < image.nbytes:
+            self.frame = None
+            if self.shm is not None:
+                self.shm.close()
+                self.shm.unlink()
+
+            self.shm = SharedMemory(create=True, size=image.nbytes)
+
+        self.frame = np.ndarray(image.shape, dtype=np.uint8, buffer=self.shm.buf)
+        np.copyto(self.frame, image)
+        self.mode = mode
+
+        self.requests.send(
+            (
+                self.shm.name,
+                image.shape,
+                mode,
+                K,
+                D,
+                draw,
+                valid_tags,
+                tag_size,
+                sweep_interval,
+                decimation,
+                detector,
+                tiles,
+                robot_pose,
+                robot_to_camera,
+                detection_mask,
+                servo_interval,
+                detector_params,
+                pose_tracking,
+            )
+        )
+
+    # Wait for the result of the last submit, in the same shape get_pose or
+    # get_tags would have returned it
+    def collect(self):
+        if not self.process.is_alive():
+            raise RuntimeError(f"Vision worker for {self.identifier} died")
+
+        result, self.camera_solve = self.results.recv()
+
+        if self.mode == Modes.POSE_ESTIMATION:
+            (pose1, pose2), ids, corners, ambig = result
+            return (
+                (pose_from_tuple(pose1), pose_from_tuple(pose2)),
+                ids,
+                corners,
+                ambig,
+            )
+
+        return result
+
+    def close(self):
+        try:
+            self.requests.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+
+        self.process.join(1.0)
+        self.frame = None
+
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
@@ -10,6 +10,12 @@ import time
 class NetworkIO:
     logger = logging.getLogger(__name__)
 
+    # Robot poses older than this (seconds) are not used
+    MAX_ROBOT_POSE_AGE = 0.5
+
+    # Key of the joint robot pose packet, no camera may be named this
+    ROBOT_POSE_KEY = "Robot"
+
     # Create a Network Tables Client with given info
     def __init__(
         self, test: bool, team: int, table_name: str, port: int, num_cams: int
@@ -26,6 +32,7 @@ class NetworkIO:
         self.inst.startClient4("WallEye_Client")
         self.update_num = []
         self.connection = []
+        self.robot_update_num = 0
       
         if test:
             self.inst.setServer("127.0.0.1", 5810)
@@ -43,8 +50,51 @@ class NetworkIO:
 
         # Pose publisher
         for index in range(num_cams):
+            self.add_camera(index)
+
+        self.subscribe_robot_pose()
+
+    # The robot publishes its odometry pose as [x, y, yaw] (meters, radians)
+    # on the field and optionally its field relative velocity as
+    # [vx, vy, omega] for guided search (see TagPredictor)
+    def subscribe_robot_pose(self):
+        self.robot_pose_sub = self.table.getDoubleArrayTopic("RobotPose").subscribe(
+            []
+        )
+        self.robot_velocity_sub = self.table.getDoubleArrayTopic(
+            "RobotVelocity"
+        ).subscribe([])
+
+    # Latest robot pose moved forward to now with the robot's velocity, None
+    # when the robot has not published a recent one
+    def get_robot_pose(self) -> tuple[float, float, float] | None:
+        pose = self.robot_pose_sub.getAtomic()
+        if len(pose.value) < 3:
+            return None
+
+        age = (ntcore._now() - pose.time) / 1e6
+        if age > NetworkIO.MAX_ROBOT_POSE_AGE:
+            return None
+
+        x, y, yaw = pose.value[:3]
+
+        velocity = self.robot_velocity_sub.getAtomic()
+        if len(velocity.value) >= 3:
+            vx, vy, omega = velocity.value[:3]
+            x += vx * age
+            y += vy * age
+            yaw += omega * age
+
+        return (x, y, yaw)
+
+    # Publishers are indexed by camera, more are added when a camera with a
+    # new index is plugged in
+    def add_camera(self, index: int):
+        while len(self.publish_connection) <= index:
             self.publish_connection.append(
-                self.table.getBooleanTopic("Connected" + str(index)).publish(
+                self.table.getBooleanTopic(
+                    "Connected" + str(len(self.publish_connection))
+                ).publish(
                     ntcore.PubSubOptions(
                         periodic=0.01, sendAll=True, keepDuplicates=True
                     )
@@ -59,18 +109,21 @@ class NetworkIO:
 
     def set_table(self, name: str):
         self.table = self.inst.getTable(name)
+        self.subscribe_robot_pose()
 
-    def udp_pose_publish(self, names, pose1, pose2, ambig, timestamps, tags, tag_corners):
+    # indices are the cameras' stable publisher indices, names their nicknames
+    def udp_pose_publish(self, indices, names, pose1, pose2, ambig, timestamps, tags, tag_corners):
         data_dict = {}
 
         for i in range(len(pose1)):
             if pose1[i] == PoseProcessor.BAD_POSE:
                 continue
 
-            self.update_num[i] += 1
+            self.add_camera(indices[i])
+            self.update_num[indices[i]] += 1
             camDict = {
                 "Mode": 0,
-                "Update": self.update_num[i],
+                "Update": self.update_num[indices[i]],
                 "Pose1": self.pose_to_dict(pose1[i]),
                 "Pose2": self.pose_to_dict(pose2[i]),
                 "Ambig": ambig[i],
@@ -88,7 +141,31 @@ class NetworkIO:
             # NetworkIO.logger.error("Failed to publish pose in UDP: ", exc_info=e)
             pass
 
-    def udp_tag_publish(self, names, tags, tag_corners, timestamps):
+    # JointPoseSolver's robot pose in a packet of its own, so no camera's
+    # entry can replace it. names are the nicknames of the cameras it was
+    # solved from, tags their tag ids
+    def udp_robot_pose_publish(self, pose, error, names, tags, timestamp):
+        self.robot_update_num += 1
+        data_dict = {
+            NetworkIO.ROBOT_POSE_KEY: {
+                "Mode": 2,
+                "Update": self.robot_update_num,
+                "Pose": self.pose_to_dict(pose),
+                "Error": error,
+                "Cameras": names,
+                "Tags": sorted({int(tag_id) for ids in tags for tag_id in ids}),
+                "Timestamp": (time.monotonic_ns() / 1000000 - timestamp),
+            }
+        }
+        data_str = json.dumps(data_dict)
+
+        try:
+            self.sock.sendto(bytes(data_str, "utf-8"), (self.robot_ip, self.robot_port))
+        except Exception as e:
+            # NetworkIO.logger.error("Failed to publish pose in UDP: ", exc_info=e)
+            pass
+
+    def udp_tag_publish(self, indices, names, tags, tag_corners, timestamps):
         data_dict = {}
 
         # Loop through each camera
@@ -96,12 +173,13 @@ class NetworkIO:
             if len(tags) == 0:
                 continue
 
-            self.update_num[i] += 1 
+            self.add_camera(indices[i])
+            self.update_num[indices[i]] += 1 
 
             # Data for camera i
             data_dict[names[i]] = {
                 "Mode": 1,
-                "Update": (self.update_num[i]),
+                "Update": (self.update_num[indices[i]]),
                 "Tags": tags[i].tolist(), 
                 "TagCorners": tag_corners[i].tolist(),
                 "Timestamp": (time.monotonic_ns() / 1000000 - timestamps[i]),
@@ -134,10 +212,12 @@ class NetworkIO:
         self.publish_update.set(self.update_num)
 
     def set_connection_value(self, index: int, val):
+        self.add_camera(index)
         self.connection[index] = val
         self.publish_connection[index].set(val)
 
     def get_connection_value(self, index: int):
+        self.add_camera(index)
         return self.connection[index]
 
     def destroy(self):
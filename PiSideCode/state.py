@@ -5,6 +5,10 @@ from camera.camera_info import CameraInfo
 from directory import CONFIG_DATA_PATH
 from publisher.network_table_publisher import NetworkIO
 from calibration.calibration import CalibType
+from camera.replay_camera import ReplayPace
+from processing.roi_tracker import RoiTracker
+from processing.servo_tracker import ServoTracker
+from processing.tag_detectors import AprilTagDetector, validate_apriltag_options
 import logging
 import socket
 from networking import set_ip, get_current_ip
@@ -13,6 +17,10 @@ import os
 import numpy as np
 
 
+REPLAY_PATH_ENV = "WALLEYE_REPLAY"
+REPLAY_PACE_ENV = "WALLEYE_REPLAY_PACE"
+
+
 class States(Enum):
     IDLE = "IDLE"
     BEGIN_CALIBRATION = "BEGIN_CALIBRATION"
@@ -64,6 +72,47 @@ class Data:
         self.tag_size = 0.157
         self.udp_port = 5802
 
+        # Run detection and pose solving in one process per camera
+        self.use_worker_processes: bool = False
+        # Otherwise process cameras at the same time on a thread pool
+        self.parallel_cameras: bool = True
+
+        # Play back recorded frames instead of using cameras
+        self.replay_path: str | None = None
+        self.replay_pace: ReplayPace = ReplayPace.RECORDED
+
+        # Write frames and detections to disk while processing, one of every
+        # record_every_n frames per camera
+        self.recording: bool = False
+        self.record_every_n: int = 1
+
+        # Only search around the tags found in the last frame, with a full
+        # frame sweep every roi_sweep_interval frames
+        self.roi_tracking: bool = False
+        self.roi_sweep_interval: int = RoiTracker.SWEEP_INTERVAL
+
+        # In TAG_SERVOING, follow tags with optical flow and only detect them
+        # every servo_detection_interval frames
+        self.servo_tracking: bool = False
+        self.servo_detection_interval: int = ServoTracker.DETECTION_INTERVAL
+
+        # Also solve one robot pose from the tags of all POSE_ESTIMATION
+        # cameras, placed on the robot by their extrinsics
+        self.joint_pose: bool = False
+
+        # Refine each POSE_ESTIMATION camera's last pose while it sees the
+        # same tags and resolve single tags by continuity (see PoseTracker)
+        self.pose_tracking: bool = False
+
+        # For cameras using the AprilTag detector, quad_decimate is the
+        # camera's decimation
+        self.apriltag_threads: int = AprilTagDetector.NUM_THREADS
+        self.apriltag_quad_sigma: float = AprilTagDetector.QUAD_SIGMA
+        self.apriltag_bits_corrected: int = AprilTagDetector.BITS_CORRECTED
+        self.apriltag_min_decision_margin: float = (
+            AprilTagDetector.MIN_DECISION_MARGIN
+        )
+
         os.system(
             'nmcli --terse connection show | cut -d : -f 1 | while read name; do echo nmcli connection delete "$name"; done'
         )
@@ -80,6 +129,37 @@ class Data:
                 self.udp_port = config["Port"]
                 self.valid_tags = np.asarray(config["ValidTags"])
                 self.cam_nicknames = config["Nicknames"]
+                # Optional so older configs still load
+                self.use_worker_processes = config.get("WorkerProcesses", False)
+                self.parallel_cameras = config.get("ParallelCameras", True)
+                self.replay_path = config.get("ReplayPath")
+                self.replay_pace = ReplayPace(
+                    config.get("ReplayPace", ReplayPace.RECORDED.value)
+                )
+                self.recording = config.get("Recording", False)
+                self.record_every_n = config.get("RecordEveryN", 1)
+                self.roi_tracking = config.get("RoiTracking", False)
+                self.roi_sweep_interval = config.get(
+                    "RoiSweepInterval", RoiTracker.SWEEP_INTERVAL
+                )
+                self.servo_tracking = config.get("ServoTracking", False)
+                self.servo_detection_interval = config.get(
+                    "ServoDetectionInterval", ServoTracker.DETECTION_INTERVAL
+                )
+                self.joint_pose = config.get("JointPose", False)
+                self.pose_tracking = config.get("PoseTracking", False)
+                self.apriltag_threads = config.get(
+                    "AprilTagThreads", AprilTagDetector.NUM_THREADS
+                )
+                self.apriltag_quad_sigma = config.get(
+                    "AprilTagQuadSigma", AprilTagDetector.QUAD_SIGMA
+                )
+                self.apriltag_bits_corrected = config.get(
+                    "AprilTagBitsCorrected", AprilTagDetector.BITS_CORRECTED
+                )
+                self.apriltag_min_decision_margin = config.get(
+                    "AprilTagMinDecisionMargin", AprilTagDetector.MIN_DECISION_MARGIN
+                )
 
                 self.set_ip(ip)
 
@@ -107,10 +187,53 @@ class Data:
                 "Port": self.udp_port,
                 "ValidTags": self.valid_tags.tolist(),
                 "Nicknames": {},
+                "WorkerProcesses": self.use_worker_processes,
+                "ParallelCameras": self.parallel_cameras,
+                "Recording": self.recording,
+                "RecordEveryN": self.record_every_n,
+                "RoiTracking": self.roi_tracking,
+                "RoiSweepInterval": self.roi_sweep_interval,
+                "ServoTracking": self.servo_tracking,
+                "ServoDetectionInterval": self.servo_detection_interval,
+                "JointPose": self.joint_pose,
+                "PoseTracking": self.pose_tracking,
+                "AprilTagThreads": self.apriltag_threads,
+                "AprilTagQuadSigma": self.apriltag_quad_sigma,
+                "AprilTagBitsCorrected": self.apriltag_bits_corrected,
+                "AprilTagMinDecisionMargin": self.apriltag_min_decision_margin,
             }
             with open(CONFIG_DATA_PATH, "w") as out:
                 json.dump(data_dump, out)
 
+        # Bad AprilTag options would keep the detector from being created,
+        # the defaults are used instead
+        try:
+            options = validate_apriltag_options(self.apriltag_options())
+            self.apriltag_threads = options["num_threads"]
+            self.apriltag_quad_sigma = options["quad_sigma"]
+            self.apriltag_bits_corrected = options["bits_corrected"]
+            self.apriltag_min_decision_margin = options["min_decision_margin"]
+        except ValueError as e:
+            Data.logger.error(f"Ignoring AprilTag options: {e}")
+            self.apriltag_threads = AprilTagDetector.NUM_THREADS
+            self.apriltag_quad_sigma = AprilTagDetector.QUAD_SIGMA
+            self.apriltag_bits_corrected = AprilTagDetector.BITS_CORRECTED
+            self.apriltag_min_decision_margin = AprilTagDetector.MIN_DECISION_MARGIN
+
+        # Environment wins over system settings
+        self.replay_path = os.environ.get(REPLAY_PATH_ENV, self.replay_path)
+        if REPLAY_PACE_ENV in os.environ:
+            self.replay_pace = ReplayPace(os.environ[REPLAY_PACE_ENV])
+
+    # Passed to TagProcessor for AprilTagDetector, checked when loaded
+    def apriltag_options(self) -> dict:
+        return {
+            "num_threads": self.apriltag_threads,
+            "quad_sigma": self.apriltag_quad_sigma,
+            "bits_corrected": self.apriltag_bits_corrected,
+            "min_decision_margin": self.apriltag_min_decision_margin,
+        }
+
     def board_dims(self, new_value: tuple[int, int]):
         self.board_dims = new_value
 
@@ -285,6 +408,10 @@ class Data:
                 identifier: camera_info.export_configs()
                 for identifier, camera_info in self.cameras.info.items()
             },
+            "detectionMasks": {
+                identifier: camera_info.detection_mask
+                for identifier, camera_info in self.cameras.info.items()
+            },
             "cameraConfigOptions": {
                 identifier: camera_info.export_config_options()
                 for identifier, camera_info in self.cameras.info.items()
@@ -25,7 +25,13 @@ class Buffer:
             logger.info("Updated image is NOT none!")
         self.last_none = False
         # img = cv2.resize(img, (img.shape[1] // 2, img.shape[0] // 2))
-        self.output_frame = simplejpeg.encode_jpeg(img, colorspace="bgr")
+        if img.ndim == 2:
+            # Gray capture
+            self.output_frame = simplejpeg.encode_jpeg(
+                img[..., np.newaxis], colorspace="gray", colorsubsampling="gray"
+            )
+        else:
+            self.output_frame = simplejpeg.encode_jpeg(img, colorspace="bgr")
 
     def output(self):
         while True:
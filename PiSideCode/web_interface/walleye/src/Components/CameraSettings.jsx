@@ -6,6 +6,7 @@ import { useState } from "react";
 import Confirm from "./Confirm";
 import DataRangeBox from "./DataRangeBox";
 import OptionMenu from "./OptionMenu";
+import DetectionMaskEditor from "./DetectionMaskEditor";
 
 export default function CameraSettings(props) {
     const [showCalWarning, setShowCalWarning] = useState(false);
@@ -51,6 +52,7 @@ export default function CameraSettings(props) {
                 })
             }
 
+            <DetectionMaskEditor camID={props.camID} state={props.state} />
 
             <br />
             <Form.Label> Import Calibration</Form.Label>
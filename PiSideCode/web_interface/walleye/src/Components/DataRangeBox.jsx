@@ -14,7 +14,7 @@ export default function DataRangeBox(props) {
                 </Col>
                 <Col>
                     <FormRange
-                        step="1"
+                        step={props.step}
                         min={props.min}
                         max={props.max}
                         value={value}
@@ -32,6 +32,7 @@ export default function DataRangeBox(props) {
                 <Col xs={3}>
                     <Form.Control
                         type="number"
+                        step={props.step}
                         value={value}
                         onChange={(e) => {
                             socket.emit(
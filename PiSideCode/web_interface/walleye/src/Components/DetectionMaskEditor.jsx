@@ -0,0 +1,135 @@
+import { Button, ButtonGroup, Card, Form } from "react-bootstrap";
+import { socket } from "../socket";
+import { useState } from "react";
+
+// Click the stream to place points (fractions of the frame), then turn two
+// of them into the crop rectangle or three or more into a polygon to blank
+export default function DetectionMaskEditor(props) {
+    const saved = props.state.detectionMasks[props.camID];
+    const [crop, setCrop] = useState(saved.crop);
+    const [polygons, setPolygons] = useState(saved.polygons);
+    const [points, setPoints] = useState([]);
+
+    function addPoint(e) {
+        const rect = e.currentTarget.getBoundingClientRect();
+        setPoints([
+            ...points,
+            [
+                (e.clientX - rect.left) / rect.width,
+                (e.clientY - rect.top) / rect.height,
+            ],
+        ]);
+    }
+
+    return (
+        <Form.Group className="p-2">
+            <Card.Text>
+                <b>Detection Mask</b>
+            </Card.Text>
+            <div style={{ position: "relative" }} onClick={addPoint}>
+                <img
+                    src={"video_feed/" + props.camID}
+                    alt="Camera stream failed"
+                    style={{ width: "100%", display: "block" }}
+                />
+                <svg
+                    viewBox="0 0 1 1"
+                    preserveAspectRatio="none"
+                    style={{
+                        position: "absolute",
+                        top: 0,
+                        left: 0,
+                        width: "100%",
+                        height: "100%",
+                    }}
+                >
+                    {crop && (
+                        <rect
+                            x={crop[0]}
+                            y={crop[1]}
+                            width={crop[2] - crop[0]}
+                            height={crop[3] - crop[1]}
+                            fill="none"
+                            stroke="magenta"
+                            strokeWidth="2"
+                            vectorEffect="non-scaling-stroke"
+                        />
+                    )}
+                    {polygons.map((polygon) => (
+                        <polygon
+                            points={polygon.map((p) => p.join(",")).join(" ")}
+                            fill="rgba(0, 0, 0, 0.5)"
+                            stroke="magenta"
+                            strokeWidth="2"
+                            vectorEffect="non-scaling-stroke"
+                        />
+                    ))}
+                    {points.length > 1 && (
+                        <polyline
+                            points={points.map((p) => p.join(",")).join(" ")}
+                            fill="none"
+                            stroke="yellow"
+                            strokeWidth="2"
+                            vectorEffect="non-scaling-stroke"
+                        />
+                    )}
+                    {points.map((p) => (
+                        <circle cx={p[0]} cy={p[1]} r="0.008" fill="yellow" />
+                    ))}
+                </svg>
+            </div>
+            <ButtonGroup className="d-flex mt-2">
+                <Button
+                    variant="info"
+                    disabled={points.length !== 2}
+                    onClick={() => {
+                        const [a, b] = points;
+                        setCrop([
+                            Math.min(a[0], b[0]),
+                            Math.min(a[1], b[1]),
+                            Math.max(a[0], b[0]),
+                            Math.max(a[1], b[1]),
+                        ]);
+                        setPoints([]);
+                    }}
+                >
+                    Crop
+                </Button>
+                <Button
+                    variant="info"
+                    disabled={points.length < 3}
+                    onClick={() => {
+                        setPolygons([...polygons, points]);
+                        setPoints([]);
+                    }}
+                >
+                    Blank
+                </Button>
+                <Button variant="secondary" onClick={() => setPoints([])}>
+                    Clear Points
+                </Button>
+                <Button
+                    variant="danger"
+                    onClick={() => {
+                        setCrop(null);
+                        setPolygons([]);
+                        setPoints([]);
+                    }}
+                >
+                    Clear Mask
+                </Button>
+                <Button
+                    variant="success"
+                    onClick={() =>
+                        socket.emit("set_detection_mask", props.camID, {
+                            crop: crop,
+                            polygons: polygons,
+                        })
+                    }
+                >
+                    Save
+                </Button>
+            </ButtonGroup>
+        </Form.Group>
+    );
+}
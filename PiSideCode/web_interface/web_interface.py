@@ -2,13 +2,13 @@ from flask import Response, Flask, send_from_directory
 import os
 from flask_socketio import SocketIO
 import json
+from collections import defaultdict
 from directory import (
     CONFIG_ZIP,
     calibration_path_by_cam,
     cam_config_path,
     CONFIG_DIRECTORY,
     CONFIG_DATA_PATH,
-    TAG_LAYOUT_PATH
 )
 from state import walleye_data, States
 import logging
@@ -19,7 +19,11 @@ import pathlib
 import io
 import glob
 from calibration.calibration import CalibType
-from camera.camera_info import Modes
+from camera.camera_info import Modes, Backends, EXTRINSICS
+from processing.detection_mask import DetectionMask, write_detection_mask
+from processing.tag_detectors import Detectors
+from processing.tag_layout import write_tag_layout
+from publisher.network_table_publisher import NetworkIO
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +36,10 @@ socketio = SocketIO(
     async_mode="eventlet",
 )
 
-cam_buffers = {identifier: Buffer() for identifier in walleye_data.cameras.info.keys()}
+# Cameras plugged in at runtime get a buffer on their first frame
+cam_buffers = defaultdict(
+    Buffer, {identifier: Buffer() for identifier in walleye_data.cameras.info.keys()}
+)
 # visualization_buffers = {
 #     identifier: LivePlotBuffer() for identifier in walleye_data.cameras.info.keys()
 # }
@@ -102,12 +109,46 @@ def set(property: str, cam_id: str, new_value: float | str):
         camera_info.set_color_format(new_value.strip('"'))
     elif property == "frame_rate":
         camera_info.set_frame_rate(int(new_value))
+    elif property == "gray_capture":
+        camera_info.set_gray_capture(json.loads(new_value))
+    elif property == "backend":
+        walleye_data.cameras.set_backend(cam_id, Backends(json.loads(new_value)))
+    elif property == "decimation":
+        camera_info.set_decimation(int(new_value))
+    elif property == "detector":
+        camera_info.detector = Detectors(json.loads(new_value))
+    elif property == "detector_profile":
+        camera_info.set_detector_profile(json.loads(new_value))
+    elif property == "tiles":
+        camera_info.set_tiles(int(new_value))
+    elif property == "guided_search":
+        camera_info.guided_search = json.loads(new_value)
+    elif property in EXTRINSICS:
+        camera_info.set_extrinsic(property, float(new_value))
     else:
         camera_info.set(property, new_value)
 
     walleye_data.cameras.write_configs(cam_id)
 
 
+# mask is a DetectionMask spec in fractions of the frame, {} clears it
+@socketio.on("set_detection_mask")
+@update_after
+def set_detection_mask(cam_id: str, mask: dict):
+    try:
+        mask = DetectionMask.validate(mask)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Invalid detection mask for {cam_id}: {e}")
+        display_info(f"Invalid detection mask: {e}")
+        return
+
+    walleye_data.cameras.info[cam_id].detection_mask = mask
+    write_detection_mask(cam_id, mask)
+
+    logger.info(f"Detection mask set for {cam_id}: {mask}")
+    display_info("Detection mask saved")
+
+
 @socketio.on("toggle_calibration")
 @update_after
 def toggle_calibration(cam_id: str):
@@ -181,8 +222,13 @@ def import_config(file):
 def import_tag_layout(file):
     logger.info("Importing tag layout")
     display_info("Importing tag layout")
-    with open(TAG_LAYOUT_PATH, "w") as f:
-        f.write(file.decode("utf-8"))
+
+    # Pose processors pick the new layout up on their next frame
+    try:
+        write_tag_layout(file.decode("utf-8"))
+    except (json.decoder.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        logger.error(f"Invalid tag layout: {e}")
+        display_info("Invalid tag layout")
 
 @socketio.on("export_config")
 @update_after
@@ -288,7 +334,12 @@ def set_tag_allowed(tag_id: int, allowed: bool):
 def set_cam_nickname(cam_id: str, nickname: str):
     if len(nickname) == 0:
         nickname = cam_id
-    
+
+    # The robot would take it for the joint robot pose
+    if nickname == NetworkIO.ROBOT_POSE_KEY:
+        display_info(f"{nickname} is reserved, pick another name")
+        return
+
     walleye_data.set_nickname(cam_id, nickname)
 
     display_info(f"{cam_id} is now named {nickname}")
@@ -351,7 +402,11 @@ def img_info_update():
 def performance_update():
     socketio.emit(
         "performance_update",
-        {"loopTime": walleye_data.loop_time, "camReadTime": walleye_data.cam_read_delay},
+        {
+            "loopTime": walleye_data.loop_time,
+            "camReadTime": walleye_data.cam_read_delay,
+            "camRecoveryTime": walleye_data.cameras.recovery_time,
+        },
     )
     socketio.sleep(0)
 